@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Startup time budget check.
+
+Imports the entry points the way a short-lived job does, in a fresh
+interpreter with `python -X importtime`, and fails when the import time goes
+over budget or when a heavy dependency is loaded by an operation that
+doesn't need it.
+
+    python benchmarks/import_time.py                # default budget
+    python benchmarks/import_time.py --budget 0.4 --json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies only some operations need (scikit-learn brings SciPy)
+HEAVY = ["sklearn", "scipy", "matplotlib", "PIL"]
+
+# (name, modules imported, heavy modules that must not be loaded)
+SCENARIOS = [
+    ("main", ["main"], HEAVY),
+    ("canny", ["src.cli", "src.canny_edge_detector"], HEAVY),
+    ("sobel", ["src.cli", "src.sobel_edge_detector"], ["sklearn", "scipy", "matplotlib"]),
+    ("colors", ["src.cli", "src.color_extractor"], HEAVY),
+    ("deshade", ["src.cli", "src.remove_shading"], HEAVY),
+    ("scan", ["src.cli", "src.document_scanner"], HEAVY),
+    ("pipeline", ["src.cli", "src.pipeline"], HEAVY),
+    ("video", ["src.cli", "src.video"], HEAVY),
+    ("serve", ["src.cli", "src.server"], HEAVY),
+    ("index", ["src.cli", "src.palette_index"], HEAVY),
+]
+
+
+def parse_importtime(stderr):
+    """Parse `-X importtime` output into {module: (self_us, cumulative_us, depth)}."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def measure(modules):
+    """Import modules in a fresh interpreter, returns (seconds, loaded module names)."""
+    code = "; ".join(f"import {module}" for module in modules)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=REPO_ROOT,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {modules} failed:\n{result.stderr[-2000:]}")
+    timings = parse_importtime(result.stderr)
+    # Top-level entries include the time of everything they imported
+    total_us = sum(cumulative for _, cumulative, depth in timings.values() if depth == 0)
+    return total_us / 1e6, set(timings)
+
+
+def check(budget, repeat):
+    """Run every scenario, keeping the fastest of repeat runs."""
+    results = []
+    for name, modules, forbidden in SCENARIOS:
+        seconds, loaded = min((measure(modules) for _ in range(repeat)), key=lambda run: run[0])
+        leaked = sorted(module for module in forbidden
+                        if any(m == module or m.startswith(module + ".") for m in loaded))
+        results.append({"scenario": name, "seconds": seconds, "budget": budget, "leaked": leaked,
+                        "ok": seconds <= budget and not leaked})
+    return results
+
+
+def main(argv=None):
+    """Parse arguments, run the check and print the results."""
+    parser = argparse.ArgumentParser(description="Check the import time budget of the entry points")
+    parser.add_argument("--budget", type=float, default=0.5,
+                        help="Maximum import time per scenario in seconds (default 0.5)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per scenario, the fastest counts (default 3)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = check(args.budget, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            status = "ok" if result["ok"] else "FAIL"
+            leaked = f"  loads {', '.join(result['leaked'])}" if result["leaked"] else ""
+            print(f"{status:4} {result['scenario']:8} {result['seconds'] * 1000:7.1f} ms"
+                  f" (budget {args.budget * 1000:.0f} ms){leaked}")
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the five operations.
+
+Runs Canny, Sobel, color extraction, shading removal and the perspective
+warp on deterministic synthetic images (0.25 to 50 MP by default) and on the
+images in samples/. Every case runs in its own interpreter so its peak RSS
+is measured on its own; decoding and image generation are not timed.
+
+    python benchmarks/run_benchmarks.py -o results.json
+    python benchmarks/run_benchmarks.py --sizes 0.25 1 --ops canny sobel
+    python benchmarks/run_benchmarks.py --baseline baseline.json --threshold 0.15
+
+With --baseline the results are compared case by case and the exit status
+is 1 when any case got slower than the baseline by more than --threshold.
+Everything runs offline.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+OPERATIONS = ["canny", "sobel", "colors", "deshade", "warp"]
+DEFAULT_SIZES = [0.25, 1, 4, 12, 50]
+
+
+def synthetic_image(megapixels, seed=0):
+    """
+    Build a deterministic 4:3 BGR test image of about the given size.
+
+    A bright tilted "page" with colored shapes and text-like strokes sits on
+    a shaded background, with mild noise, so every operation has real edges,
+    colors and a document outline to work on.
+
+    Returns:
+        Tuple of (image, corners) with the page corners in tl, tr, br, bl order
+    """
+    import cv2
+    import numpy as np
+
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = int(round(width * 3 / 4))
+    rng = np.random.default_rng(seed)
+
+    # Shaded background, darker towards the bottom right. Built in bands so
+    # generating a large image doesn't inflate the case's peak RSS
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    for start in range(0, height, 1024):
+        y = np.linspace(start, min(start + 1024, height) - 1, min(1024, height - start),
+                        dtype=np.float32)[:, None] / max(height - 1, 1)
+        image[start:start + 1024] = (90 - 50 * (x + y) / 2).astype(np.uint8)[:, :, None]
+
+    corners = np.array([[0.12 * width, 0.10 * height], [0.86 * width, 0.14 * height],
+                        [0.90 * width, 0.92 * height], [0.08 * width, 0.88 * height]], dtype=np.float32)
+    cv2.fillConvexPoly(image, corners.astype(np.int32), (235, 240, 245))
+
+    # Colored blocks and dark strokes inside the page
+    scale = width / 1000
+    for _ in range(12):
+        cx, cy = rng.uniform(0.2, 0.8) * width, rng.uniform(0.2, 0.8) * height
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            cv2.circle(image, (int(cx), int(cy)), int(rng.uniform(10, 60) * scale), color, -1)
+        else:
+            size = rng.uniform(20, 90, 2) * scale
+            cv2.rectangle(image, (int(cx), int(cy)), (int(cx + size[0]), int(cy + size[1])), color, -1)
+    for row in np.linspace(0.25, 0.8, 20):
+        start = int(0.2 * width + rng.uniform(0, 0.1) * width)
+        stop = int(start + rng.uniform(0.3, 0.5) * width)
+        cv2.line(image, (start, int(row * height)), (stop, int(row * height)), (30, 30, 30),
+                 max(1, int(2 * scale)))
+
+    for start in range(0, height, 1024):
+        band = image[start:start + 1024]
+        noise = rng.integers(-6, 7, size=band.shape, dtype=np.int16)
+        band[...] = np.clip(band + noise, 0, 255)
+    return image, corners
+
+
+def operation(name, corners, colors_method):
+    """Function running one operation on a BGR image"""
+    if name == "canny":
+        from src.canny_edge_detector import detect_edges_canny_from_array
+        return lambda image: detect_edges_canny_from_array(image, 100, 200)
+    if name == "sobel":
+        from src.sobel_edge_detector import detect_edges_sobel_from_array
+        return detect_edges_sobel_from_array
+    if name == "colors":
+        from src.color_extractor import extract_bright_colorful_colors_from_array
+        return lambda image: extract_bright_colorful_colors_from_array(image, 8, method=colors_method)
+    if name == "deshade":
+        from src.remove_shading import remove_shading_and_keep_colors_from_array
+        return lambda image: remove_shading_and_keep_colors_from_array(
+            image, 8, 150, fit_masked_only=True, max_samples=100000)
+    if name == "warp":
+        from src.document_scanner import four_point_transform
+        return lambda image: four_point_transform(image, corners)
+    raise ValueError(f"unknown operation {name!r}")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, None where unsupported"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(op, image_name, repeat, colors_method):
+    """Run one case in this process and return its result record"""
+    import numpy as np
+
+    if image_name.startswith("synthetic:"):
+        megapixels = float(image_name.split(":", 1)[1])
+        image, corners = synthetic_image(megapixels)
+    else:
+        from src.image_io import as_bgr
+        image = as_bgr(image_name)
+        h, w = image.shape[:2]
+        corners = np.array([[0.1 * w, 0.1 * h], [0.9 * w, 0.1 * h], [0.9 * w, 0.9 * h], [0.1 * w, 0.9 * h]],
+                           dtype=np.float32)
+
+    func = operation(op, corners, colors_method)
+    base_rss = peak_rss_mb()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(image)
+        times.append(time.perf_counter() - start)
+
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    best = min(times)
+    return {"op": op, "image": image_name, "width": image.shape[1], "height": image.shape[0],
+            "megapixels": round(megapixels, 3), "seconds": best, "runs": times,
+            "mp_per_s": megapixels / best if best > 0 else None,
+            "peak_rss_mb": peak_rss_mb(), "input_rss_mb": base_rss}
+
+
+def run_isolated(op, image_name, repeat, colors_method, timeout):
+    """Run one case in a fresh interpreter so peak RSS belongs to that case alone"""
+    command = [sys.executable, os.path.abspath(__file__), "--child", op, image_name,
+               "--repeat", str(repeat), "--colors-method", colors_method]
+    try:
+        result = subprocess.run(command, cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"op": op, "image": image_name, "error": f"timed out after {timeout}s"}
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        # A child killed by the OOM killer or a signal leaves no traceback
+        errors = result.stderr.strip().splitlines()
+        if errors:
+            error = errors[-1]
+        elif result.returncode < 0:
+            error = f"killed by signal {-result.returncode}"
+        else:
+            error = f"exited with status {result.returncode} without output"
+        return {"op": op, "image": image_name, "error": error}
+    return json.loads(lines[-1])
+
+
+def environment():
+    """Versions and machine details stored with the results"""
+    import cv2
+    import numpy as np
+    return {"python": platform.python_version(), "numpy": np.__version__, "opencv": cv2.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results against a baseline run.
+
+    Returns:
+        List of (result, baseline seconds, relative change, regressed) for the
+        cases present in both runs. A case that ran in the baseline but now
+        fails (error, timeout, killed) is a regression with a change of None.
+    """
+    previous = {(r["op"], r["image"]): r for r in baseline["results"] if "seconds" in r}
+    rows = []
+    for result in results:
+        old = previous.get((result["op"], result["image"]))
+        if old is None:
+            continue
+        if "seconds" not in result:
+            rows.append((result, old["seconds"], None, True))
+            continue
+        change = result["seconds"] / old["seconds"] - 1
+        rows.append((result, old["seconds"], change, change > threshold))
+    return rows
+
+
+def print_results(results, comparison):
+    """Print one line per case, with the change against the baseline if any"""
+    changes = {(r["op"], r["image"]): (change, regressed) for r, _, change, regressed in comparison}
+    print(f"{'op':8} {'image':28} {'MP':>7} {'seconds':>9} {'MP/s':>8} {'peak MB':>8}")
+    for r in results:
+        if "error" in r:
+            regressed = changes.get((r["op"], r["image"]), (None, False))[1]
+            print(f"{r['op']:8} {r['image']:28} error: {r['error']}{'  REGRESSION' if regressed else ''}")
+            continue
+        line = (f"{r['op']:8} {r['image']:28} {r['megapixels']:7.2f} {r['seconds']:9.3f} "
+                f"{r['mp_per_s']:8.2f} {r['peak_rss_mb'] or 0:8.0f}")
+        change = changes.get((r["op"], r["image"]))
+        if change:
+            line += f"  {change[0]:+.1%}{'  REGRESSION' if change[1] else ''}"
+        print(line)
+
+
+def main(argv=None):
+    """Parse arguments, run the cases and write the results."""
+    parser = argparse.ArgumentParser(description="Benchmark the image operations")
+    parser.add_argument("--ops", nargs="+", choices=OPERATIONS, default=OPERATIONS,
+                        help="Operations to run (default: all)")
+    parser.add_argument("--sizes", nargs="+", type=float, default=DEFAULT_SIZES,
+                        help="Synthetic image sizes in megapixels (default: 0.25 1 4 12 50)")
+    parser.add_argument("--no-samples", action="store_true", help="Skip the images in samples/")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case, the fastest counts")
+    parser.add_argument("--colors-method", choices=["exact", "histogram", "sample"], default="histogram",
+                        help="Color extraction method (default histogram, exact is very slow on large images)")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds before a case is abandoned")
+    parser.add_argument("-o", "--output", default="benchmarks/results.json", help="Results JSON file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown counted as a regression (default 0.10)")
+    parser.add_argument("--child", nargs=2, metavar=("OP", "IMAGE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_case(args.child[0], args.child[1], args.repeat, args.colors_method)))
+        return 0
+
+    images = [f"synthetic:{size:g}" for size in args.sizes]
+    if not args.no_samples:
+        images += sorted(os.path.relpath(path, REPO_ROOT)
+                         for path in glob.glob(os.path.join(REPO_ROOT, "samples", "*")))
+
+    results = []
+    for image_name in images:
+        for op in args.ops:
+            results.append(run_isolated(op, image_name, args.repeat, args.colors_method, args.timeout))
+
+    comparison = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            comparison = compare(results, json.load(f), args.threshold)
+    print_results(results, comparison)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "repeat": args.repeat, "results": results}, f, indent=2)
+    print(f"Results saved to: {args.output}")
+
+    regressions = [r for r, _, _, regressed in comparison if regressed]
+    if regressions:
+        print(f"{len(regressions)} case(s) failed or slower than the baseline by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
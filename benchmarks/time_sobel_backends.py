@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Sobel backend timings.
+
+Times every convolution backend (except the pure-Python reference) with
+every kernel size and accumulator on a synthetic image. Equivalence with the
+reference is checked by tests/test_sobel_backends.py.
+
+    python benchmarks/time_sobel_backends.py
+    python benchmarks/time_sobel_backends.py --size 1080 1920 --json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def time_backends(shape, repeat):
+    """Fastest of repeat runs of every backend but the reference, per kernel size and accumulator."""
+    from src.sobel_backends import ACCUMULATORS, BACKENDS, KERNEL_SIZES, check_options, sobel_edges, synthetic_image
+
+    gray = synthetic_image(shape)
+    timings = []
+    for ksize in KERNEL_SIZES:
+        for accumulator in ACCUMULATORS:
+            try:
+                check_options(ksize, accumulator)
+            except ValueError:
+                continue
+            for name in BACKENDS:
+                if name == "python":
+                    continue
+                runs = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    sobel_edges(gray, name, ksize, accumulator)
+                    runs.append(time.perf_counter() - start)
+                timings.append({"backend": name, "ksize": ksize, "accumulator": accumulator,
+                                "seconds": min(runs)})
+    return timings
+
+
+def main(argv=None):
+    """Parse arguments, time the backends and print the results."""
+    parser = argparse.ArgumentParser(description="Time the Sobel backends")
+    parser.add_argument("--size", nargs=2, type=int, default=[720, 960], metavar=("HEIGHT", "WIDTH"),
+                        help="Image size (default 720 960)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case, the fastest counts")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    timings = time_backends(tuple(args.size), args.repeat)
+    if args.json:
+        print(json.dumps({"timings": timings}, indent=2))
+    else:
+        for timing in timings:
+            print(f"{timing['backend']:10} {timing['ksize']}x{timing['ksize']} {timing['accumulator']:8}"
+                  f" {timing['seconds'] * 1000:8.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
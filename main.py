@@ -2,24 +2,31 @@
 """
 Edge Detector - Main Program
 A simple program to use various image processing functions.
+Run without arguments for the interactive menu, or see `python main.py -h`.
 """
 
 import os
 import sys
-import cv2
-from src.canny_edge_detector import detect_edges_canny, display_edges
-from src.sobel_edge_detector import detect_edges_sobel
-from src.color_extractor import extract_bright_colorful_colors
-from src.remove_shading import remove_shading_and_keep_colors
-from src.document_scanner import detect_document
+import time
+from src.image_io import LoadedImage, load_image, probe_image, preview_image
+from src.image_writer import ImageWriter, write_image
+
+# The operation modules are imported inside their menu handlers, so the
+# command line and each option only load the dependencies they use
 
 
 def validate_image(image_path):
-    """Validate that an image can be read by cv2."""
-    img = cv2.imread(image_path)
+    """Validate that an image can be read, from its header when possible."""
+    info = probe_image(image_path)
+    if info is not None:
+        return True, info
+
+    # Formats PIL doesn't recognize still get a full decode with cv2
+    img = load_image(image_path)
     if img is None:
         return False, None
-    return True, img
+    return True, {"width": img.shape[1], "height": img.shape[0],
+                  "format": os.path.splitext(image_path)[1].lstrip(".").upper()}
 
 
 def print_menu():
@@ -37,15 +44,15 @@ def print_menu():
 
 
 def get_image_path():
-    """Get image path from user with validation."""
+    """Get image path from user with validation, returns the image (decoded on first use)."""
     while True:
         path = input("Enter image path: ").strip()
         if not os.path.exists(path):
             print(f"✗ File not found: '{path}'")
             continue
         
-        # Try to load the image with cv2 to verify it's a valid image
-        is_valid, img = validate_image(path)
+        # Check the image header to verify it's a valid image
+        is_valid, info = validate_image(path)
         if not is_valid:
             print(f"✗ Cannot read image: '{path}'")
             print("  - File may be corrupted")
@@ -53,8 +60,8 @@ def get_image_path():
             print("  - Check file permissions")
             continue
         
-        print(f"✓ Image loaded successfully ({img.shape[1]}x{img.shape[0]} pixels)")
-        return path
+        print(f"✓ Image found ({info['width']}x{info['height']} pixels, {info['format']})")
+        return LoadedImage(path=path)
 
 
 def get_output_path(default_name):
@@ -68,10 +75,32 @@ def get_output_path(default_name):
     return path
 
 
+def get_preview_path(output_path):
+    """Output path of a preview, next to the full-resolution output."""
+    stem, extension = os.path.splitext(output_path)
+    return f"{stem}_preview{extension}"
+
+
+def run_preview(image, run):
+    """Offer a quick low-res pass first, returns whether to continue at full resolution."""
+    answer = input("Run a quick low-res preview first? (y/n): ").strip().lower()
+    if answer != 'y':
+        return True
+
+    start = time.perf_counter()
+    preview = preview_image(image.path)
+    run(preview)
+    print(f"✓ Preview at 1/{preview.reduce} resolution ({preview.shape[1]}x{preview.shape[0]} pixels) "
+          f"took {time.perf_counter() - start:.2f}s")
+    return input("Continue at full resolution? (y/n): ").strip().lower() == 'y'
+
+
 def option_canny():
     """Handle Canny edge detection."""
+    from src.canny_edge_detector import detect_edges_canny_from_array, display_edges
+
     print("\n--- Canny Edge Detection ---")
-    input_path = get_image_path()
+    image = get_image_path()
     output_path = get_output_path("canny_edges.png")
     low_threshold = input("Enter low threshold (default 100): ").strip()
     high_threshold = input("Enter high threshold (default 200): ").strip()
@@ -80,18 +109,21 @@ def option_canny():
     high_threshold = int(high_threshold) if high_threshold else 200
     
     try:
-        # Verify image can be read before processing
-        is_valid, img = validate_image(input_path)
-        if not is_valid:
-            print(f"✗ Cannot process image: {input_path}")
+        def preview(small):
+            edges = detect_edges_canny_from_array(small, low_threshold, high_threshold)
+            write_image(get_preview_path(output_path), edges)
+            print(f"  Preview saved to: {get_preview_path(output_path)}")
+
+        if not run_preview(image, preview):
             return
-        
-        detect_edges_canny(input_path, output_path, low_threshold, high_threshold)
+
+        edges = detect_edges_canny_from_array(image, low_threshold, high_threshold)
+        write_image(output_path, edges)
         print(f"✓ Edge detection complete! Saved to: {output_path}")
         
         show_display = input("Display result? (y/n): ").strip().lower()
         if show_display == 'y':
-            display_edges(input_path, output_path, show_plot=True)
+            display_edges(image, show_plot=True, edges=edges)
     except AssertionError as e:
         print(f"✗ Error: {e}")
     except Exception as e:
@@ -100,39 +132,50 @@ def option_canny():
 
 def option_sobel():
     """Handle Sobel edge detection."""
+    from src.sobel_edge_detector import detect_edges_sobel
+
     print("\n--- Sobel Edge Detection ---")
-    input_path = get_image_path()
+    image = get_image_path()
     output_path = get_output_path("sobel_edges.png")
+    save_steps = input("Save intermediate steps to output/? (y/n): ").strip().lower() == 'y'
     
     try:
-        # Verify image can be read before processing
-        is_valid, img = validate_image(input_path)
-        if not is_valid:
-            print(f"✗ Cannot process image: {input_path}")
+        def preview(small):
+            detect_edges_sobel(small, get_preview_path(output_path))
+            print(f"  Preview saved to: {get_preview_path(output_path)}")
+
+        if not run_preview(image, preview):
             return
-        
-        detect_edges_sobel(input_path, output_path)
-        print(f"✓ Sobel edge detection complete!")
-        print("  Output files saved in output/ directory")
+
+        # Encode the step images in the background while the output is computed
+        with ImageWriter() as writer:
+            detect_edges_sobel(image, output_path, steps_dir="output" if save_steps else None,
+                               writer=writer)
+        print(f"✓ Sobel edge detection complete! Saved to: {output_path}")
+        if save_steps:
+            print("  Intermediate steps saved in output/ directory")
     except Exception as e:
         print(f"✗ Error: {type(e).__name__}: {e}")
 
 
 def option_color_extract():
     """Handle color extraction."""
+    from src.color_extractor import extract_bright_colorful_colors_from_array
+
     print("\n--- Extract Bright & Colorful Colors ---")
-    input_path = get_image_path()
+    image = get_image_path()
     num_colors = input("Enter number of colors to extract (default 8): ").strip()
     num_colors = int(num_colors) if num_colors else 8
     
     try:
-        # Verify image can be read before processing
-        is_valid, img = validate_image(input_path)
-        if not is_valid:
-            print(f"✗ Cannot process image: {input_path}")
+        def preview(small):
+            colors = extract_bright_colorful_colors_from_array(small, num_colors=num_colors)
+            print(f"  Preview colors (RGB): {colors}")
+
+        if not run_preview(image, preview):
             return
-        
-        colors = extract_bright_colorful_colors(input_path, num_colors=num_colors)
+
+        colors = extract_bright_colorful_colors_from_array(image, num_colors=num_colors)
         print(f"✓ Extracted {len(colors)} colors!")
         print(f"Colors (RGB): {colors}")
     except Exception as e:
@@ -141,8 +184,10 @@ def option_color_extract():
 
 def option_remove_shading():
     """Handle shading removal."""
+    from src.remove_shading import remove_shading_and_keep_colors_from_array
+
     print("\n--- Remove Shading from Image ---")
-    input_path = get_image_path()
+    image = get_image_path()
     output_path = get_output_path("no_shading.jpg")
     num_colors = input("Enter number of colors (default 8): ").strip()
     brightness = input("Enter brightness threshold (default 150): ").strip()
@@ -151,13 +196,16 @@ def option_remove_shading():
     brightness = int(brightness) if brightness else 150
     
     try:
-        # Verify image can be read before processing
-        is_valid, img = validate_image(input_path)
-        if not is_valid:
-            print(f"✗ Cannot process image: {input_path}")
+        def preview(small):
+            segmented = remove_shading_and_keep_colors_from_array(small, num_colors, brightness)
+            write_image(get_preview_path(output_path), segmented)
+            print(f"  Preview saved to: {get_preview_path(output_path)}")
+
+        if not run_preview(image, preview):
             return
-        
-        remove_shading_and_keep_colors(input_path, output_path, num_colors, brightness)
+
+        segmented = remove_shading_and_keep_colors_from_array(image, num_colors, brightness)
+        write_image(output_path, segmented)
         print(f"✓ Shading removed! Saved to: {output_path}")
     except Exception as e:
         print(f"✗ Error: {type(e).__name__}: {e}")
@@ -165,19 +213,15 @@ def option_remove_shading():
 
 def option_document_scan():
     """Handle document scanning."""
+    from src.document_scanner import detect_document
+
     print("\n--- Document Scanner ---")
-    input_path = get_image_path()
+    image = get_image_path()
     
     try:
-        # Verify image can be read before processing
-        is_valid, img = validate_image(input_path)
-        if not is_valid:
-            print(f"✗ Cannot process image: {input_path}")
-            return
-        
         print("Instructions: Click on 4 corners of the document to scan it.")
         print("Points should be selected in order: top-left, top-right, bottom-right, bottom-left")
-        detect_document(input_path)
+        detect_document(image)
         print("✓ Document scanning complete! Saved to: output/transformed_image.png")
     except Exception as e:
         print(f"✗ Error: {type(e).__name__}: {e}")
@@ -209,4 +253,7 @@ def main():
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        from src.cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
     main()
@@ -0,0 +1,116 @@
+import os
+import glob
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp", ".ppm", ".pgm")
+
+def expand_inputs(patterns, recursive=False):
+    """
+    Expand files, directories and glob patterns into a list of image paths.
+
+    Matches of each pattern are sorted and duplicates are dropped, so the
+    same arguments always give the same list in the same order.
+
+    Args:
+        patterns: File paths, directory paths or glob patterns
+        recursive: Whether to descend into subdirectories of directories
+
+    Returns:
+        List of image file paths
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            if recursive:
+                matches = [os.path.join(root, name)
+                           for root, _, names in os.walk(pattern) for name in names]
+            else:
+                matches = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+            matches = [path for path in matches
+                       if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)]
+        elif os.path.isfile(pattern):
+            matches = [pattern]
+        else:
+            matches = [path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)]
+        paths.extend(sorted(matches))
+
+    seen = set()
+    unique = []
+    for path in paths:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+def output_paths(inputs, output_dir, suffix, extension):
+    """
+    Map input paths to output paths below output_dir.
+
+    The layout relative to the inputs' common directory is kept, so files
+    with the same name in different folders don't overwrite each other.
+    """
+    if not inputs:
+        return []
+    absolute = [os.path.abspath(path) for path in inputs]
+    base = os.path.commonpath([os.path.dirname(path) for path in absolute])
+    outputs = []
+    for path in absolute:
+        stem = os.path.splitext(os.path.relpath(path, base))[0]
+        outputs.append(os.path.join(output_dir, stem + suffix + extension))
+    return outputs
+
+def run_batch(func, tasks, workers=None, max_in_flight=None, use_threads=False):
+    """
+    Run func over tasks on a worker pool, yielding results in task order.
+
+    At most max_in_flight tasks are submitted at a time, so memory stays flat
+    however many tasks there are. A failing task doesn't stop the batch; its
+    exception is yielded instead of a result.
+
+    Args:
+        func: Picklable function taking one task
+        tasks: Iterable of tasks
+        workers: Pool size (default: number of CPUs)
+        max_in_flight: Maximum number of submitted tasks (default: 2 * workers)
+        use_threads: Use a thread pool instead of a process pool
+
+    Yields:
+        Tuples of (task, result, error) with either result or error set
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max(max_in_flight or 2 * workers, 1)
+    pool = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+
+    with pool(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append((task, executor.submit(func, task)))
+            if len(pending) >= max_in_flight:
+                yield _collect(*pending.popleft())
+        while pending:
+            yield _collect(*pending.popleft())
+
+def _collect(task, future):
+    """Wait for a future and return (task, result, error)"""
+    try:
+        return task, future.result(), None
+    except Exception as e:
+        return task, None, e
+
+def batch_report(processed, failed, seconds):
+    """
+    Summarize a batch run.
+
+    Args:
+        processed: Number of files that succeeded
+        failed: List of (path, error message) for files that failed
+        seconds: Wall time of the batch
+
+    Returns:
+        Dictionary with counts, failures and images per second
+    """
+    total = processed + len(failed)
+    return {"processed": processed, "failed": failed, "seconds": seconds,
+            "images_per_sec": total / seconds if seconds > 0 else 0.0}
@@ -0,0 +1,265 @@
+"""
+Content-addressed on-disk cache for operation results.
+
+Entries are keyed by a hash of the input file's content, the operation name,
+its parameters and the library versions, so editing an image, changing a
+parameter or upgrading OpenCV/NumPy/scikit-learn never returns a stale
+result. Arrays are stored as .npy, bytes as-is and everything else as JSON.
+
+Writes go to a temporary file that is renamed into place, so concurrent
+workers never see a partial entry. Temporary files count towards the size,
+and those older than STALE_TEMP_SECONDS (left by a killed writer) are
+deleted when the directory is walked. Reading an entry refreshes its
+modification time, and when the cache grows past max_bytes the least
+recently used entries are deleted.
+
+Each process keeps a running total of the cache's size, so a put doesn't
+walk the directory: only when the total goes over max_bytes, or when it is
+older than rescan_interval (other processes write to the same directory).
+Eviction then goes down to EVICT_TO of max_bytes, so the next walks are
+far apart.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+
+# Bump when an operation's output changes, to invalidate old entries
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.environ.get("IMAGE_PROCESSING_CACHE",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "image-processing"))
+
+_EXTENSIONS = (".npy", ".bin", ".json")
+
+# Fraction of max_bytes left after an eviction
+EVICT_TO = 0.9
+
+# Age after which a temporary file can't belong to a running write
+STALE_TEMP_SECONDS = 3600
+
+# Size of each cache directory known to this process: {directory: [bytes,
+# time of the last walk]}, shared by all its ResultCache objects
+_totals = {}
+_totals_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _library_versions():
+    """Versions of the libraries the results depend on"""
+    import cv2
+    try:
+        from importlib.metadata import version
+        sklearn_version = version("scikit-learn")
+    except Exception:
+        sklearn_version = "unknown"
+    return {"cache": CACHE_VERSION, "opencv": cv2.__version__, "numpy": np.__version__,
+            "scikit-learn": sklearn_version}
+
+def file_hash(path, block_size=1 << 20):
+    """BLAKE2b digest of a file's content, read in blocks"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_key(operation, content_hash, params):
+    """
+    Key of one result.
+
+    Args:
+        operation: Operation name
+        content_hash: Hash of the input, e.g. from file_hash
+        params: JSON-serializable dictionary of the parameters that affect
+            the result
+
+    Returns:
+        Hex digest string
+    """
+    description = json.dumps({"operation": operation, "input": content_hash, "params": params,
+                              "versions": _library_versions()}, sort_keys=True, default=str)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of operation results in a directory.
+
+    Args:
+        directory: Cache directory, created when needed
+        max_bytes: Total size above which old entries are evicted
+        rescan_interval: Seconds after which the size is measured again
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=1 << 30, rescan_interval=60.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def get(self, key):
+        """Cached value for key, or None on a miss"""
+        for extension in _EXTENSIONS:
+            path = self._path(key, extension)
+            try:
+                if extension == ".npy":
+                    value = np.load(path)
+                elif extension == ".bin":
+                    with open(path, "rb") as f:
+                        value = f.read()
+                else:
+                    with open(path) as f:
+                        value = json.load(f)
+            except (FileNotFoundError, ValueError, OSError):
+                continue
+            try:
+                # Mark as recently used for the LRU eviction
+                os.utime(path)
+            except OSError:
+                pass
+            return value
+        return None
+
+    def put(self, key, value):
+        """Store a value (numpy array, bytes or JSON-serializable data) atomically"""
+        if isinstance(value, np.ndarray):
+            extension = ".npy"
+        elif isinstance(value, (bytes, bytearray)):
+            extension = ".bin"
+        else:
+            extension = ".json"
+        path = self._path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if extension == ".npy":
+                    np.save(f, value)
+                elif extension == ".bin":
+                    f.write(value)
+                else:
+                    f.write(json.dumps(value).encode())
+                size = f.tell()
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self._grow(size - replaced)
+
+    def _grow(self, delta):
+        """Add to the running size, and evict when it may be over max_bytes or is stale"""
+        with _totals_lock:
+            state = _totals.get(os.path.abspath(self.directory))
+            if state is not None:
+                state[0] += delta
+        if (state is None or state[0] > self.max_bytes
+                or time.monotonic() - state[1] > self.rescan_interval):
+            self.evict()
+
+    def _set_total(self, total):
+        with _totals_lock:
+            _totals[os.path.abspath(self.directory)] = [total, time.monotonic()]
+
+    def _entries(self):
+        """
+        Walk the cache, deleting stale temporary files.
+
+        Returns:
+            Tuple of ((mtime, size, path) of every entry, bytes of the
+            temporary files still being written)
+        """
+        entries = []
+        temp_bytes = 0
+        if not os.path.isdir(self.directory):
+            return entries, temp_bytes
+        stale = time.time() - STALE_TEMP_SECONDS
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(_EXTENSIONS + (".tmp",)):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if not name.endswith(".tmp"):
+                        entries.append((stat.st_mtime, stat.st_size, path))
+                    elif stat.st_mtime < stale:
+                        os.remove(path)
+                    else:
+                        temp_bytes += stat.st_size
+                except OSError:
+                    continue
+        return entries, temp_bytes
+
+    def size(self):
+        """Total size of the entries and temporary files in bytes"""
+        entries, temp_bytes = self._entries()
+        return sum(size for _, size, _ in entries) + temp_bytes
+
+    def evict(self):
+        """Delete the least recently used entries when the cache is over max_bytes, down to EVICT_TO of it"""
+        entries, temp_bytes = self._entries()
+        entries.sort()
+        total = sum(size for _, size, _ in entries) + temp_bytes
+        if total > self.max_bytes:
+            for _, size, path in entries:
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Already evicted by another worker
+                    pass
+                total -= size
+        self._set_total(total)
+
+    def clear(self):
+        """Delete every entry"""
+        entries, temp_bytes = self._entries()
+        for _, _, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._set_total(temp_bytes)
+
+def cached(cache, operation, input_path, params, compute):
+    """
+    Return a cached result, or compute and store it.
+
+    Args:
+        cache: ResultCache, or None to always compute
+        operation: Operation name
+        input_path: Path of the input image, hashed by content
+        params: Dictionary of the parameters that affect the result
+        compute: Function without arguments computing the result; None and
+            empty results aren't stored
+
+    Returns:
+        The result
+    """
+    if cache is None:
+        return compute()
+    key = cache_key(operation, file_hash(input_path), params)
+    value = cache.get(key)
+    if value is not None:
+        return value
+    value = compute()
+    if value is not None and len(value):
+        cache.put(key, value)
+    return value
@@ -1,8 +1,33 @@
+import os
+import time
 import numpy as np
 import cv2
-from matplotlib import pyplot as plt
+from src.tiling import (open_image_source, iter_bands, process_bands,
+                        open_band_output, close_band_output)
+from src.batch import expand_inputs, output_paths, run_batch, batch_report
+from src.image_io import as_gray
+from src.instrument import operation, stage
+from src.image_writer import write_image
 
-def detect_edges_canny(input_path, output_path=None, low_threshold=100, high_threshold=200):
+@operation("canny")
+def detect_edges_canny_from_array(img, low_threshold=100, high_threshold=200):
+    """
+    Detect edges using Canny edge detection on an in-memory image.
+
+    Args:
+        img: Grayscale or BGR numpy array, or LoadedImage (reuses its grayscale)
+        low_threshold: Lower threshold for Canny edge detection
+        high_threshold: Upper threshold for Canny edge detection
+
+    Returns:
+        Detected edges as numpy array
+    """
+    gray = as_gray(img)
+    with stage("edges"):
+        return cv2.Canny(gray, low_threshold, high_threshold)
+
+@operation("canny")
+def detect_edges_canny(input_path, output_path=None, low_threshold=100, high_threshold=200, writer=None):
     """
     Detect edges using Canny edge detection algorithm.
     
@@ -11,33 +36,121 @@ def detect_edges_canny(input_path, output_path=None, low_threshold=100, high_thr
         output_path: Path to save output image (optional)
         low_threshold: Lower threshold for Canny edge detection
         high_threshold: Upper threshold for Canny edge detection
+        writer: Optional ImageWriter saving the output in the background
     
     Returns:
         Detected edges as numpy array
     """
-    img = cv2.imread(input_path, cv2.IMREAD_GRAYSCALE)
-    assert img is not None, "file could not be read, check with os.path.exists()"
-    
-    edges = cv2.Canny(img, low_threshold, high_threshold)
+    img = as_gray(input_path)
+    edges = detect_edges_canny_from_array(img, low_threshold, high_threshold)
     
     if output_path:
-        cv2.imwrite(output_path, edges)
+        write_image(output_path, edges, writer)
     
     return edges
 
-def display_edges(input_path, output_path=None, show_plot=False):
+def canny_gradients(image):
+    """
+    Compute the Sobel gradients cv2.Canny would compute internally.
+
+    Passing them to cv2.Canny(dx, dy, low, high) gives the same edges as
+    cv2.Canny(image, low, high) without redoing the gradient.
+
+    Args:
+        image: Path to input image, numpy array or LoadedImage
+
+    Returns:
+        Tuple of (dx, dy) int16 arrays
+    """
+    img = as_gray(image)
+    dx = cv2.Sobel(img, cv2.CV_16S, 1, 0, ksize=3, borderType=cv2.BORDER_REPLICATE)
+    dy = cv2.Sobel(img, cv2.CV_16S, 0, 1, ksize=3, borderType=cv2.BORDER_REPLICATE)
+    return dx, dy
+
+def canny_threshold_sweep(image, threshold_pairs, gradients=None):
+    """
+    Run Canny for many threshold pairs, computing the gradient only once.
+
+    Args:
+        image: Path to input image, numpy array or LoadedImage
+        threshold_pairs: List of (low_threshold, high_threshold)
+        gradients: Optional (dx, dy) from canny_gradients to reuse
+
+    Returns:
+        uint8 array of shape (len(threshold_pairs), height, width)
+    """
+    dx, dy = gradients if gradients is not None else canny_gradients(image)
+    edges = np.empty((len(threshold_pairs),) + dx.shape, dtype=np.uint8)
+    for i, (low_threshold, high_threshold) in enumerate(threshold_pairs):
+        edges[i] = cv2.Canny(dx, dy, low_threshold, high_threshold)
+    return edges
+
+def auto_canny_thresholds(image, sigma=0.33):
+    """
+    Pick Canny thresholds from the median intensity of the image.
+
+    The thresholds are placed sigma below and above the median, which works
+    well on most photos without tuning.
+
+    Args:
+        image: Path to input image, numpy array or LoadedImage
+        sigma: Relative spread of the thresholds around the median
+
+    Returns:
+        Tuple of (low_threshold, high_threshold)
+    """
+    median = float(np.median(as_gray(image)))
+    low_threshold = int(max(0, (1.0 - sigma) * median))
+    high_threshold = int(min(255, (1.0 + sigma) * median))
+    return low_threshold, high_threshold
+
+def auto_canny(image, sigma=0.33, threshold_pairs=None):
+    """
+    Detect edges with thresholds chosen by the median heuristic.
+
+    Without threshold_pairs the median-based pair is used directly. With
+    threshold_pairs the pair closest to it is chosen from the candidates.
+
+    Args:
+        image: Path to input image, numpy array or LoadedImage
+        sigma: Relative spread of the thresholds around the median
+        threshold_pairs: Optional list of candidate (low, high) pairs
+
+    Returns:
+        Tuple of (edges, (low_threshold, high_threshold))
+    """
+    img = as_gray(image)
+    target = auto_canny_thresholds(img, sigma)
+    best = target
+    if threshold_pairs:
+        best = min(threshold_pairs,
+                   key=lambda pair: abs(pair[0] - target[0]) + abs(pair[1] - target[1]))
+    edges = canny_threshold_sweep(img, [best])[0]
+    return edges, tuple(best)
+
+def display_edges(input_path, output_path=None, show_plot=False, low_threshold=100,
+                  high_threshold=200, edges=None):
     """
     Display original image and edge-detected image side by side.
     
     Args:
-        input_path: Path to input image
+        input_path: Path to input image, numpy array or LoadedImage
         output_path: Path to save output image
         show_plot: Whether to display matplotlib window (default False)
+        low_threshold: Lower threshold for Canny edge detection
+        high_threshold: Upper threshold for Canny edge detection
+        edges: Already computed edges to show instead of running Canny again
     """
-    img = cv2.imread(input_path, cv2.IMREAD_GRAYSCALE)
-    edges = detect_edges_canny(input_path, output_path)
+    img = as_gray(input_path)
+    if edges is None:
+        edges = detect_edges_canny_from_array(img, low_threshold, high_threshold)
+    if output_path:
+        write_image(output_path, edges)
     
     if show_plot:
+        # matplotlib is slow to import, only load it when plotting
+        from matplotlib import pyplot as plt
+
         plt.figure(figsize=(12, 5))
         plt.subplot(121)
         plt.imshow(img, cmap='gray')
@@ -55,6 +168,193 @@ def display_edges(input_path, output_path=None, show_plot=False):
     
     return edges
 
+def _band_to_gray(band):
+    """Convert a band read from an image source to grayscale"""
+    band = np.ascontiguousarray(band)
+    if band.ndim == 2:
+        return band
+    code = cv2.COLOR_BGRA2GRAY if band.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+    return cv2.cvtColor(band, code)
+
+def _band_candidates(source, start, stop, low_threshold, high_threshold):
+    """
+    Split Canny into its pre-hysteresis maps for rows [start, stop).
+
+    Running Canny with equal thresholds skips hysteresis, so the two calls give
+    the non-maximum-suppressed pixels above the low and above the high
+    threshold. Gradients and suppression look 2 rows away, hence the halo.
+    """
+    height = source.shape[0]
+    top = max(start - 2, 0)
+    bottom = min(stop + 2, height)
+    gray = _band_to_gray(source[top:bottom])
+    low, high = sorted((low_threshold, high_threshold))
+    weak = cv2.Canny(gray, low, low)[start - top:stop - top]
+    strong = cv2.Canny(gray, high, high)[start - top:stop - top]
+    count, labels = cv2.connectedComponents(weak, connectivity=8, ltype=cv2.CV_32S)
+    return count, labels, strong
+
+def _find_roots(parent):
+    """Resolve every union-find entry to its root by pointer jumping"""
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return parent
+        parent = grandparent
+
+def _stitch_components(bands):
+    """
+    Merge per-band components that touch across seams.
+
+    Args:
+        bands: List of (count, has_strong, first_row, last_row) per band
+
+    Returns:
+        Tuple of (offsets, is_edge) where is_edge[offsets[k] + label] tells if
+        a component of band k is connected to a strong pixel
+    """
+    offsets = np.cumsum([0] + [count for count, _, _, _ in bands])
+    parent = np.arange(offsets[-1])
+    has_strong = np.concatenate([strong for _, strong, _, _ in bands])
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for k in range(len(bands) - 1):
+        above = bands[k][3]
+        below = bands[k + 1][2]
+        width = len(above)
+        # 8-connectivity: a pixel touches the three pixels below it
+        pairs = []
+        for dx in (-1, 0, 1):
+            a = above[max(-dx, 0):width - max(dx, 0)]
+            b = below[max(dx, 0):width - max(-dx, 0)]
+            touching = (a > 0) & (b > 0)
+            pairs.append(np.stack([a[touching] + offsets[k], b[touching] + offsets[k + 1]], axis=1))
+        for a, b in np.unique(np.concatenate(pairs), axis=0):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+    roots = _find_roots(parent)
+    root_strong = np.zeros(len(parent), dtype=bool)
+    root_strong[roots[has_strong]] = True
+    return offsets, root_strong[roots]
+
+@operation("canny")
+def detect_edges_canny_tiled(input_path, output_path, low_threshold=100, high_threshold=200,
+                             band_rows=256, workers=1, halo=None):
+    """
+    Detect edges using Canny, processing the image in row bands.
+
+    By default the result matches detect_edges_canny on the same grayscale
+    data exactly: a first pass labels the edge candidates of each band and
+    links them across seams, a second pass writes the components that reach
+    a strong edge. With an integer halo a single pass is made instead, each
+    band reading `halo` extra rows on both sides; that is faster, but an edge
+    chain that leaves the halo before reaching a strong pixel can be cut at a
+    seam. Peak memory depends on band_rows, not on the image size, when the
+    input is memory-mappable (.npy or binary PGM/PPM).
+
+    Args:
+        input_path: Path to input image
+        output_path: Path to save output image (.npy is written as a memmap)
+        low_threshold: Lower threshold for Canny edge detection
+        high_threshold: Upper threshold for Canny edge detection
+        band_rows: Number of rows per band
+        workers: Number of threads processing bands
+        halo: None for exact seams, or rows of overlap for a single pass
+
+    Returns:
+        Memory-mapped edges for .npy outputs, otherwise None
+    """
+    source = open_image_source(input_path, lambda path: cv2.imread(path, cv2.IMREAD_GRAYSCALE))
+    height, width = source.shape[:2]
+    bands = iter_bands(height, band_rows)
+    output = open_band_output(output_path, (height, width))
+
+    if halo is not None:
+        def write_band(start, stop):
+            top = max(start - halo, 0)
+            bottom = min(stop + halo, height)
+            edges = cv2.Canny(_band_to_gray(source[top:bottom]), low_threshold, high_threshold)
+            output[start:stop] = edges[start - top:stop - top]
+
+        with stage("edges"):
+            process_bands(bands, write_band, workers)
+        return close_band_output(output, output_path)
+
+    def label_band(start, stop):
+        count, labels, strong = _band_candidates(source, start, stop, low_threshold, high_threshold)
+        has_strong = np.zeros(count, dtype=bool)
+        has_strong[labels[strong > 0]] = True
+        has_strong[0] = False
+        return count, has_strong, labels[0].copy(), labels[-1].copy()
+
+    with stage("label"):
+        components = process_bands(bands, label_band, workers)
+    with stage("stitch"):
+        offsets, is_edge = _stitch_components(components)
+
+    def write_band(start, stop):
+        _, labels, _ = _band_candidates(source, start, stop, low_threshold, high_threshold)
+        output[start:stop] = is_edge[offsets[start // band_rows] + labels].astype(np.uint8) * 255
+
+    with stage("edges"):
+        process_bands(bands, write_band, workers)
+    return close_band_output(output, output_path)
+
+def _canny_file(task):
+    """Run Canny on one file of a batch (runs in a worker)"""
+    input_path, output_path, low_threshold, high_threshold = task
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    detect_edges_canny(input_path, output_path, low_threshold, high_threshold)
+    return output_path
+
+def detect_edges_canny_batch(inputs, output_dir, low_threshold=100, high_threshold=200,
+                             workers=None, max_in_flight=None, use_threads=False,
+                             recursive=False, on_result=None):
+    """
+    Detect edges using Canny on many images in parallel.
+
+    Decoding, Canny and encoding all run in the workers. Files are processed
+    in sorted order and written to output_dir as <name>_canny.png, keeping
+    their layout relative to the inputs' common directory. A file that fails
+    is recorded in the report and the batch carries on.
+
+    Args:
+        inputs: Image paths, directories or glob patterns
+        output_dir: Directory to save output images
+        low_threshold: Lower threshold for Canny edge detection
+        high_threshold: Upper threshold for Canny edge detection
+        workers: Number of workers (default: number of CPUs)
+        max_in_flight: Maximum number of queued images (default: 2 * workers)
+        use_threads: Use threads instead of processes
+        recursive: Whether to descend into subdirectories
+        on_result: Optional callback(input_path, output_path, error) per file
+
+    Returns:
+        Batch report with processed count, failures and images/sec
+    """
+    paths = expand_inputs(inputs, recursive=recursive)
+    tasks = [(path, out, low_threshold, high_threshold)
+             for path, out in zip(paths, output_paths(paths, output_dir, "_canny", ".png"))]
+
+    start = time.perf_counter()
+    processed = 0
+    failed = []
+    for task, result, error in run_batch(_canny_file, tasks, workers, max_in_flight, use_threads):
+        if error is None:
+            processed += 1
+        else:
+            failed.append((task[0], f"{type(error).__name__}: {error}"))
+        if on_result:
+            on_result(task[0], result, error)
+    return batch_report(processed, failed, time.perf_counter() - start)
+
 if __name__ == "__main__":
     # Example usage
     display_edges('samples/sample_image.jpg', 'output/canny_edges.png')
@@ -0,0 +1,597 @@
+"""
+Command-line interface for batch processing.
+Used by main.py when it is called with arguments.
+
+Every subcommand takes image files, directories or glob patterns ("-" reads
+a list of paths from stdin) and processes them on a pool of --jobs workers.
+With --json one JSON object per file is printed as it finishes, followed by
+a summary object.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from functools import lru_cache, wraps
+
+from src.image_io import load_image
+from src import image_writer
+from src.image_writer import INDEXED_EXTENSIONS
+from src.batch import expand_inputs, output_paths, run_batch, batch_report
+from src import instrument
+from src.cache import DEFAULT_CACHE_DIR, ResultCache
+
+# Operation modules are imported by their task functions, so a run only loads
+# the dependencies (scikit-learn, PIL, ...) of the subcommand it uses
+
+
+def build_parser():
+    """Build the argument parser with one subcommand per operation."""
+    parser = argparse.ArgumentParser(prog="main.py", description="Batch image processing")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    canny = subparsers.add_parser("canny", help="Canny edge detection")
+    add_batch_arguments(canny, "output/canny")
+    canny.add_argument("--low", type=int, default=100, help="Low threshold (default 100)")
+    canny.add_argument("--high", type=int, default=200, help="High threshold (default 200)")
+
+    sobel = subparsers.add_parser("sobel", help="Sobel edge detection")
+    add_batch_arguments(sobel, "output/sobel")
+    sobel.add_argument("--engine", choices=["numpy", "python", "legacy"], default="numpy",
+                       help="Sobel engine (default numpy; legacy reproduces the original in-place loops)")
+    sobel.add_argument("--backend", choices=["numpy", "separable", "opencv", "python", "auto"], default="numpy",
+                       help="Convolution backend of the numpy engine (default numpy, auto: fastest here)")
+    sobel.add_argument("--ksize", type=int, choices=[3, 5, 7], default=3, help="Sobel kernel size (default 3)")
+    sobel.add_argument("--accumulator", choices=["float64", "float32", "int16"], default="float64",
+                       help="Gradient arithmetic (default float64, exact; int16 needs --ksize 3 or 5)")
+
+    colors = subparsers.add_parser("colors", help="Extract bright & colorful colors")
+    add_batch_arguments(colors, None)
+    add_cache_arguments(colors)
+    colors.add_argument("-n", "--num-colors", type=int, default=8, help="Number of colors (default 8)")
+    colors.add_argument("--method", choices=["exact", "histogram", "sample"], default="exact",
+                        help="Clustering method (default exact)")
+
+    deshade = subparsers.add_parser("deshade", help="Remove shading from images")
+    add_batch_arguments(deshade, "output/deshaded")
+    add_cache_arguments(deshade)
+    deshade.add_argument("-n", "--num-colors", type=int, default=8, help="Number of colors (default 8)")
+    deshade.add_argument("--brightness", type=int, default=150,
+                         help="Brightness threshold (default 150)")
+    deshade.add_argument("--masked-only", action="store_true",
+                         help="Fit colors on the bright pixels only")
+    deshade.add_argument("--max-samples", type=int, default=None,
+                         help="Maximum pixels to fit on (with --masked-only)")
+    deshade.add_argument("--palette", help="Apply a saved palette (.npz) instead of fitting")
+    deshade.add_argument("--indexed", choices=[ext[1:] for ext in INDEXED_EXTENSIONS], default=None,
+                         help="Write labels and palette: a palettized PNG, or a .npy label map "
+                              "with a .palette.json sidecar")
+
+    scan = subparsers.add_parser("scan", help="Document scanning")
+    add_batch_arguments(scan, "output/scans")
+    scan.add_argument("--min-confidence", type=float, default=0.5,
+                      help="Skip pages detected below this confidence (default 0.5)")
+    scan.add_argument("--max-dim", type=int, default=800,
+                      help="Longest side used for corner detection (default 800)")
+    scan.add_argument("--profile", help="Use a saved scan profile (.npz) instead of detection")
+    scan.add_argument("--corners", help='Fixed corners instead of detection, "x,y x,y x,y x,y"')
+
+    pipeline = subparsers.add_parser("pipeline", help="Run a multi-step pipeline from a JSON/YAML spec")
+    add_batch_arguments(pipeline, "output/pipeline")
+    pipeline.add_argument("--spec", required=True, help="Pipeline spec file (.json, or .yaml with PyYAML)")
+    pipeline.add_argument("--step-workers", type=int, default=None,
+                          help="Steps of one image running at the same time (default: from the spec, or CPUs)")
+
+    video = subparsers.add_parser("video", help="Process the frames of a video")
+    video.add_argument("input", help="Input video file")
+    video.add_argument("-o", "--output", help="Output video (default: output/video/<name>_<op>.mp4)")
+    video.add_argument("--op", choices=["canny", "sobel", "palette"], default="canny",
+                       help="Operation applied to each frame (default canny)")
+    video.add_argument("--low", type=int, default=100, help="Canny low threshold (default 100)")
+    video.add_argument("--high", type=int, default=200, help="Canny high threshold (default 200)")
+    video.add_argument("--palette", help="Palette (.npz) for --op palette (default: fitted on the first frame)")
+    video.add_argument("-j", "--jobs", "--workers", dest="jobs", type=int, default=None,
+                       help="Number of worker threads (default: CPUs)")
+    video.add_argument("--queue-size", type=int, default=8,
+                       help="Frames decoded ahead and frames in flight (default 8)")
+    video.add_argument("--realtime", action="store_true",
+                       help="Drop frames when processing falls behind the video's frame rate")
+    video.add_argument("--max-lag", type=float, default=0.5,
+                       help="Seconds behind real time before dropping frames (default 0.5)")
+    video.add_argument("--fourcc", default="mp4v", help="Output codec (default mp4v)")
+    video.add_argument("--instrument", metavar="LOG",
+                       help='Append per-stage timing records as JSON lines to LOG ("-" for stderr)')
+
+    index = subparsers.add_parser("index", help="Add the palettes of images to a palette index")
+    index.add_argument("inputs", nargs="+",
+                       help='Image files, directories or glob patterns ("-" reads paths from stdin)')
+    index.add_argument("--index", required=True, help="Index directory, created when needed")
+    index.add_argument("-r", "--recursive", action="store_true", help="Descend into subdirectories")
+    index.add_argument("-j", "--jobs", "--workers", dest="jobs", type=int, default=None,
+                       help="Number of parallel jobs (default: CPUs)")
+    index.add_argument("--max-in-flight", type=int, default=None, help="Maximum queued images (default: 2 x jobs)")
+    index.add_argument("--threads", action="store_true", help="Use threads instead of processes")
+    index.add_argument("-n", "--num-colors", type=int, default=8,
+                       help="Colors per palette of a new index (default 8)")
+    index.add_argument("--method", choices=["exact", "histogram", "sample"], default="histogram",
+                       help="Clustering method (default histogram)")
+    index.add_argument("--refresh", action="store_true", help="Re-extract images that are already indexed")
+    index.add_argument("--remove", action="store_true", help="Remove the given paths from the index instead")
+    index.add_argument("--compact", action="store_true", help="Rewrite the index without removed entries")
+    add_cache_arguments(index)
+
+    query = subparsers.add_parser("query", help="Find the images of a palette index with similar colors")
+    query.add_argument("--index", required=True, help="Index directory")
+    target = query.add_mutually_exclusive_group(required=True)
+    target.add_argument("--color", help='Target color, "R,G,B"')
+    target.add_argument("--palette", help='Target palette, "R,G,B R,G,B ..."')
+    target.add_argument("--like", metavar="IMAGE", help="Use the palette of an image")
+    query.add_argument("-k", type=int, default=10, help="Number of results (default 10)")
+    query.add_argument("--json", action="store_true", help="Print results as JSON lines")
+
+    serve = subparsers.add_parser("serve", help="Run a local HTTP processing service")
+    serve.add_argument("--host", default="127.0.0.1", help="Address to listen on (default 127.0.0.1)")
+    serve.add_argument("--port", type=int, default=8080, help="Port to listen on (default 8080)")
+    serve.add_argument("-j", "--jobs", "--workers", dest="jobs", type=int, default=None,
+                       help="Number of worker processes (default: CPUs)")
+    serve.add_argument("--max-queue", type=int, default=None,
+                       help="Requests queued or running before answering 503 (default: 4 x jobs)")
+    serve.add_argument("--batch-size", type=int, default=8, help="Maximum requests per worker task (default 8)")
+    serve.add_argument("--batch-wait", type=float, default=5,
+                       help="Milliseconds to wait for more requests to batch (default 5)")
+    serve.add_argument("--max-body", type=int, default=64, help="Maximum request size in MB (default 64)")
+    return parser
+
+
+def add_batch_arguments(parser, default_output_dir):
+    """Add the input, output and worker pool arguments shared by subcommands."""
+    parser.add_argument("inputs", nargs="+",
+                        help='Image files, directories or glob patterns ("-" reads paths from stdin)')
+    if default_output_dir:
+        parser.add_argument("-o", "--output-dir", default=default_output_dir, help="Output directory")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Descend into subdirectories")
+    parser.add_argument("-j", "--jobs", "--workers", dest="jobs", type=int, default=None,
+                        help="Number of parallel jobs (default: CPUs)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Maximum queued images (default: 2 x jobs)")
+    parser.add_argument("--threads", action="store_true", help="Use threads instead of processes")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines")
+    parser.add_argument("--preview", type=int, choices=[2, 4, 8], default=None,
+                        help="Quick low-res pass: decode at 1/N resolution, outputs get a _preview suffix")
+    parser.add_argument("--png-compression", type=int, choices=range(10), default=None, metavar="0-9",
+                        help="PNG compression level (default: OpenCV's, the fastest)")
+    parser.add_argument("--jpeg-quality", type=int, default=None, help="JPEG quality 0-100 (default 95)")
+    parser.add_argument("--instrument", metavar="LOG",
+                        help='Append per-stage timing records as JSON lines to LOG ("-" for stderr)')
+    parser.add_argument("--trace-memory", choices=["tracemalloc", "rss"], default=None,
+                        help="Also record memory per stage (with --instrument)")
+
+
+def add_cache_arguments(parser):
+    """Add the result cache arguments of the k-means based subcommands."""
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Result cache directory (default: $IMAGE_PROCESSING_CACHE or ~/.cache/image-processing)")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Result cache size in MB (default 1024)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the result cache")
+    parser.add_argument("--clear-cache", action="store_true", help="Empty the result cache before running")
+
+
+def collect_inputs(args):
+    """Expand the input arguments, reading paths from stdin for "-"."""
+    patterns = []
+    for pattern in args.inputs:
+        if pattern == "-":
+            patterns.extend(line.strip() for line in sys.stdin if line.strip())
+        else:
+            patterns.append(pattern)
+    return expand_inputs(patterns, recursive=args.recursive)
+
+
+def _write(output_path, image):
+    """Write an image, creating its directory."""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    image_writer.write_image(output_path, image)
+
+
+def _read(input_path, reduce=None):
+    """Read a BGR image, at 1/reduce resolution if given."""
+    image = load_image(input_path, reduce or 1)
+    assert image is not None, "file could not be read, check with os.path.exists()"
+    return image.bgr
+
+
+def _source(input_path, options):
+    """The input path, or a reduced-resolution decode of it in preview mode."""
+    if not options["preview"]:
+        return input_path
+    image = load_image(input_path, options["preview"])
+    assert image is not None, "file could not be read, check with os.path.exists()"
+    return image
+
+
+@lru_cache(maxsize=4)
+def _scan_profile(profile_path, corners):
+    """Load or build a scan profile once per worker."""
+    from src.document_scanner import create_scan_profile, load_scan_profile
+
+    if profile_path:
+        return load_scan_profile(profile_path)
+    return create_scan_profile(corners)
+
+
+def _cache(options):
+    """Result cache of a task, None when bypassed or in preview mode."""
+    if not options["cache_dir"] or options["preview"]:
+        return None
+    return ResultCache(options["cache_dir"], options["cache_bytes"])
+
+
+@lru_cache(maxsize=4)
+def _pipeline(spec_path, workers):
+    """Load a pipeline spec once per worker."""
+    from src.pipeline import Pipeline
+
+    return Pipeline.from_spec(spec_path, workers)
+
+
+@lru_cache(maxsize=4)
+def _palette(palette_path):
+    """Load a palette once per worker."""
+    from src.remove_shading import load_palette
+
+    return load_palette(palette_path)
+
+
+_instrument_lock = threading.Lock()
+
+
+def batch_task(func):
+    """Apply the encoding settings and, with --instrument, run the task inside a "task" stage."""
+    @wraps(func)
+    def wrapper(task):
+        input_path, _, options = task
+        image_writer.configure(options["png_compression"], options["jpeg_quality"])
+        if not options["instrument"]:
+            return func(task)
+        with _instrument_lock:
+            if not instrument.is_enabled():
+                instrument.enable(options["trace_memory"], options["instrument"])
+        with instrument.stage("task", input=input_path):
+            return func(task)
+    return wrapper
+
+
+@batch_task
+def canny_task(task):
+    """Run Canny on one file."""
+    from src.canny_edge_detector import detect_edges_canny
+
+    input_path, output_path, options = task
+    edges = detect_edges_canny(_source(input_path, options), None, options["low"], options["high"])
+    _write(output_path, edges)
+    return {"output": output_path}
+
+
+@batch_task
+def sobel_task(task):
+    """Run Sobel on one file."""
+    from src.sobel_edge_detector import detect_edges_sobel
+
+    input_path, output_path, options = task
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    detect_edges_sobel(_source(input_path, options), output_path, engine=options["engine"],
+                       backend=options["backend"], ksize=options["ksize"], accumulator=options["accumulator"])
+    return {"output": output_path}
+
+
+@batch_task
+def colors_task(task):
+    """Extract the colors of one file."""
+    from src.cache import cached
+    from src.color_extractor import extract_bright_colorful_colors_from_array
+
+    input_path, _, options = task
+    params = {"num_colors": options["num_colors"], "method": options["method"], "max_samples": 100000, "bits": 5}
+    # Same cache entries as extract_bright_colorful_colors, which prints its
+    # errors instead of raising them
+    colors = cached(_cache(options), "colors", input_path, params,
+                    lambda: extract_bright_colorful_colors_from_array(_read(input_path, options["preview"]), **params))
+    return {"colors": colors}
+
+
+@batch_task
+def deshade_task(task):
+    """Remove shading from one file."""
+    from src.remove_shading import (remove_shading_and_keep_colors, apply_shading_palette,
+                                    apply_shading_palette_labels)
+    from src.image_writer import write_indexed
+
+    input_path, output_path, options = task
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    if options["palette"] and options["indexed"]:
+        labels, palette = apply_shading_palette_labels(_read(input_path, options["preview"]),
+                                                       _palette(options["palette"]))
+        write_indexed(output_path, labels, palette)
+    elif options["palette"]:
+        apply_shading_palette(_read(input_path, options["preview"]), _palette(options["palette"]),
+                              output_path)
+    else:
+        remove_shading_and_keep_colors(_source(input_path, options), output_path, options["num_colors"],
+                                       options["brightness"], fit_masked_only=options["masked_only"],
+                                       max_samples=options["max_samples"], cache=_cache(options),
+                                       indexed=bool(options["indexed"]))
+    return {"output": output_path}
+
+
+@batch_task
+def scan_task(task):
+    """Scan the document in one file."""
+    from src.document_scanner import find_document_corners, four_point_transform, apply_scan_profile
+
+    input_path, output_path, options = task
+    image = _read(input_path, options["preview"])
+    if options["profile"] or options["corners"]:
+        _write(output_path, apply_scan_profile(image, _scan_profile(options["profile"], options["corners"])))
+        return {"output": output_path}
+
+    corners, confidence = find_document_corners(image, options["max_dim"])
+    if corners is None or confidence < options["min_confidence"]:
+        return {"output": None, "confidence": confidence, "low_confidence": True}
+    _write(output_path, four_point_transform(image, corners))
+    return {"output": output_path, "confidence": confidence}
+
+
+@batch_task
+def pipeline_task(task):
+    """Run a pipeline on one file."""
+    input_path, output_base, options = task
+    pipeline = _pipeline(options["spec"], options["step_workers"])
+    results = pipeline.run(_source(input_path, options), os.path.dirname(output_base), stem_path=output_base)
+    # Final images without an output file aren't printable
+    return {"pipeline": {name: value for name, value in results.items() if not hasattr(value, "shape")}}
+
+
+def parse_corners(text):
+    """Parse "x,y x,y x,y x,y" into a tuple of four points."""
+    points = tuple(tuple(float(v) for v in point.split(",")) for point in text.split())
+    if len(points) != 4 or any(len(point) != 2 for point in points):
+        raise ValueError(f"expected four x,y corners, got {text!r}")
+    return points
+
+
+def parse_colors(text):
+    """Parse "R,G,B R,G,B ..." into a list of RGB colors."""
+    colors = [[int(v) for v in color.split(",")] for color in text.split()]
+    if not colors or any(len(color) != 3 or not all(0 <= v <= 255 for v in color) for color in colors):
+        raise ValueError(f"expected R,G,B colors with values 0-255, got {text!r}")
+    return colors
+
+
+TASKS = {
+    "canny": (canny_task, "_canny", ".png"),
+    "sobel": (sobel_task, "_sobel", ".png"),
+    "colors": (colors_task, None, None),
+    "deshade": (deshade_task, "_deshaded", ".png"),
+    "scan": (scan_task, "_scan", ".png"),
+    "pipeline": (pipeline_task, "", ""),
+}
+
+
+def task_options(args):
+    """Options passed to the task function of the selected subcommand."""
+    options = {"preview": args.preview, "instrument": args.instrument,
+               "trace_memory": args.trace_memory, "png_compression": args.png_compression,
+               "jpeg_quality": args.jpeg_quality}
+    if args.command == "canny":
+        options.update(low=args.low, high=args.high)
+    elif args.command == "sobel":
+        options.update(engine=args.engine, backend=args.backend, ksize=args.ksize,
+                       accumulator=args.accumulator)
+    elif args.command == "colors":
+        options.update(num_colors=args.num_colors, method=args.method)
+    elif args.command == "pipeline":
+        options.update(spec=args.spec, step_workers=args.step_workers)
+    elif args.command == "deshade":
+        options.update(num_colors=args.num_colors, brightness=args.brightness,
+                       masked_only=args.masked_only, max_samples=args.max_samples,
+                       palette=args.palette, indexed=args.indexed)
+    else:
+        options.update(min_confidence=args.min_confidence, max_dim=args.max_dim, profile=args.profile,
+                       corners=parse_corners(args.corners) if args.corners else None)
+    if args.command in ("colors", "deshade"):
+        options.update(cache_dir=None if args.no_cache else args.cache_dir,
+                       cache_bytes=args.cache_size << 20)
+    return options
+
+
+def print_result(args, input_path, result, error):
+    """Print the outcome of one file."""
+    if args.json:
+        record = {"input": input_path, "ok": error is None,
+                  "error": f"{type(error).__name__}: {error}" if error else None}
+        record.update(result or {})
+        print(json.dumps(record), flush=True)
+    elif error is not None:
+        print(f"✗ {input_path}: {type(error).__name__}: {error}", file=sys.stderr)
+    elif result.get("low_confidence"):
+        print(f"? {input_path}: low confidence ({result['confidence']:.2f}), needs manual corners")
+    elif "pipeline" in result:
+        print(f"✓ {input_path}: " + ", ".join(f"{name}: {value}" for name, value in result["pipeline"].items()))
+    elif "colors" in result:
+        print(f"✓ {input_path}: {result['colors']}")
+    else:
+        print(f"✓ {input_path} -> {result['output']}")
+
+
+def print_report(args, report):
+    """Print the summary of a batch run."""
+    if args.json:
+        print(json.dumps({"summary": report}), flush=True)
+        return
+    manual = f"{len(report['low_confidence'])} need manual corners, " if args.command == "scan" else ""
+    print(f"{report['processed']} processed, {manual}{len(report['failed'])} failed "
+          f"in {report['seconds']:.2f}s ({report['images_per_sec']:.1f} images/sec)")
+
+
+def run_video(args):
+    """Run the video subcommand."""
+    from src.video import process_video
+
+    output = args.output or os.path.join(
+        "output", "video", os.path.splitext(os.path.basename(args.input))[0] + f"_{args.op}.mp4")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    if args.instrument:
+        instrument.enable(log=args.instrument)
+
+    def progress(stats):
+        print(f"\r{stats['frames']} frames, {stats['fps']:.1f} fps, {stats['skipped']} skipped",
+              end="", file=sys.stderr, flush=True)
+
+    try:
+        stats = process_video(args.input, output, args.op, workers=args.jobs, queue_size=args.queue_size,
+                              realtime=args.realtime, max_lag=args.max_lag, fourcc=args.fourcc,
+                              low_threshold=args.low, high_threshold=args.high, palette=args.palette,
+                              progress=progress)
+    except (IOError, ValueError) as e:
+        print(f"✗ {args.input}: {type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if instrument.is_enabled():
+            instrument.disable()
+    print(file=sys.stderr)
+    print(f"✓ {args.input} -> {output}: {stats['frames']} frames ({stats['skipped']} skipped) "
+          f"in {stats['seconds']:.2f}s ({stats['fps']:.1f} fps, input {stats['input_fps']:.1f} fps)")
+    return 0
+
+
+def run_index(args):
+    """Run the index subcommand."""
+    from src.palette_index import PaletteIndex, index_images
+
+    index = PaletteIndex(args.index, args.num_colors)
+    start = time.perf_counter()
+    failed = []
+    if args.remove:
+        paths = [line.strip() for line in sys.stdin if line.strip()] if args.inputs == ["-"] else args.inputs
+        print(f"Removed {index.remove(*paths)} images from {args.index}")
+    else:
+        if args.clear_cache:
+            ResultCache(args.cache_dir).clear()
+        cache = None if args.no_cache else ResultCache(args.cache_dir, args.cache_size << 20)
+
+        def progress(path, colors, error):
+            if error is not None:
+                print(f"✗ {path}: {type(error).__name__}: {error}", file=sys.stderr)
+
+        added, failed = index_images(index, collect_inputs(args), args.method, workers=args.jobs,
+                                     max_in_flight=args.max_in_flight, use_threads=args.threads, cache=cache,
+                                     refresh=args.refresh, callback=progress)
+        print(f"Indexed {added} images, {len(failed)} failed in {time.perf_counter() - start:.2f}s "
+              f"({len(index)} in {args.index})")
+    if args.compact:
+        index.compact()
+    return 1 if failed else 0
+
+
+def run_query(args):
+    """Run the query subcommand."""
+    from src.palette_index import PaletteIndex
+
+    if not os.path.isdir(args.index):
+        print(f"✗ no palette index in {args.index}", file=sys.stderr)
+        return 1
+    index = PaletteIndex(args.index)
+    if args.like and args.like in index:
+        colors = index.palette(args.like)
+    elif args.like:
+        from src.color_extractor import extract_bright_colorful_colors_from_array
+        from src.image_io import as_bgr
+
+        try:
+            colors = extract_bright_colorful_colors_from_array(as_bgr(args.like), index.num_colors, "histogram")
+        except Exception as e:
+            print(f"✗ {args.like}: {type(e).__name__}: {e}", file=sys.stderr)
+            return 1
+    else:
+        colors = parse_colors(args.color or args.palette)
+
+    for rank, (path, distance) in enumerate(index.query(colors, args.k), 1):
+        if args.json:
+            print(json.dumps({"path": path, "distance": round(distance, 2)}), flush=True)
+        else:
+            print(f"{rank}. {path} ({distance:.1f})")
+    return 0
+
+
+def main(argv=None):
+    """Parse arguments and run the selected subcommand."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        from src.server import serve
+        serve(args.host, args.port, workers=args.jobs, max_queue=args.max_queue, batch_size=args.batch_size,
+              batch_wait=args.batch_wait / 1000, max_body=args.max_body << 20)
+        return 0
+    if args.command == "video":
+        return run_video(args)
+    if args.command == "index":
+        return run_index(args)
+    if args.command == "query":
+        for text in (args.color, args.palette):
+            if text is not None:
+                try:
+                    parse_colors(text)
+                except ValueError as e:
+                    parser.error(str(e))
+        return run_query(args)
+    if getattr(args, "jpeg_quality", None) is not None and not 0 <= args.jpeg_quality <= 100:
+        parser.error(f"--jpeg-quality must be between 0 and 100, got {args.jpeg_quality}")
+    if args.command == "deshade" and not 1 <= args.num_colors <= 255:
+        parser.error(f"--num-colors must be between 1 and 255, got {args.num_colors}")
+    if args.command == "sobel" and args.accumulator == "int16" and args.ksize == 7:
+        parser.error("--accumulator int16 can overflow with --ksize 7, use float32")
+    if args.command == "sobel" and args.preview and args.engine != "numpy":
+        parser.error(f"--preview needs the numpy engine, --engine {args.engine} decodes the full file itself")
+    if args.command == "pipeline":
+        # Check the spec before starting the workers
+        try:
+            _pipeline(args.spec, args.step_workers)
+        except (OSError, ValueError, KeyError, TypeError, ImportError) as e:
+            parser.error(f"invalid pipeline spec {args.spec}: {e}")
+    if args.preview and args.command == "scan" and (args.profile or args.corners):
+        parser.error("--preview can't be combined with full-resolution --profile/--corners")
+    func, suffix, extension = TASKS[args.command]
+    if suffix is not None and args.preview:
+        suffix += "_preview"
+    if getattr(args, "indexed", None):
+        extension = "." + args.indexed
+    options = task_options(args)
+    if getattr(args, "clear_cache", False):
+        ResultCache(args.cache_dir).clear()
+
+    paths = collect_inputs(args)
+    outputs = output_paths(paths, args.output_dir, suffix, extension) if suffix is not None else [None] * len(paths)
+    tasks = [(path, output, options) for path, output in zip(paths, outputs)]
+
+    start = time.perf_counter()
+    processed = 0
+    failed = []
+    low_confidence = []
+    for task, result, error in run_batch(func, tasks, args.jobs, args.max_in_flight, args.threads):
+        if error is not None:
+            failed.append((task[0], f"{type(error).__name__}: {error}"))
+        elif result.get("low_confidence"):
+            low_confidence.append((task[0], result["confidence"]))
+        else:
+            processed += 1
+        print_result(args, task[0], result, error)
+
+    report = batch_report(processed, failed, time.perf_counter() - start)
+    report["low_confidence"] = low_confidence
+    print_report(args, report)
+    if instrument.is_enabled():
+        instrument.disable()
+    # Skipped pages weren't written, so the run didn't complete either
+    return 1 if failed or low_confidence else 0
@@ -1,18 +1,254 @@
 import cv2
 import numpy as np
-from sklearn.cluster import KMeans
 import os
+from src.tiling import IndexedSource, open_image_source
+from src.image_io import REDUCED_COLOR_FLAGS, as_bgr, as_rgb
+from src.instrument import operation, stage
+from src.cache import cached
 
-def extract_bright_colorful_colors(image_path, num_colors=8, brightness_threshold=100, saturation_threshold=30):
+def _kmeans(**kwargs):
+    """KMeans estimator, scikit-learn is only imported on first use as it is slow to load"""
+    with stage("import_sklearn"):
+        from sklearn.cluster import KMeans
+    return KMeans(**kwargs)
+
+def color_histogram(pixels, bits=5):
+    """
+    Count RGB pixels in a coarse color histogram.
+
+    Args:
+        pixels: (N, 3) uint8 array of RGB pixels
+        bits: Bits kept per channel, giving 2**(3*bits) bins
+
+    Returns:
+        Tuple of (counts, sums): pixels per bin and their per-channel sums
+    """
+    shift = 8 - bits
+    quantized = (pixels >> shift).astype(np.int32)
+    bins = (quantized[:, 0] << (2 * bits)) | (quantized[:, 1] << bits) | quantized[:, 2]
+    size = 1 << (3 * bits)
+    counts = np.bincount(bins, minlength=size)
+    sums = np.stack([np.bincount(bins, weights=pixels[:, c], minlength=size) for c in range(3)], axis=1)
+    return counts, sums
+
+def _fit_histogram(counts, sums, num_colors):
+    """Cluster the mean color of each bin, weighted by its pixel count"""
+    occupied = counts > 0
+    means = sums[occupied] / counts[occupied][:, None]
+    kmeans = _kmeans(n_clusters=min(num_colors, len(means)), n_init=10, random_state=42)
+    with stage("fit"):
+        kmeans.fit(means, sample_weight=counts[occupied])
+    return kmeans.cluster_centers_
+
+def stratified_sample(image, max_samples, seed=42):
+    """
+    Sample about max_samples pixels spread evenly over the image.
+
+    The image is split into a grid of square cells and one random pixel is
+    taken from each, so every region is represented.
+    """
+    height, width = image.shape[:2]
+    step = max(1, int(np.ceil(np.sqrt(height * width / max_samples))))
+    rng = np.random.default_rng(seed)
+    rows = np.arange(0, height, step)
+    cols = np.arange(0, width, step)
+    y = np.minimum(rows[:, None] + rng.integers(0, step, (len(rows), len(cols))), height - 1)
+    x = np.minimum(cols[None, :] + rng.integers(0, step, (len(rows), len(cols))), width - 1)
+    return image[y, x].reshape((-1, 3))
+
+def _fit_sample(image_rgb, num_colors, max_samples):
+    """Cluster a stratified pixel sample with k-means"""
+    with stage("sample"):
+        sample = stratified_sample(image_rgb, max_samples)
+    kmeans = _kmeans(n_clusters=min(num_colors, len(sample)), n_init=10, random_state=42)
+    with stage("fit"):
+        kmeans.fit(sample)
+    return kmeans.cluster_centers_
+
+def score_colors(cluster_centers, num_colors):
+    """
+    Sort cluster centers by brightness and saturation.
+
+    Args:
+        cluster_centers: (K, 3) array of RGB cluster centers
+        num_colors: Number of colors to keep
+
+    Returns:
+        List of RGB color values, brightest and most saturated first
+    """
+    centers = np.asarray(cluster_centers).astype(np.uint8)
+
+    # Convert all centers to HSV at once for brightness and saturation analysis
+    centers_hsv = cv2.cvtColor(centers.reshape((1, -1, 3)), cv2.COLOR_RGB2HSV)[0]
+    brightness = centers_hsv[:, 2]
+    saturation = centers_hsv[:, 1]
+
+    # Score based on combination of brightness and saturation
+    # Prefer bright and saturated colors, but don't strictly filter
+    scores = brightness * 0.6 + saturation * 0.4
+
+    # Stable sort keeps the k-means order for ties, like list.sort did
+    order = np.argsort(-scores, kind="stable")[:num_colors]
+    return centers[order].tolist()
+
+@operation("colors")
+def extract_bright_colorful_colors_from_array(image, num_colors=8, method="exact", max_samples=100000, bits=5):
+    """
+    Extract bright and colorful colors from an in-memory image.
+
+    Same as extract_bright_colorful_colors, but errors are raised instead of
+    printed.
+
+    Args:
+        image: BGR numpy array, or LoadedImage (reuses its cached RGB)
+        num_colors: Number of color clusters to extract
+        method: "exact", "histogram" or "sample"
+        max_samples: Pixels to sample for the "sample" method
+        bits: Bits per channel for the "histogram" method
+
+    Returns:
+        List of RGB color values sorted by brightness
+    """
+    # Suppress the physical cores warning
+    os.environ['LOKY_MAX_CPU_COUNT'] = '4'
+
+    # Convert the image from BGR to RGB
+    image_rgb = as_rgb(image)
+
+    if method == "histogram":
+        with stage("histogram"):
+            counts, sums = color_histogram(image_rgb.reshape((-1, 3)), bits)
+        cluster_centers = _fit_histogram(counts, sums, num_colors)
+    elif method == "sample":
+        cluster_centers = _fit_sample(image_rgb, num_colors, max_samples)
+    elif method == "exact":
+        # Reshape the image to a 2D array of pixels
+        pixels = image_rgb.reshape((-1, 3))
+
+        # Perform k-means clustering for color quantization
+        kmeans = _kmeans(n_clusters=num_colors, n_init=10, random_state=42)
+        with stage("fit"):
+            kmeans.fit(pixels)
+        cluster_centers = kmeans.cluster_centers_
+    else:
+        raise ValueError(f"Unknown method: {method}")
+
+    # Score clusters by brightness and saturation, take top num_colors
+    with stage("score"):
+        return score_colors(cluster_centers, num_colors)
+
+@operation("colors")
+def extract_bright_colorful_colors(image_path, num_colors=8, brightness_threshold=100, saturation_threshold=30,
+                                   method="exact", max_samples=100000, bits=5, cache=None):
     """
     Extract bright and colorful colors from an image using K-means clustering.
-    
+
+    The "exact" method clusters every pixel. The fast methods cluster a
+    summary of the image instead:
+
+    - "histogram" quantizes to `bits` per channel and clusters the mean
+      color of each occupied bin, weighted by its pixel count. Every pixel
+      is within r = (2**(8-bits) - 1) * sqrt(3) of its bin's mean (12.1
+      levels at 5 bits). By the triangle inequality, the RMS distance from
+      the pixels to their nearest palette color is then at most 2r above
+      that of the exact palette (when both k-means fits reach their
+      optimum).
+    - "sample" clusters about `max_samples` pixels taken evenly over the
+      image, so the cost no longer grows with the image size. A center's
+      standard error is sigma / sqrt(n), with sigma the spread of its
+      cluster per channel and n the samples in it: at 100000 samples, under
+      2 levels for a cluster covering 1% of the image with sigma up to 60.
+
+    Measured on the images in samples/ with 8 colors, both stay within 0.1
+    levels of the exact palette's RMS distance (tests/test_color_extractor.py). Single
+    colors aren't bounded: when two clusterings are almost equally good,
+    the methods (like exact with another seed) can pick different ones.
+
     Args:
         image_path: Path to input image
         num_colors: Number of color clusters to extract
         brightness_threshold: Minimum brightness value (0-255) for filtering
         saturation_threshold: Minimum saturation value (0-255) for filtering
+        method: "exact", "histogram" or "sample"
+        max_samples: Pixels to sample for the "sample" method
+        bits: Bits per channel for the "histogram" method
+        cache: Optional ResultCache, reused when the same file is processed
+            with the same parameters again
     
+    Returns:
+        List of RGB color values sorted by brightness
+    """
+    try:
+        def compute():
+            # Read the image
+            image = as_bgr(image_path)
+            return extract_bright_colorful_colors_from_array(image, num_colors, method, max_samples, bits)
+
+        if not isinstance(image_path, str):
+            return compute()
+        params = {"num_colors": num_colors, "method": method, "max_samples": max_samples, "bits": bits}
+        return cached(cache, "colors", image_path, params, compute)
+
+    except UnicodeDecodeError as e:
+        print(f"UnicodeDecodeError: {e}")
+    except Exception as e:
+        print(f"Error: {e}")
+        return []
+
+def _chunk_to_rgb(chunk):
+    """Convert a BGR, BGRA or grayscale chunk to an (N, 3) RGB pixel array"""
+    chunk = np.ascontiguousarray(chunk)
+    if chunk.ndim == 2:
+        code = cv2.COLOR_GRAY2RGB
+    elif chunk.shape[2] == 4:
+        code = cv2.COLOR_BGRA2RGB
+    else:
+        code = cv2.COLOR_BGR2RGB
+    return cv2.cvtColor(chunk, code).reshape((-1, 3))
+
+def _reservoir_add(reservoir, seen, pixels, rng):
+    """
+    Add pixels to a fixed-size uniform sample (Algorithm R, vectorized).
+
+    Returns:
+        Number of pixels seen so far
+    """
+    capacity = len(reservoir)
+    fill = max(min(capacity - seen, len(pixels)), 0)
+    reservoir[seen:seen + fill] = pixels[:fill]
+
+    # Pixel number i replaces a random slot with probability capacity / (i + 1);
+    # on repeated slots the later pixel wins, as in the sequential algorithm
+    rest = pixels[fill:]
+    slots = rng.integers(0, seen + fill + np.arange(len(rest)) + 1)
+    keep = slots < capacity
+    reservoir[slots[keep]] = rest[keep]
+    return seen + len(pixels)
+
+@operation("colors")
+def extract_bright_colorful_colors_streaming(image_path, num_colors=8, method="histogram",
+                                            chunk_pixels=1 << 20, max_samples=100000,
+                                            bits=5, reduce=1):
+    """
+    Extract bright and colorful colors reading the image in row chunks.
+
+    Only one chunk of pixels is in memory at a time, next to a fixed-size
+    summary: a running color histogram ("histogram", as in
+    extract_bright_colorful_colors) or a uniform reservoir sample of
+    max_samples pixels ("reservoir"). The summary is clustered at the end.
+    .npy and 8-bit binary PGM/PPM inputs are memory-mapped, so peak memory
+    doesn't depend on the image size. Other formats must be decoded first;
+    reduce=2/4/8 decodes them at reduced resolution (cheap for JPEG).
+
+    Args:
+        image_path: Path to input image
+        num_colors: Number of color clusters to extract
+        method: "histogram" or "reservoir"
+        chunk_pixels: Approximate number of pixels read per chunk
+        max_samples: Reservoir size for the "reservoir" method
+        bits: Bits per channel for the "histogram" method
+        reduce: Downscale factor (1, 2, 4 or 8)
+
     Returns:
         List of RGB color values sorted by brightness
     """
@@ -20,51 +256,46 @@ def extract_bright_colorful_colors(image_path, num_colors=8, brightness_threshol
         # Suppress the physical cores warning
         os.environ['LOKY_MAX_CPU_COUNT'] = '4'
 
-        # Read the image
-        image = cv2.imread(image_path)
+        source = open_image_source(image_path,
+                                   lambda path: cv2.imread(path, REDUCED_COLOR_FLAGS[reduce]))
+        if isinstance(source, np.memmap):
+            source = source[::reduce, ::reduce]
+        elif isinstance(source, IndexedSource):
+            source = IndexedSource(source.labels[::reduce, ::reduce], source.palette)
+        height, width = source.shape[:2]
+        chunk_rows = max(1, chunk_pixels // width)
 
-        # Convert the image from BGR to RGB
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if method == "histogram":
+            counts = np.zeros(1 << (3 * bits), dtype=np.int64)
+            sums = np.zeros((1 << (3 * bits), 3))
+        elif method == "reservoir":
+            reservoir = np.empty((max_samples, 3), dtype=np.uint8)
+            seen = 0
+            rng = np.random.default_rng(42)
+        else:
+            raise ValueError(f"Unknown method: {method}")
 
-        # Reshape the image to a 2D array of pixels
-        pixels = image_rgb.reshape((-1, 3))
-
-        # Perform k-means clustering for color quantization
-        kmeans = KMeans(n_clusters=num_colors, n_init=10, random_state=42)
-        kmeans.fit(pixels)
+        with stage("summarize"):
+            for start in range(0, height, chunk_rows):
+                pixels = _chunk_to_rgb(source[start:start + chunk_rows])
+                if method == "histogram":
+                    chunk_counts, chunk_sums = color_histogram(pixels, bits)
+                    counts += chunk_counts
+                    sums += chunk_sums
+                else:
+                    seen = _reservoir_add(reservoir, seen, pixels, rng)
 
-        # Get the cluster centers
-        cluster_centers = kmeans.cluster_centers_
+        if method == "histogram":
+            cluster_centers = _fit_histogram(counts, sums, num_colors)
+        else:
+            sample = reservoir[:min(seen, max_samples)]
+            kmeans = _kmeans(n_clusters=min(num_colors, len(sample)), n_init=10, random_state=42)
+            with stage("fit"):
+                kmeans.fit(sample)
+            cluster_centers = kmeans.cluster_centers_
 
-        # Score clusters by brightness and saturation
-        scored_clusters = []
-        for center in cluster_centers:
-            # Reshape center to a 1x1 array
-            center_reshaped = center.reshape((1, 1, 3))
-
-            # Convert cluster center to HSV for brightness and saturation analysis
-            center_hsv = cv2.cvtColor(center_reshaped.astype(np.uint8), cv2.COLOR_RGB2HSV)[0][0]
-            
-            brightness = center_hsv[2]
-            saturation = center_hsv[1]
-            
-            # Score based on combination of brightness and saturation
-            # Prefer bright and saturated colors, but don't strictly filter
-            score = brightness * 0.6 + saturation * 0.4
-            
-            scored_clusters.append((score, center))
-
-        # Sort by score (brightness + saturation) and take top num_colors
-        scored_clusters.sort(reverse=True, key=lambda x: x[0])
-        top_clusters = [center for score, center in scored_clusters[:num_colors]]
-
-        # Convert to uint8
-        top_clusters = np.array(top_clusters, dtype=np.uint8)
-
-        # Convert the colors to a list of RGB values
-        colors_rgb = top_clusters.tolist()
-
-        return colors_rgb
+        with stage("score"):
+            return score_colors(cluster_centers, num_colors)
 
     except UnicodeDecodeError as e:
         print(f"UnicodeDecodeError: {e}")
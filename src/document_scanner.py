@@ -1,5 +1,12 @@
+import os
+import time
 import cv2
 import numpy as np
+from src.canny_edge_detector import auto_canny_thresholds
+from src.image_io import as_bgr
+from src.instrument import operation, stage
+from src.image_writer import write_image
+from src.batch import expand_inputs, output_paths, run_batch, batch_report
 
 def mouse_callback(event, x, y, flags, param):
     """Mouse callback for point selection."""
@@ -21,20 +28,21 @@ def mouse_callback(event, x, y, flags, param):
             param['complete'] = True
             rect = order_points(np.array(user_points))
             transformed_image = four_point_transform(original_image, rect)
-            cv2.imwrite("output/transformed_image.png", transformed_image)
+            write_image(param['output_path'], transformed_image)
             cv2.destroyAllWindows()
 
-def detect_document(image_path):
-    """Detect document by selecting four corner points."""
-    # Read the image
-    image = cv2.imread(image_path)
-    original_image = image.copy()
+def detect_document(image_path, output_path="output/transformed_image.png"):
+    """Detect document by selecting four corner points (path, array or LoadedImage)."""
+    # Read the image (or reuse an already decoded one)
+    original_image = as_bgr(image_path)
+    image = original_image.copy()
     
     # Prepare callback data
     callback_data = {
         'points': [],
         'image': image,
         'original': original_image,
+        'output_path': output_path,
         'complete': False
     }
     
@@ -53,7 +61,8 @@ def detect_document(image_path):
             cv2.destroyAllWindows()
             break
 
-def four_point_transform(image, pts):
+def _perspective_transform(pts):
+    """Output size and perspective matrix mapping ordered corners to an upright rectangle"""
     # Get the transformed rectangle's width and height
     widthA = np.sqrt(((pts[2][0] - pts[3][0]) ** 2) + ((pts[2][1] - pts[3][1]) ** 2))
     widthB = np.sqrt(((pts[1][0] - pts[0][0]) ** 2) + ((pts[1][1] - pts[0][1]) ** 2))
@@ -63,10 +72,18 @@ def four_point_transform(image, pts):
     heightB = np.sqrt(((pts[0][0] - pts[3][0]) ** 2) + ((pts[0][1] - pts[3][1]) ** 2))
     maxHeight = max(int(heightA), int(heightB))
 
-    # Calculate the perspective transform matrix and warp the image
+    # Calculate the perspective transform matrix
     dst = np.array([[0, 0], [maxWidth - 1, 0], [maxWidth - 1, maxHeight - 1], [0, maxHeight - 1]], dtype="float32")
     M = cv2.getPerspectiveTransform(pts, dst)
-    warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
+    return M, (maxWidth, maxHeight)
+
+@operation("scan")
+def four_point_transform(image, pts):
+    # Calculate the perspective transform matrix and warp the image
+    image = as_bgr(image)
+    M, size = _perspective_transform(pts)
+    with stage("warp"):
+        warped = cv2.warpPerspective(image, M, size)
 
     return warped
 
@@ -81,6 +98,240 @@ def order_points(pts):
     rect[3] = pts[np.argmax(diff)]
     return rect
 
+def _quad_confidence(quad, contour, image_area):
+    """
+    Score how likely a quadrilateral is the document, from 0 to 1.
+
+    Combines how well the quad fits its contour, how much of the image it
+    covers (a page normally fills a good part of the frame) and how close
+    its angles are to right angles.
+    """
+    quad_area = cv2.contourArea(quad)
+    # A quad covering the whole frame is the image border or merged background
+    if quad_area <= 0 or quad_area > 0.95 * image_area:
+        return 0.0
+    fit = min(cv2.contourArea(contour) / quad_area, quad_area / max(cv2.contourArea(contour), 1e-6))
+    coverage = min(quad_area / image_area / 0.25, 1.0)
+
+    corners = quad.reshape((4, 2)).astype(np.float64)
+    cosines = []
+    for i in range(4):
+        a = corners[i - 1] - corners[i]
+        b = corners[(i + 1) % 4] - corners[i]
+        cosines.append(abs(np.dot(a, b)) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-6))
+    rectangularity = 1.0 - max(cosines)
+    return float(fit * coverage * rectangularity)
+
+@operation("scan")
+def find_document_corners(image, max_dim=800):
+    """
+    Find the corners of a document without user interaction.
+
+    The edge and contour search runs on a copy downscaled to max_dim pixels
+    on its longest side; the corners are scaled back to full resolution.
+
+    Args:
+        image: BGR image as numpy array, or LoadedImage
+        max_dim: Longest side of the copy used for detection
+
+    Returns:
+        Tuple of (corners, confidence): ordered (4, 2) float32 corners in
+        full-resolution coordinates (None if nothing was found) and a score
+        from 0 to 1
+    """
+    image = as_bgr(image)
+    height, width = image.shape[:2]
+    scale = min(1.0, max_dim / max(height, width))
+    with stage("resize"):
+        small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else image
+
+    with stage("edges"):
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        low_threshold, high_threshold = auto_canny_thresholds(gray)
+        edges = cv2.Canny(gray, low_threshold, high_threshold)
+        edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+
+    with stage("contours"):
+        contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)[:5]
+    image_area = small.shape[0] * small.shape[1]
+
+    best_quad, best_confidence = None, 0.0
+    for contour in contours:
+        perimeter = cv2.arcLength(contour, True)
+        quad = cv2.approxPolyDP(contour, 0.02 * perimeter, True)
+        if len(quad) == 4 and cv2.isContourConvex(quad):
+            confidence = _quad_confidence(quad, contour, image_area)
+        else:
+            # No clean quadrilateral, fall back to the bounding rotated box
+            quad = cv2.boxPoints(cv2.minAreaRect(contour)).reshape((4, 1, 2))
+            confidence = 0.5 * _quad_confidence(quad, contour, image_area)
+        if confidence > best_confidence:
+            best_quad, best_confidence = quad, confidence
+
+    if best_quad is None:
+        return None, 0.0
+    corners = best_quad.reshape((4, 2)).astype(np.float32) / scale
+    return order_points(corners), best_confidence
+
+@operation("scan")
+def scan_document_auto(image_path, output_path=None, max_dim=800):
+    """
+    Scan a document by detecting its corners automatically.
+
+    Args:
+        image_path: Path to input image
+        output_path: Path to save the transformed image (optional)
+        max_dim: Longest side of the copy used for detection
+
+    Returns:
+        Tuple of (transformed image or None, confidence)
+    """
+    image = as_bgr(image_path)
+    corners, confidence = find_document_corners(image, max_dim)
+    if corners is None:
+        return None, 0.0
+    transformed_image = four_point_transform(image, corners)
+    if output_path:
+        write_image(output_path, transformed_image)
+    return transformed_image, confidence
+
+def _scan_file(task):
+    """Scan one file of a batch (runs in a worker)"""
+    input_path, output_path, min_confidence, max_dim = task
+    image = as_bgr(input_path)
+    corners, confidence = find_document_corners(image, max_dim)
+    if corners is None or confidence < min_confidence:
+        return None, confidence
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    write_image(output_path, four_point_transform(image, corners))
+    return output_path, confidence
+
+def scan_documents_batch(inputs, output_dir, min_confidence=0.5, max_dim=800, workers=None,
+                         max_in_flight=None, use_threads=False, recursive=False, on_result=None):
+    """
+    Scan many documents in parallel with automatic corner detection.
+
+    Pages detected with a confidence below min_confidence are not written
+    but listed in the report, so they can go through detect_document.
+
+    Args:
+        inputs: Image paths, directories or glob patterns
+        output_dir: Directory to save the transformed images
+        min_confidence: Minimum confidence to accept a detection
+        max_dim: Longest side of the copy used for detection
+        workers: Number of workers (default: number of CPUs)
+        max_in_flight: Maximum number of queued images (default: 2 * workers)
+        use_threads: Use threads instead of processes
+        recursive: Whether to descend into subdirectories
+        on_result: Optional callback(input_path, (output_path, confidence), error) per file
+
+    Returns:
+        Batch report, with 'low_confidence' listing (path, confidence) pairs
+    """
+    paths = expand_inputs(inputs, recursive=recursive)
+    tasks = [(path, out, min_confidence, max_dim)
+             for path, out in zip(paths, output_paths(paths, output_dir, "_scan", ".png"))]
+
+    start = time.perf_counter()
+    processed = 0
+    failed = []
+    low_confidence = []
+    for task, result, error in run_batch(_scan_file, tasks, workers, max_in_flight, use_threads):
+        if error is not None:
+            failed.append((task[0], f"{type(error).__name__}: {error}"))
+        elif result[0] is None:
+            low_confidence.append((task[0], result[1]))
+        else:
+            processed += 1
+        if on_result:
+            on_result(task[0], result, error)
+
+    report = batch_report(processed, failed, time.perf_counter() - start)
+    report["low_confidence"] = low_confidence
+    return report
+
+def create_scan_profile(corners):
+    """
+    Precompute the warp for a fixed camera, so captures only need a remap.
+
+    The inverse perspective mapping is evaluated once for every output pixel
+    and stored as fixed-point cv2.remap maps.
+
+    Args:
+        corners: Four document corners in any order
+
+    Returns:
+        Scan profile dictionary with the ordered 'corners', the output
+        'size' as (width, height) and the remap maps 'map1' and 'map2'
+    """
+    rect = order_points(np.asarray(corners, dtype=np.float32))
+    M, (width, height) = _perspective_transform(rect)
+
+    # Source position of every output pixel
+    inverse = np.linalg.inv(M)
+    xs, ys = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+    denominator = inverse[2, 0] * xs + inverse[2, 1] * ys + inverse[2, 2]
+    map_x = ((inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]) / denominator).astype(np.float32)
+    map_y = ((inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]) / denominator).astype(np.float32)
+    map1, map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    return {'corners': rect, 'size': (width, height), 'map1': map1, 'map2': map2}
+
+def save_scan_profile(profile, path):
+    """Save a scan profile to a .npz file"""
+    np.savez(path, corners=profile['corners'], size=np.array(profile['size']),
+             map1=profile['map1'], map2=profile['map2'])
+
+def load_scan_profile(path):
+    """Load a scan profile saved with save_scan_profile"""
+    with np.load(path) as data:
+        return {'corners': data['corners'], 'size': tuple(int(v) for v in data['size']),
+                'map1': data['map1'], 'map2': data['map2']}
+
+@operation("scan")
+def apply_scan_profile(image, profile, out=None):
+    """
+    Warp a capture with a scan profile.
+
+    Args:
+        image: BGR image as numpy array, taken with the profile's camera setup
+        profile: Scan profile from create_scan_profile or load_scan_profile
+        out: Optional preallocated output array of the profile's size
+
+    Returns:
+        Transformed image (out, when given)
+    """
+    with stage("warp"):
+        return cv2.remap(image, profile['map1'], profile['map2'], cv2.INTER_LINEAR, dst=out)
+
+def scan_output_path(input_path, output_dir="output"):
+    """Output path for the scan of input_path: <output_dir>/<name>_scan.png"""
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, name + "_scan.png")
+
+@operation("scan")
+def scan_with_profile(image_path, profile, output_dir="output", out=None, writer=None):
+    """
+    Scan one capture with a scan profile and save it under its own name.
+
+    Args:
+        image_path: Path to input image
+        profile: Scan profile from create_scan_profile or load_scan_profile
+        output_dir: Directory to save the transformed image
+        out: Optional preallocated output array of the profile's size
+        writer: Optional ImageWriter saving the image in the background
+            (don't reuse out until its write has finished)
+
+    Returns:
+        Path of the saved image
+    """
+    image = as_bgr(image_path)
+    output_path = scan_output_path(image_path, output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    write_image(output_path, apply_scan_profile(image, profile, out), writer)
+    return output_path
+
 # Example usage
 if __name__ == "__main__":
     detect_document('samples/sample_image.jpg')  # Update the image path
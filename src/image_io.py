@@ -0,0 +1,290 @@
+"""
+Shared image loading.
+
+Operations accept a path, a numpy array (BGR or grayscale, as cv2.imread
+returns them) or a LoadedImage. A LoadedImage is decoded once and caches its
+conversions, so chained operations reuse one buffer and one grayscale.
+
+probe_image reads only the file header, and preview_image decodes at reduced
+resolution for a quick low-res pass before the full-resolution job.
+
+Indexed-color images (a uint8 label map and a small palette, see
+image_writer.write_indexed) are read with load_indexed and only expanded to
+BGR by expand_indexed. A .npy file is a label map when it has a
+.palette.json sidecar (see is_indexed), and otherwise a BGR or grayscale
+pixel array, as src.tiling reads it. Either can be passed wherever a path is
+accepted; a label map is expanded when its pixels are first needed.
+"""
+
+import json
+import os
+import threading
+
+import cv2
+import numpy as np
+from src.instrument import stage
+
+REDUCED_COLOR_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                       4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+class LoadedImage:
+    """
+    A BGR image with cached color conversions.
+
+    When only a path is given the file is decoded on first use, at 1/reduce
+    resolution. Each conversion is computed once even when several threads
+    ask for it at the same time.
+    """
+
+    def __init__(self, bgr=None, path=None, reduce=1):
+        self._bgr = bgr
+        self.path = path
+        self.reduce = reduce
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    @property
+    def bgr(self):
+        """BGR pixels, decoded from the path on first use"""
+        if self._bgr is None:
+            self._bgr = self._cached("bgr", lambda: _read(self.path, REDUCED_COLOR_FLAGS[self.reduce]))
+        return self._bgr
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    def _cached(self, name, convert):
+        if name not in self._cache:
+            with self._lock:
+                lock = self._locks.setdefault(name, threading.Lock())
+            with lock:
+                if name not in self._cache:
+                    self._cache[name] = convert()
+        return self._cache[name]
+
+    def release(self, *names):
+        """Drop cached conversions (rgb, gray, ...) that are no longer needed"""
+        for name in names:
+            self._cache.pop(name, None)
+
+    @property
+    def rgb(self):
+        """RGB version of the image"""
+        return self._cached("rgb", lambda: _convert(self.bgr, "rgb"))
+
+    @property
+    def gray(self):
+        """Luma grayscale (cv2.COLOR_BGR2GRAY)"""
+        return self._cached("gray", lambda: _convert(self.bgr, "gray"))
+
+    @property
+    def mean_gray(self):
+        """Channel-average grayscale, as used by the Sobel detector"""
+        return self._cached("mean_gray", lambda: _mean_gray(self.bgr))
+
+def cached(image, name, compute):
+    """
+    Intermediate result computed once per LoadedImage.
+
+    Args:
+        image: LoadedImage, or anything else to compute without caching
+        name: Cache key, e.g. "box_blur"
+        compute: Function without arguments computing the value
+
+    Returns:
+        The value
+    """
+    if isinstance(image, LoadedImage):
+        return image._cached(name, compute)
+    return compute()
+
+def load_image(image_path, reduce=1):
+    """
+    Decode an image file once.
+
+    Args:
+        image_path: Path to input image
+        reduce: Downscale factor (1, 2, 4 or 8); JPEGs are decoded directly
+            at the reduced size
+
+    Returns:
+        LoadedImage, or None if the file can't be read
+    """
+    if image_path.lower().endswith(".npy"):
+        # Expanded on first use
+        return LoadedImage(path=image_path, reduce=reduce) if os.path.isfile(image_path) else None
+    with stage("decode"):
+        bgr = cv2.imread(image_path, REDUCED_COLOR_FLAGS[reduce])
+    if bgr is None:
+        return None
+    return LoadedImage(bgr, image_path, reduce)
+
+def probe_image(image_path):
+    """
+    Read the size and format of an image from its header, without decoding it.
+
+    Args:
+        image_path: Path to input image
+
+    Returns:
+        Dictionary with width, height, channels and format, or None if the
+        file isn't a recognized image
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            return {"width": width, "height": height,
+                    "channels": len(img.getbands()), "format": img.format}
+    except (OSError, ValueError):
+        return None
+
+def preview_factor(width, height, max_dim=800):
+    """Largest reduce factor (1, 2, 4 or 8) keeping the longest side at least max_dim"""
+    factor = 1
+    while factor < 8 and max(width, height) // (factor * 2) >= max_dim:
+        factor *= 2
+    return factor
+
+def preview_image(image_path, max_dim=800):
+    """
+    Decode a reduced-resolution preview of an image.
+
+    The reduce factor is picked from the header so the preview's longest
+    side stays at least max_dim. JPEGs are decoded directly at that size
+    (libjpeg's scaled decoding, like PIL's draft mode), so a preview of a
+    large photo costs a fraction of a full decode.
+
+    Args:
+        image_path: Path to input image
+        max_dim: Minimum longest side of the preview
+
+    Returns:
+        LoadedImage (its reduce attribute holds the factor used)
+    """
+    info = probe_image(image_path)
+    reduce = preview_factor(info["width"], info["height"], max_dim) if info else 1
+    return LoadedImage(_read(image_path, REDUCED_COLOR_FLAGS[reduce]), image_path, reduce)
+
+def _read(image_path, flags=cv2.IMREAD_COLOR):
+    """Decode an image file, failing loudly like the operations always did"""
+    if image_path.lower().endswith(".npy"):
+        assert os.path.isfile(image_path), "file could not be read, check with os.path.exists()"
+        return _read_npy(image_path, flags)
+    with stage("decode"):
+        image = cv2.imread(image_path, flags)
+    assert image is not None, "file could not be read, check with os.path.exists()"
+    return image
+
+def _convert(image, target):
+    """Convert a BGR, BGRA or grayscale array to RGB or gray"""
+    if image.ndim == 2:
+        if target != "rgb":
+            return image
+        code = cv2.COLOR_GRAY2RGB
+    elif image.shape[2] == 4:
+        code = cv2.COLOR_BGRA2RGB if target == "rgb" else cv2.COLOR_BGRA2GRAY
+    else:
+        code = cv2.COLOR_BGR2RGB if target == "rgb" else cv2.COLOR_BGR2GRAY
+    with stage("grayscale" if target == "gray" else "to_rgb"):
+        return cv2.cvtColor(image, code)
+
+def _mean_gray(image):
+    """Average of the color channels, rounded down"""
+    if image.ndim == 2:
+        return np.asarray(image, dtype=np.uint8)
+    with stage("grayscale"):
+        total = image[..., 0].astype(np.uint16)
+        total += image[..., 1]
+        total += image[..., 2]
+        return (total // 3).astype(np.uint8)
+
+def as_bgr(image):
+    """BGR array of a path, array or LoadedImage"""
+    if isinstance(image, str):
+        return _read(image)
+    if isinstance(image, LoadedImage):
+        return image.bgr
+    return image
+
+def as_rgb(image):
+    """RGB array of a path, BGR array or LoadedImage"""
+    if isinstance(image, LoadedImage):
+        return image.rgb
+    return _convert(as_bgr(image), "rgb")
+
+def as_gray(image):
+    """Luma grayscale of a path, array or LoadedImage"""
+    if isinstance(image, str):
+        return _read(image, cv2.IMREAD_GRAYSCALE)
+    if isinstance(image, LoadedImage):
+        return image.gray
+    return _convert(image, "gray")
+
+def as_mean_gray(image):
+    """Channel-average grayscale of a path, array or LoadedImage"""
+    if isinstance(image, LoadedImage):
+        return image.mean_gray
+    return _mean_gray(as_bgr(image))
+
+def indexed_palette_path(labels_path):
+    """Path of the palette sidecar of a .npy label map"""
+    return os.path.splitext(labels_path)[0] + ".palette.json"
+
+def load_indexed(path, mmap=False):
+    """
+    Read an indexed-color image without expanding it.
+
+    Args:
+        path: Palettized PNG, or .npy label map with its .palette.json sidecar
+        mmap: Memory-map a .npy label map instead of reading it
+
+    Returns:
+        Tuple of (labels, palette): (H, W) uint8 indices into the (K, 3)
+        uint8 RGB palette
+    """
+    with stage("decode"):
+        if path.lower().endswith(".npy"):
+            labels = np.load(path, mmap_mode="r" if mmap else None)
+            with open(indexed_palette_path(path)) as f:
+                palette = np.array(json.load(f)["palette"], dtype=np.uint8).reshape((-1, 3))
+            return labels, palette
+
+        from PIL import Image
+
+        with Image.open(path) as img:
+            if img.mode != "P":
+                raise ValueError(f"not a palettized image: {path} (mode {img.mode})")
+            labels = np.asarray(img)
+            palette = np.array(img.getpalette(), dtype=np.uint8).reshape((-1, 3))
+    return labels, palette
+
+def expand_indexed(labels, palette):
+    """BGR image of a label map and its RGB palette"""
+    with stage("expand"):
+        return np.asarray(palette, dtype=np.uint8)[:, ::-1][labels]
+
+def is_indexed(path):
+    """Whether a path is a .npy label map, i.e. has a palette sidecar"""
+    return path.lower().endswith(".npy") and os.path.isfile(indexed_palette_path(path))
+
+def _read_npy(image_path, flags):
+    """Read a .npy label map or pixel array like cv2.imread would decode an image with these flags"""
+    reduce = {flag: factor for factor, flag in REDUCED_COLOR_FLAGS.items()}.get(flags, 1)
+    if not is_indexed(image_path):
+        image = np.load(image_path, mmap_mode="r")[::reduce, ::reduce]
+        if flags == cv2.IMREAD_GRAYSCALE or image.ndim == 2:
+            image = _convert(np.ascontiguousarray(image), "gray")
+            return image if flags == cv2.IMREAD_GRAYSCALE else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        return np.array(image)
+
+    labels, palette = load_indexed(image_path, mmap=True)
+    labels = labels[::reduce, ::reduce]
+    if flags == cv2.IMREAD_GRAYSCALE:
+        # Convert the few palette colors instead of every pixel
+        palette_bgr = np.ascontiguousarray(palette[:, ::-1]).reshape((-1, 1, 3))
+        return cv2.cvtColor(palette_bgr, cv2.COLOR_BGR2GRAY).reshape(-1)[labels]
+    return expand_indexed(labels, palette)
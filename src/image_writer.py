@@ -0,0 +1,251 @@
+"""
+Image encoding and writing.
+
+write_image and encode_image apply per-format settings (PNG compression
+level, JPEG and WebP quality). configure() sets the process-wide defaults
+and a call can override them. An ImageWriter encodes and writes on background
+threads through a bounded queue, so computing the next image overlaps with
+encoding the previous ones. cv2.imencode releases the GIL while it works.
+
+Images with few colors can be written as a label map plus palette with
+write_indexed, without building the expanded BGR image: a palettized PNG,
+or a raw .npy label map with a .palette.json sidecar.
+"""
+
+import io
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from src.instrument import stage
+
+# Formats write_indexed can store a label map and palette in
+INDEXED_EXTENSIONS = (".png", ".npy")
+
+_settings = {"png_compression": None, "jpeg_quality": None, "webp_quality": None}
+
+def configure(png_compression=None, jpeg_quality=None, webp_quality=None):
+    """
+    Set the default encoding settings of this process.
+
+    Args:
+        png_compression: PNG zlib level 0-9 (None: OpenCV's default, the fastest)
+        jpeg_quality: JPEG quality 0-100 (None: OpenCV's default, 95)
+        webp_quality: WebP quality 1-100 (None: OpenCV's default)
+    """
+    for name, value, low, high in (("png_compression", png_compression, 0, 9),
+                                   ("jpeg_quality", jpeg_quality, 0, 100), ("webp_quality", webp_quality, 1, 100)):
+        if value is not None and not low <= value <= high:
+            raise ValueError(f"{name} must be between {low} and {high}, got {value}")
+    _settings.update(png_compression=png_compression, jpeg_quality=jpeg_quality,
+                     webp_quality=webp_quality)
+
+def encode_params(extension, **settings):
+    """cv2.imencode parameters for a file extension, from the defaults and overrides"""
+    settings = dict(_settings, **{k: v for k, v in settings.items() if v is not None})
+    extension = extension.lower()
+    if extension == ".png" and settings["png_compression"] is not None:
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(settings["png_compression"])]
+    if extension in (".jpg", ".jpeg") and settings["jpeg_quality"] is not None:
+        return [cv2.IMWRITE_JPEG_QUALITY, int(settings["jpeg_quality"])]
+    if extension == ".webp" and settings["webp_quality"] is not None:
+        return [cv2.IMWRITE_WEBP_QUALITY, int(settings["webp_quality"])]
+    return []
+
+def encode_image(image, extension=".png", **settings):
+    """
+    Encode an image in memory.
+
+    Args:
+        image: BGR, BGRA or grayscale numpy array
+        extension: Format, as a file extension
+        **settings: Overrides of the configure() settings
+
+    Returns:
+        Encoded bytes
+    """
+    with stage("encode"):
+        ok, encoded = cv2.imencode(extension, image, encode_params(extension, **settings))
+    if not ok:
+        raise IOError(f"could not encode image as {extension}")
+    return encoded.tobytes()
+
+def write_image(output_path, image, writer=None, **settings):
+    """
+    Encode and write an image file.
+
+    Args:
+        output_path: Path to save the image, its extension picks the format
+        image: BGR, BGRA or grayscale numpy array
+        writer: Optional ImageWriter to write in the background
+        **settings: Overrides of the configure() settings
+
+    Returns:
+        A Future when a writer is given, otherwise None
+    """
+    if writer is not None:
+        return writer.submit(output_path, image, **settings)
+    encoded = encode_image(image, os.path.splitext(output_path)[1], **settings)
+    with stage("write"):
+        with open(output_path, "wb") as f:
+            f.write(encoded)
+    return None
+
+def _indexed_arrays(labels, palette):
+    """uint8 labels and (K, 3) uint8 palette, ValueError when they don't fit in uint8"""
+    palette = np.asarray(palette, dtype=np.uint8).reshape((-1, 3))
+    if len(palette) > 256:
+        raise ValueError(f"indexed images hold at most 256 colors, got {len(palette)}")
+    labels = np.asarray(labels)
+    if labels.dtype != np.uint8:
+        # Casting would wrap labels of larger palettes onto other colors
+        if labels.size and (labels.min() < 0 or labels.max() >= len(palette)):
+            raise ValueError(f"labels must index the {len(palette)} palette colors")
+        labels = labels.astype(np.uint8)
+    return labels, palette
+
+def encode_indexed(labels, palette, **settings):
+    """
+    Encode a label map and its palette as a palettized PNG in memory.
+
+    Pixels of palettes with up to 16 colors are packed in 1, 2 or 4 bits.
+
+    Args:
+        labels: (H, W) uint8 array of palette indices
+        palette: (K, 3) RGB palette, K <= 256
+        **settings: Overrides of the configure() settings (png_compression)
+
+    Returns:
+        Encoded bytes
+    """
+    from PIL import Image
+
+    labels, palette = _indexed_arrays(labels, palette)
+    level = dict(_settings, **{k: v for k, v in settings.items() if v is not None})["png_compression"]
+    with stage("encode"):
+        labels = np.ascontiguousarray(labels, dtype=np.uint8)
+        img = Image.frombytes("P", (labels.shape[1], labels.shape[0]), labels.tobytes())
+        img.putpalette(palette.tobytes())
+        buffer = io.BytesIO()
+        # Default to OpenCV's fastest level, like encode_image
+        img.save(buffer, "PNG", compress_level=1 if level is None else int(level))
+    return buffer.getvalue()
+
+def write_indexed(output_path, labels, palette, writer=None, **settings):
+    """
+    Write a label map and its palette without expanding them to BGR.
+
+    Args:
+        output_path: .png for a palettized PNG, or .npy for the raw label map
+            with the palette in a .palette.json sidecar (see
+            image_io.indexed_palette_path)
+        labels: (H, W) uint8 array of palette indices
+        palette: (K, 3) RGB palette, K <= 256
+        writer: Optional ImageWriter to write in the background
+        **settings: Overrides of the configure() settings
+
+    Returns:
+        A Future when a writer is given, otherwise None
+    """
+    from src.image_io import indexed_palette_path
+
+    if writer is not None:
+        return writer.submit_indexed(output_path, labels, palette, **settings)
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension == ".npy":
+        labels, palette = _indexed_arrays(labels, palette)
+        with stage("write"):
+            np.save(output_path, labels)
+            with open(indexed_palette_path(output_path), "w") as f:
+                json.dump({"palette": palette.tolist()}, f)
+        return None
+    if extension not in INDEXED_EXTENSIONS:
+        raise ValueError(f"indexed images are written as {' or '.join(INDEXED_EXTENSIONS)}, not {extension}")
+    encoded = encode_indexed(labels, palette, **settings)
+    with stage("write"):
+        with open(output_path, "wb") as f:
+            f.write(encoded)
+    return None
+
+class ImageWriter:
+    """
+    Background image encoder and writer.
+
+    At most max_pending images are queued; submit blocks beyond that, so a
+    fast producer can't fill the memory with images waiting to be encoded.
+    Submitted arrays must not be modified until their write finishes.
+    Errors are raised by flush() and close() (and by the returned futures).
+
+    Args:
+        workers: Number of encoding threads
+        max_pending: Maximum queued images
+        **settings: Encoding settings for this writer, see configure()
+    """
+
+    def __init__(self, workers=2, max_pending=8, **settings):
+        self.settings = settings
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def _submit(self, func, *args, **kwargs):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._pending.append(future)
+            # Forget finished writes that succeeded
+            while self._pending and self._pending[0].done() and self._pending[0].exception() is None:
+                self._pending.popleft()
+        return future
+
+    def submit(self, output_path, image, **settings):
+        """Queue an image to be written to output_path, returns a Future"""
+        return self._submit(write_image, output_path, image, **dict(self.settings, **settings))
+
+    def submit_indexed(self, output_path, labels, palette, **settings):
+        """Queue a label map and palette to be written with write_indexed, returns a Future"""
+        return self._submit(write_indexed, output_path, labels, palette, **dict(self.settings, **settings))
+
+    def encode(self, image, extension=".png", **settings):
+        """Queue an image to be encoded in memory, returns a Future of the bytes"""
+        return self._submit(encode_image, image, extension, **dict(self.settings, **settings))
+
+    def flush(self):
+        """Wait for every queued image, raising the first error"""
+        error = None
+        while True:
+            with self._lock:
+                if not self._pending:
+                    break
+                future = self._pending.popleft()
+            exception = future.exception()
+            if exception is not None and error is None:
+                error = exception
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Flush and stop the encoding threads"""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,244 @@
+"""
+Opt-in per-stage timing and memory instrumentation.
+
+Operations wrap their steps (decode, grayscale, blur, fit, encode, ...) in
+stage() blocks. While instrumentation is off, which is the default, a stage
+costs one global check. After enable() every finished stage produces a record
+that is passed to the registered hooks:
+
+    {"stage": "deshade/fit", "name": "fit", "operation": "deshade",
+     "wall_s": ..., "cpu_s": ..., "mem_peak_bytes": ..., "pid": ..., ...}
+
+memory="tracemalloc" measures the peak of Python and NumPy allocations above
+the stage's starting point (OpenCV's own buffers aren't traced).
+memory="rss" records how much the process peak RSS grew during the stage.
+Stages nest per thread. Memory figures of stages running concurrently in
+several threads overlap.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+_enabled = False
+_memory = None
+_hooks = []
+_local = threading.local()
+
+def enable(memory=None, log=None):
+    """
+    Turn instrumentation on.
+
+    Args:
+        memory: None, "tracemalloc" or "rss"
+        log: Optional path or file object receiving one JSON line per stage
+            ("-" for stderr)
+    """
+    global _enabled, _memory
+    if memory not in (None, "tracemalloc", "rss"):
+        raise ValueError(f"Unknown memory mode: {memory}")
+    if memory == "tracemalloc" and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _memory = memory
+    if log is not None:
+        add_hook(json_log_hook(log))
+    _enabled = True
+
+def disable():
+    """Turn instrumentation off and remove all hooks"""
+    global _enabled, _memory
+    _enabled = False
+    if _memory == "tracemalloc" and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _memory = None
+    for hook in list(_hooks):
+        remove_hook(hook)
+
+def is_enabled():
+    """Whether stages are being recorded"""
+    return _enabled
+
+def add_hook(hook):
+    """Register a function called with each finished stage record"""
+    _hooks.append(hook)
+    return hook
+
+def remove_hook(hook):
+    """Unregister a hook, closing the log file of json_log_hook hooks"""
+    if hook in _hooks:
+        _hooks.remove(hook)
+    close = getattr(hook, "close", None)
+    if close is not None:
+        close()
+
+def json_log_hook(log):
+    """
+    Hook writing each record as one JSON line.
+
+    Args:
+        log: Path (opened for appending), "-" for stderr or a file object
+
+    Returns:
+        The hook function; remove_hook closes a file it opened
+    """
+    owned = isinstance(log, str) and log != "-"
+    stream = sys.stderr if log == "-" else open(log, "a", buffering=1) if owned else log
+    lock = threading.Lock()
+
+    def hook(record):
+        line = json.dumps(record, default=str)
+        with lock:
+            stream.write(line + "\n")
+            stream.flush()
+
+    hook.close = stream.close if owned else lambda: None
+    return hook
+
+def _stack():
+    """Open stages of the current thread"""
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+def _peak_rss_kb():
+    """Peak RSS of the process in KB, None where unsupported"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+class _Stage:
+    """Measurements of one open stage"""
+
+    def __init__(self, name, fields, parent):
+        self.name = name
+        self.fields = fields
+        self.path = f"{parent.path}/{name}" if parent else name
+        self.operation = fields.pop("operation", None) or (parent.operation if parent else name)
+        self.traced_peak = 0
+
+    def start(self):
+        if _memory == "tracemalloc":
+            current, peak = tracemalloc.get_traced_memory()
+            parent = _stack()[-2] if len(_stack()) > 1 else None
+            if parent is not None:
+                parent.traced_peak = max(parent.traced_peak, peak)
+            self.traced_start = current
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        elif _memory == "rss":
+            self.rss_start = _peak_rss_kb()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def finish(self, error):
+        record = {"stage": self.path, "name": self.name, "operation": self.operation,
+                  "wall_s": time.perf_counter() - self.wall_start,
+                  "cpu_s": time.process_time() - self.cpu_start,
+                  "pid": os.getpid(), "thread": threading.current_thread().name}
+        if _memory == "tracemalloc":
+            peak = max(self.traced_peak, tracemalloc.get_traced_memory()[1])
+            record["mem_peak_bytes"] = peak - self.traced_start
+            # The parent's peak includes this stage
+            stack = _stack()
+            if len(stack) > 1:
+                stack[-2].traced_peak = max(stack[-2].traced_peak, peak)
+        elif _memory == "rss" and self.rss_start is not None:
+            record["rss_peak_growth_kb"] = _peak_rss_kb() - self.rss_start
+        if error is not None:
+            record["error"] = f"{type(error).__name__}: {error}"
+        record.update(self.fields)
+        return record
+
+@contextmanager
+def _measure(name, fields):
+    """Record a stage and pass it to the hooks when it ends"""
+    stack = _stack()
+    current = _Stage(name, fields, stack[-1] if stack else None)
+    stack.append(current)
+    current.start()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        record = current.finish(error)
+        stack.pop()
+        for hook in list(_hooks):
+            hook(record)
+
+def stage(name, **fields):
+    """
+    Context manager timing one stage of an operation.
+
+    Args:
+        name: Stage name, nested stages are recorded as "outer/inner"
+        **fields: Extra values added to the record (e.g. input=path)
+    """
+    if not _enabled:
+        return nullcontext()
+    return _measure(name, fields)
+
+def operation(name):
+    """
+    Decorator recording a function as the top-level stage of an operation.
+
+    When the function is called from inside a stage of the same operation
+    (a path wrapper calling its array variant) no extra level is added.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            stack = _stack()
+            if stack and stack[-1].operation == name and stack[-1].name == name:
+                return func(*args, **kwargs)
+            with _measure(name, {"operation": name}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def collect(memory=None):
+    """
+    Record the stages run inside the block.
+
+    Yields:
+        List that receives the stage records as they finish
+    """
+    records = []
+    was_enabled = _enabled
+    if not was_enabled:
+        enable(memory)
+    hook = add_hook(records.append)
+    try:
+        yield records
+    finally:
+        remove_hook(hook)
+        if not was_enabled:
+            disable()
+
+def summarize(records):
+    """
+    Total wall and CPU time per stage path.
+
+    Returns:
+        Dictionary mapping stage paths to {"calls", "wall_s", "cpu_s"}
+    """
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record["stage"], {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+        total["calls"] += 1
+        total["wall_s"] += record["wall_s"]
+        total["cpu_s"] += record["cpu_s"]
+    return totals
@@ -0,0 +1,321 @@
+"""
+On-disk palette index for finding images with similar colors.
+
+An index is a directory holding the palettes of a corpus as fixed-size
+arrays, read through memory maps so queries don't load the whole index:
+
+    colors.u8    (rows, num_colors, 3) uint8 RGB palettes, padded with zeros
+    sizes.u8     (rows,) number of colors of each palette, 0 for removed rows
+    paths.jsonl  one JSON string per row, the image path
+    index.json   format version and num_colors
+
+Rows are only ever appended; removing an image zeroes its size and compact()
+rewrites the files without the removed rows. A row counts once its path is
+written, so an interrupted append leaves no half-written entry.
+
+Queries compare palettes as sets of colors: the distance from a target
+palette to an image's palette is the mean distance from each target color to
+the nearest image color, averaged with the same measure in the other
+direction. A single target color finds the images containing the closest
+color. Distances are computed in float32 over chunks of rows, so memory stays
+bounded for millions of entries.
+"""
+
+import json
+import os
+
+import numpy as np
+from src.batch import run_batch
+from src.cache import cached
+from src.image_io import as_bgr
+
+INDEX_VERSION = 1
+
+_COLORS = "colors.u8"
+_SIZES = "sizes.u8"
+_PATHS = "paths.jsonl"
+_META = "index.json"
+
+class PaletteIndex:
+    """
+    Palette index stored in a directory, created when it doesn't exist.
+
+    Args:
+        directory: Index directory
+        num_colors: Maximum colors per palette (only used when creating the index)
+    """
+
+    def __init__(self, directory, num_colors=8):
+        self.directory = directory
+        meta_path = os.path.join(directory, _META)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("version") != INDEX_VERSION:
+                raise ValueError(f"unsupported palette index version {meta.get('version')} in {directory}")
+            self.num_colors = meta["num_colors"]
+        else:
+            if not 1 <= num_colors <= 255:
+                raise ValueError(f"num_colors must be between 1 and 255, got {num_colors}")
+            os.makedirs(directory, exist_ok=True)
+            self.num_colors = num_colors
+            with open(meta_path, "w") as f:
+                json.dump({"version": INDEX_VERSION, "num_colors": num_colors}, f)
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        """Read the paths and sizes, and drop any half-written rows"""
+        self.paths = []
+        if os.path.exists(self._path(_PATHS)):
+            with open(self._path(_PATHS)) as f:
+                self.paths = [json.loads(line) for line in f if line.strip()]
+        row_bytes = self.num_colors * 3
+        colors_rows = os.path.getsize(self._path(_COLORS)) // row_bytes if os.path.exists(self._path(_COLORS)) else 0
+        sizes_rows = os.path.getsize(self._path(_SIZES)) if os.path.exists(self._path(_SIZES)) else 0
+        self.rows = min(len(self.paths), colors_rows, sizes_rows)
+        del self.paths[self.rows:]
+        for name, size in ((_COLORS, self.rows * row_bytes), (_SIZES, self.rows)):
+            if os.path.exists(self._path(name)) and os.path.getsize(self._path(name)) != size:
+                with open(self._path(name), "r+b") as f:
+                    f.truncate(size)
+
+        self._sizes = self._memmap(_SIZES, (self.rows,)).copy() if self.rows else np.zeros(0, np.uint8)
+        self._rows = {}
+        for row, path in enumerate(self.paths):
+            if self._sizes[row]:
+                self._rows[path] = row
+        self._colors = None
+
+    def _memmap(self, name, shape):
+        return np.memmap(self._path(name), dtype=np.uint8, mode="r", shape=shape)
+
+    @property
+    def colors(self):
+        """Read-only memory map of the (rows, num_colors, 3) palettes"""
+        if self._colors is None:
+            if not self.rows:
+                return np.zeros((0, self.num_colors, 3), dtype=np.uint8)
+            self._colors = self._memmap(_COLORS, (self.rows, self.num_colors, 3))
+        return self._colors
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, path):
+        return path in self._rows
+
+    def palette(self, path):
+        """Palette of an indexed image as a list of RGB colors"""
+        row = self._rows[path]
+        return self.colors[row, :self._sizes[row]].tolist()
+
+    def _encode(self, colors):
+        """(num_colors, 3) uint8 row and size of a palette"""
+        colors = np.asarray(colors, dtype=np.float64).reshape((-1, 3))[:self.num_colors]
+        if not len(colors):
+            raise ValueError("empty palette")
+        row = np.zeros((self.num_colors, 3), dtype=np.uint8)
+        row[:len(colors)] = np.clip(np.rint(colors), 0, 255)
+        return row, len(colors)
+
+    def add_many(self, items):
+        """
+        Add or replace the palettes of several images in one append.
+
+        Args:
+            items: Iterable of (path, colors) with colors a list of RGB values
+        """
+        # The last palette wins when a path is given twice
+        items = list(dict(items).items())
+        if not items:
+            return
+        encoded = [self._encode(colors) for _, colors in items]
+        replaced = [self._rows[path] for path, _ in items if path in self._rows]
+
+        with open(self._path(_COLORS), "ab") as f:
+            f.write(np.stack([row for row, _ in encoded]).tobytes())
+        with open(self._path(_SIZES), "ab") as f:
+            f.write(bytes(size for _, size in encoded))
+        # Rows count once their paths are written
+        with open(self._path(_PATHS), "a") as f:
+            f.write("".join(json.dumps(path) + "\n" for path, _ in items))
+
+        self._mark_removed(replaced)
+        start = self.rows
+        self.paths.extend(path for path, _ in items)
+        self._sizes = np.concatenate([self._sizes, np.array([size for _, size in encoded], dtype=np.uint8)])
+        self.rows = len(self.paths)
+        for row, (path, _) in enumerate(items, start):
+            self._rows[path] = row
+        self._colors = None
+
+    def add(self, path, colors):
+        """Add or replace the palette of one image"""
+        self.add_many([(path, colors)])
+
+    def _mark_removed(self, rows):
+        """Zero the sizes of rows on disk and in memory"""
+        if not rows:
+            return
+        with open(self._path(_SIZES), "r+b") as f:
+            for row in rows:
+                f.seek(row)
+                f.write(b"\0")
+                self._sizes[row] = 0
+
+    def remove(self, *paths):
+        """Remove images from the index, returns how many were indexed"""
+        rows = [self._rows.pop(path) for path in set(paths) if path in self._rows]
+        self._mark_removed(rows)
+        return len(rows)
+
+    def compact(self, chunk_rows=1 << 16):
+        """Rewrite the index without its removed and replaced rows"""
+        live = np.flatnonzero(self._sizes)
+        if len(live) == self.rows:
+            return
+        temp = {name: self._path(name + ".tmp") for name in (_COLORS, _SIZES, _PATHS)}
+        with open(temp[_COLORS], "wb") as colors_file, open(temp[_SIZES], "wb") as sizes_file, \
+                open(temp[_PATHS], "w") as paths_file:
+            for start in range(0, len(live), chunk_rows):
+                rows = live[start:start + chunk_rows]
+                colors_file.write(np.ascontiguousarray(self.colors[rows]).tobytes())
+                sizes_file.write(self._sizes[rows].tobytes())
+                paths_file.write("".join(json.dumps(self.paths[row]) + "\n" for row in rows))
+        self._colors = None
+        # Paths last: until it is replaced, the old paths file bounds the rows
+        for name in (_COLORS, _SIZES, _PATHS):
+            os.replace(temp[name], self._path(name))
+        self._load()
+
+    def distances(self, colors, symmetric=True, chunk_rows=1 << 16):
+        """
+        Distance of every row to a target palette.
+
+        Args:
+            colors: Target RGB color or list of colors
+            symmetric: Also measure how well the target covers each palette
+                (ignored for a single color)
+            chunk_rows: Rows compared at a time
+
+        Returns:
+            float32 array with one distance per row, inf for removed rows
+        """
+        target = np.asarray(colors, dtype=np.float32).reshape((-1, 3))
+        symmetric = symmetric and len(target) > 1
+        result = np.full(self.rows, np.inf, dtype=np.float32)
+        slots = np.arange(self.num_colors)
+        for start in range(0, self.rows, chunk_rows):
+            palettes = np.asarray(self.colors[start:start + chunk_rows], dtype=np.float32)
+            sizes = self._sizes[start:start + chunk_rows]
+            valid = slots[None, :] < sizes[:, None]
+
+            # (rows, palette colors, target colors) Euclidean distances, from
+            # |p - t|^2 = |p|^2 - 2 p.t + |t|^2 to avoid a 4D difference array
+            d = palettes @ (-2 * target.T)
+            d += np.einsum("nkc,nkc->nk", palettes, palettes)[:, :, None]
+            d += np.einsum("tc,tc->t", target, target)
+            np.sqrt(np.maximum(d, 0, out=d), out=d)
+            # Padding slots are infinitely far from every target color
+            d += np.where(valid, np.float32(0), np.float32(np.inf))[:, :, None]
+
+            # Reduce the short color axes slice by slice, which is much
+            # faster than numpy's reductions over them
+            nearest_image = d[:, 0].copy()
+            for j in range(1, self.num_colors):
+                np.minimum(nearest_image, d[:, j], out=nearest_image)
+            forward = _row_mean(nearest_image)
+            if symmetric:
+                nearest_target = d[:, :, 0].copy()
+                for j in range(1, len(target)):
+                    np.minimum(nearest_target, d[:, :, j], out=nearest_target)
+                nearest_target[~valid] = 0
+                forward = (forward + _row_mean(nearest_target) * self.num_colors / np.maximum(sizes, 1)) / 2
+            forward[sizes == 0] = np.inf
+            result[start:start + chunk_rows] = forward
+        return result
+
+    def query(self, colors, k=10, symmetric=True):
+        """
+        Images whose palettes are nearest to a target palette or color.
+
+        Args:
+            colors: Target RGB color or list of colors
+            k: Number of results
+            symmetric: See distances()
+
+        Returns:
+            List of (path, distance), nearest first
+        """
+        distances = self.distances(colors, symmetric)
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        return [(self.paths[row], float(distances[row])) for row in nearest]
+
+def _row_mean(values):
+    """Mean of each row of a float32 array with few columns"""
+    total = values[:, 0].copy()
+    for j in range(1, values.shape[1]):
+        total += values[:, j]
+    return total / values.shape[1]
+
+def _palette_task(task):
+    """Extract the palette of one file (runs in a pool worker)"""
+    from src.color_extractor import extract_bright_colorful_colors_from_array
+
+    path, _, options = task
+    params = {"num_colors": options["num_colors"], "method": options["method"],
+              "max_samples": options["max_samples"], "bits": options["bits"]}
+    # Same cache entries as extract_bright_colorful_colors
+    return cached(options["cache"], "colors", path,
+                  params, lambda: extract_bright_colorful_colors_from_array(as_bgr(path), **params))
+
+def index_images(index, paths, method="histogram", max_samples=100000, bits=5, workers=None,
+                 max_in_flight=None, use_threads=False, cache=None, refresh=False, batch_rows=1000,
+                 callback=None):
+    """
+    Extract the palettes of images in parallel and add them to an index.
+
+    Args:
+        index: PaletteIndex
+        paths: Image paths
+        method: Color extraction method, see extract_bright_colorful_colors
+        max_samples: Pixels to sample for the "sample" method
+        bits: Bits per channel for the "histogram" method
+        workers: Pool size (default: number of CPUs)
+        max_in_flight: Maximum queued images (default: 2 x workers)
+        use_threads: Use threads instead of processes
+        cache: Optional ResultCache shared with the colors command
+        refresh: Re-extract images that are already indexed
+        batch_rows: Palettes buffered before each append to the index
+        callback: Optional function called with (path, colors, error) per image
+
+    Returns:
+        Tuple of (number of images added, list of (path, error message))
+    """
+    paths = [path for path in paths if refresh or path not in index]
+    options = {"num_colors": index.num_colors, "method": method, "max_samples": max_samples, "bits": bits,
+               "cache": cache}
+    tasks = [(path, None, options) for path in paths]
+    added, failed, pending = 0, [], []
+    for task, colors, error in run_batch(_palette_task, tasks, workers, max_in_flight, use_threads):
+        if error is None and not len(colors):
+            error = RuntimeError("no colors extracted")
+        if error is None:
+            pending.append((task[0], colors))
+        else:
+            failed.append((task[0], f"{type(error).__name__}: {error}"))
+        if callback is not None:
+            callback(task[0], colors, error)
+        if len(pending) >= batch_rows:
+            index.add_many(pending)
+            added += len(pending)
+            pending = []
+    index.add_many(pending)
+    return added + len(pending), failed
@@ -0,0 +1,259 @@
+"""
+Declarative multi-operation pipelines.
+
+A pipeline is a DAG of steps run in memory: each step applies one operation
+to the output of another step (or to the input image), so nothing is
+written to disk and decoded again between steps. For example, in JSON (YAML
+works the same when PyYAML is installed):
+
+    {"steps": [
+        {"name": "page", "op": "scan", "params": {"max_dim": 800}},
+        {"name": "flat", "op": "deshade", "input": "page",
+         "params": {"fit_masked_only": true, "max_samples": 100000},
+         "output": "{stem}_flat.png"},
+        {"name": "colors", "op": "colors", "input": "flat", "params": {"method": "histogram"}},
+        {"name": "edges", "op": "canny", "input": "flat", "output": "{stem}_edges.png"}
+    ]}
+
+Every step's output is held in a LoadedImage, so conversions shared by the
+steps reading it (RGB, grayscale, the channel-average grayscale and Sobel's
+box blur) are computed once. A conversion is released as soon as no pending
+step needs it, and a step's output as soon as all the steps reading it have
+finished. Steps whose inputs are ready run concurrently on a thread pool.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+from src.image_io import LoadedImage, as_bgr
+from src.image_writer import write_image
+from src.instrument import stage
+
+# Name of the pipeline's input image, the default input of a step
+INPUT = "input"
+
+def _scan(image, corners=None, max_dim=800, min_confidence=0.5):
+    from src.document_scanner import find_document_corners, four_point_transform, order_points
+
+    if corners is None:
+        corners, confidence = find_document_corners(image, max_dim)
+        if corners is None or confidence < min_confidence:
+            raise ValueError(f"no document found (confidence {confidence:.2f})")
+    return four_point_transform(image, order_points(np.asarray(corners, dtype=np.float32)))
+
+def _deshade(image, palette=None, **params):
+    from src.remove_shading import remove_shading_and_keep_colors_from_array, apply_shading_palette, load_palette
+
+    if palette is not None:
+        return apply_shading_palette(image, load_palette(palette) if isinstance(palette, str) else palette)
+    return remove_shading_and_keep_colors_from_array(image, **params)
+
+def _colors(image, **params):
+    from src.color_extractor import extract_bright_colorful_colors_from_array
+
+    return extract_bright_colorful_colors_from_array(image, **params)
+
+def _canny(image, **params):
+    from src.canny_edge_detector import detect_edges_canny_from_array
+
+    return detect_edges_canny_from_array(image, **params)
+
+def _sobel(image, **params):
+    from src.sobel_edge_detector import detect_edges_sobel_from_array
+
+    return detect_edges_sobel_from_array(image, **params)[2]
+
+def _warp(image, profile):
+    from src.document_scanner import apply_scan_profile, load_scan_profile
+
+    return apply_scan_profile(as_bgr(image), load_scan_profile(profile) if isinstance(profile, str) else profile)
+
+# Operation name -> (function, conversions of its input it reads). The
+# function takes a LoadedImage and the step's params and returns an image
+# (numpy array) or data.
+OPERATIONS = {
+    "scan": (_scan, ()),
+    "warp": (_warp, ()),
+    "deshade": (_deshade, ("rgb", "gray")),
+    "colors": (_colors, ("rgb",)),
+    "canny": (_canny, ("gray",)),
+    "sobel": (_sobel, ("mean_gray", "box_blur")),
+}
+
+# Operations returning data rather than an image, so no step can read them
+DATA_OPERATIONS = ("colors",)
+
+class Step:
+    """
+    One operation of a pipeline.
+
+    Args:
+        name: Unique step name, other steps refer to it as their input
+        op: Operation name, see OPERATIONS
+        input: Name of the step whose output this step reads (default: the
+            pipeline input)
+        params: Keyword arguments of the operation
+        output: Optional file name template to save the result, "{stem}" is
+            replaced by the input's file name without extension
+    """
+
+    def __init__(self, name, op, input=INPUT, params=None, output=None):
+        self.name = name
+        self.op = op
+        self.input = input
+        self.params = dict(params or {})
+        self.output = output
+
+    def __repr__(self):
+        return f"Step({self.name!r}, {self.op!r}, input={self.input!r})"
+
+def load_spec(path):
+    """
+    Read a pipeline spec from a JSON or YAML file.
+
+    Returns:
+        Spec dictionary with a "steps" list
+    """
+    with open(path) as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("YAML pipeline specs need PyYAML (pip install pyyaml), or use JSON")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+class Pipeline:
+    """
+    A DAG of steps run in memory.
+
+    Args:
+        steps: List of Step objects, or of dictionaries with the Step arguments
+        workers: Maximum steps running at the same time (default: number of CPUs)
+    """
+
+    def __init__(self, steps, workers=None):
+        self.steps = [step if isinstance(step, Step) else Step(**step) for step in steps]
+        self.workers = workers or os.cpu_count() or 1
+        self._validate()
+
+    @classmethod
+    def from_spec(cls, spec, workers=None):
+        """Pipeline from a spec dictionary or the path of a JSON/YAML spec file"""
+        if isinstance(spec, str):
+            spec = load_spec(spec)
+        return cls(spec["steps"], workers or spec.get("workers"))
+
+    def _validate(self):
+        names = set()
+        ops = {step.name: step.op for step in self.steps}
+        for step in self.steps:
+            if step.name in names or step.name == INPUT:
+                raise ValueError(f"duplicate step name: {step.name!r}")
+            if step.op not in OPERATIONS:
+                raise ValueError(f"unknown operation {step.op!r} in step {step.name!r} "
+                                 f"(use {', '.join(OPERATIONS)})")
+            names.add(step.name)
+        for step in self.steps:
+            if step.input != INPUT and step.input not in names:
+                raise ValueError(f"step {step.name!r} reads unknown step {step.input!r}")
+            if ops.get(step.input) in DATA_OPERATIONS:
+                raise ValueError(f"step {step.name!r} reads step {step.input!r}, whose "
+                                 f"{ops[step.input]!r} operation doesn't produce an image")
+
+        # Every step must be reachable from the input, which rules out cycles
+        reached, frontier = set(), {INPUT}
+        while frontier:
+            frontier = {step.name for step in self.steps if step.input in frontier} - reached
+            reached |= frontier
+        if reached != names:
+            raise ValueError(f"steps in a cycle: {', '.join(sorted(names - reached))}")
+
+    def _save(self, step, result, stem_path, output_dir, writer):
+        """Write a step's image result, returns its path"""
+        stem = os.path.splitext(os.path.basename(stem_path))[0] if stem_path else "image"
+        path = os.path.join(output_dir or "", step.output.format(stem=stem))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        write_image(path, result, writer)
+        return path
+
+    def run(self, source, output_dir=None, writer=None, stem_path=None):
+        """
+        Run the pipeline on one image.
+
+        Args:
+            source: Path, BGR numpy array or LoadedImage
+            output_dir: Directory of the steps' output files
+            writer: Optional ImageWriter saving the outputs in the background
+            stem_path: Path whose file name fills "{stem}" (default: source's path)
+
+        Returns:
+            Dictionary mapping step names to their result: the saved path
+            for steps with an output, the data for data steps (colors) and
+            the image for final steps without an output
+        """
+        if isinstance(source, str):
+            stem_path = stem_path or source
+            source = LoadedImage(path=source)
+        elif not isinstance(source, LoadedImage):
+            source = LoadedImage(source)
+        stem_path = stem_path or source.path
+        # Only the images dictionary refers to the input, so it can be freed
+        images = {INPUT: source}
+        del source
+
+        # Steps still to finish that read each node
+        readers = {INPUT: [step for step in self.steps if step.input == INPUT]}
+        for step in self.steps:
+            readers[step.name] = [other for other in self.steps if other.input == step.name]
+
+        results = {}
+        waiting = list(self.steps)
+
+        def run_step(step):
+            function, _ = OPERATIONS[step.op]
+            with stage("step", step=step.name):
+                return function(images[step.input], **step.params)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {}
+            while waiting or running:
+                for step in [step for step in waiting if step.input in images]:
+                    waiting.remove(step)
+                    running[executor.submit(run_step, step)] = step
+                if not running:
+                    raise RuntimeError("steps whose input has no image: "
+                                       f"{', '.join(step.name for step in waiting)}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception:
+                        # Let the running steps finish before raising
+                        for other in running:
+                            other.cancel()
+                        wait(running)
+                        raise
+                    self._finish(step, result, readers, images, results, stem_path, output_dir, writer)
+        return results
+
+    def _finish(self, step, result, readers, images, results, stem_path, output_dir, writer):
+        """Store a step's result and free what no pending step needs"""
+        is_image = isinstance(result, np.ndarray)
+        if is_image and readers[step.name]:
+            images[step.name] = LoadedImage(result)
+        if is_image and step.output:
+            results[step.name] = self._save(step, result, stem_path, output_dir, writer)
+        elif not is_image or not readers[step.name]:
+            results[step.name] = result
+
+        # This step no longer needs its input's conversions
+        readers[step.input].remove(step)
+        if not readers[step.input]:
+            del images[step.input]
+        else:
+            needed = {name for other in readers[step.input] for name in OPERATIONS[other.op][1]}
+            images[step.input].release(*({"rgb", "gray", "mean_gray", "box_blur"} - needed))
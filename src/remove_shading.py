@@ -1,59 +1,374 @@
 import cv2
 import numpy as np
-from sklearn.cluster import KMeans
 import os
+from src.image_io import as_bgr, as_rgb, as_gray, expand_indexed
+from src.instrument import operation, stage
+from src.cache import cached
+from src.image_writer import INDEXED_EXTENSIONS, encode_image, encode_indexed, write_image, write_indexed
 
-def remove_shading_and_keep_colors(image_path, output_path, num_colors=8, brightness_threshold=150):
+# Labels are uint8, and masked-out pixels take one more palette entry (black)
+MAX_COLORS = 255
+
+def _kmeans(**kwargs):
+    """KMeans estimator, scikit-learn is only imported on first use as it is slow to load"""
+    with stage("import_sklearn"):
+        from sklearn.cluster import KMeans
+    return KMeans(**kwargs)
+
+def assign_labels(pixels, centers, chunk_pixels=1 << 18):
     """
-    Remove shading from image while preserving colors using K-means segmentation.
-    
+    Assign each pixel to its nearest cluster center, a chunk at a time.
+
     Args:
-        image_path: Path to input image
-        output_path: Path to save output image
-        num_colors: Number of color clusters for segmentation
+        pixels: (N, 3) array of pixels
+        centers: (K, 3) array of cluster centers
+        chunk_pixels: Number of pixels handled per chunk
+
+    Returns:
+        Array of N center indices (uint8 when K <= 256)
+    """
+    centers = np.asarray(centers, dtype=np.float32)
+    labels = np.empty(len(pixels), dtype=np.uint8 if len(centers) <= 256 else np.int32)
+    center_norms = (centers ** 2).sum(axis=1)
+    for start in range(0, len(pixels), chunk_pixels):
+        chunk = pixels[start:start + chunk_pixels].astype(np.float32)
+        # |x - c|^2 without the |x|^2 term, which is the same for every center
+        distances = center_norms - 2 * chunk @ centers.T
+        labels[start:start + chunk_pixels] = distances.argmin(axis=1)
+    return labels
+
+def _check_num_colors(num_colors):
+    """Raise ValueError when num_colors doesn't fit uint8 labels"""
+    if not 1 <= num_colors <= MAX_COLORS:
+        raise ValueError(f"num_colors must be between 1 and {MAX_COLORS}, got {num_colors}")
+
+def _bright_mask(image, brightness_threshold):
+    """Threshold the grayscale image to keep bright areas"""
+    gray_image = as_gray(image)
+    with stage("mask"):
+        _, mask = cv2.threshold(gray_image, brightness_threshold, 255, cv2.THRESH_BINARY)
+    return mask
+
+def _bright_pixels(image_rgb, mask, max_samples, rng):
+    """Pixels kept by the mask, optionally subsampled"""
+    pixels = image_rgb[mask > 0]
+    if max_samples and len(pixels) > max_samples:
+        pixels = pixels[np.sort(rng.choice(len(pixels), max_samples, replace=False))]
+    return pixels
+
+def _fit_bright_pixels(image_rgb, mask, num_colors, max_samples, random_state=None):
+    """
+    Fit k-means on the pixels kept by the mask, optionally subsampled.
+
+    Returns:
+        Tuple of (centers, counts) with the pixels fitted per center
+    """
+    pixels = _bright_pixels(image_rgb, mask, max_samples, np.random.default_rng(42))
+    if len(pixels) == 0:
+        return np.zeros((0, 3)), np.zeros(0, dtype=np.int64)
+    kmeans = _kmeans(n_clusters=min(num_colors, len(pixels)), n_init=10, random_state=random_state)
+    with stage("fit"):
+        kmeans.fit(pixels)
+    counts = np.bincount(kmeans.labels_, minlength=kmeans.n_clusters)
+    return kmeans.cluster_centers_, counts
+
+def _label_masked(image_rgb, mask, centers, chunk_pixels):
+    """
+    Label kept pixels with their nearest center and the rest with black.
+
+    Returns:
+        Tuple of (labels, palette): (H, W) uint8 indices into the uint8 RGB
+        palette of the centers followed by black
+    """
+    if len(centers) > MAX_COLORS:
+        raise ValueError(f"palettes hold at most {MAX_COLORS} colors, got {len(centers)}")
+    palette = np.zeros((len(centers) + 1, 3), dtype=np.uint8)
+    palette[:len(centers)] = np.asarray(centers).astype(np.uint8)
+    labels = np.full(mask.shape, len(centers), dtype=np.uint8)
+    if len(centers) == 0:
+        return labels, palette
+    pixels = image_rgb.reshape((-1, 3))
+    flat_mask = mask.reshape(-1)
+    flat_labels = labels.reshape(-1)
+    with stage("assign_labels"):
+        for start in range(0, len(pixels), chunk_pixels):
+            stop = start + chunk_pixels
+            kept = flat_mask[start:stop] > 0
+            flat_labels[start:stop][kept] = assign_labels(pixels[start:stop][kept], centers, chunk_pixels)
+    return labels, palette
+
+@operation("deshade")
+def remove_shading_labels_from_array(image, num_colors=8, brightness_threshold=150, fit_masked_only=False,
+                                     max_samples=None, chunk_pixels=1 << 18):
+    """
+    Remove shading from an in-memory image, as a label map and palette.
+
+    Same as remove_shading_and_keep_colors_from_array without building the
+    BGR image; image_io.expand_indexed gives the same pixels.
+
+    Args:
+        image: BGR numpy array, or LoadedImage (reuses its cached RGB and grayscale)
+        num_colors: Number of color clusters for segmentation, 1 to MAX_COLORS
         brightness_threshold: Threshold for keeping bright areas
+        fit_masked_only: Fit only on the pixels kept by the threshold
+        max_samples: Maximum number of pixels to fit on (fit_masked_only only)
+        chunk_pixels: Pixels per chunk when assigning labels (fit_masked_only only)
+
+    Returns:
+        Tuple of (labels, palette): (H, W) uint8 indices into a (K, 3) uint8
+        RGB palette
     """
-    try:
-        # Suppress the physical cores warning
-        os.environ['LOKY_MAX_CPU_COUNT'] = '4'
+    _check_num_colors(num_colors)
 
-        # Read the image
-        image = cv2.imread(image_path)
+    # Suppress the physical cores warning
+    os.environ['LOKY_MAX_CPU_COUNT'] = '4'
 
-        # Convert the image from BGR to RGB
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    # Convert the image from BGR to RGB
+    image_rgb = as_rgb(image)
 
-        # Convert the image to grayscale
-        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # Convert to grayscale and threshold it to keep bright areas
+    mask = _bright_mask(image, brightness_threshold)
 
-        # Threshold the grayscale image to keep bright areas
-        _, mask = cv2.threshold(gray_image, brightness_threshold, 255, cv2.THRESH_BINARY)
+    if fit_masked_only:
+        centers, _ = _fit_bright_pixels(image_rgb, mask, num_colors, max_samples)
+        return _label_masked(image_rgb, mask, centers, chunk_pixels)
 
-        # Apply the mask to the original image
-        masked_image = cv2.bitwise_and(image_rgb, image_rgb, mask=mask)
+    # Apply the mask to the original image
+    masked_image = cv2.bitwise_and(image_rgb, image_rgb, mask=mask)
 
-        # Reshape the image to a 2D array of pixels
-        pixels = masked_image.reshape((-1, 3))
+    # Reshape the image to a 2D array of pixels
+    pixels = masked_image.reshape((-1, 3))
 
-        # Perform k-means clustering for color quantization
-        kmeans = KMeans(n_clusters=num_colors, n_init=10)
+    # Perform k-means clustering for color quantization
+    kmeans = _kmeans(n_clusters=num_colors, n_init=10)
+    with stage("fit"):
         kmeans.fit(pixels)
 
-        # Assign each pixel to the nearest cluster center
-        segmented_image = kmeans.cluster_centers_[kmeans.labels_]
+    # Each pixel's cluster, and the cluster centers as uint8 colors
+    labels = kmeans.labels_.astype(np.uint8).reshape(mask.shape)
+    return labels, kmeans.cluster_centers_.astype(np.uint8)
+
+@operation("deshade")
+def remove_shading_and_keep_colors_from_array(image, num_colors=8, brightness_threshold=150,
+                                              fit_masked_only=False, max_samples=None,
+                                              chunk_pixels=1 << 18):
+    """
+    Remove shading from an in-memory image, see remove_shading_and_keep_colors.
+
+    Args:
+        image: BGR numpy array, or LoadedImage (reuses its cached RGB and grayscale)
+        num_colors: Number of color clusters for segmentation, 1 to MAX_COLORS
+        brightness_threshold: Threshold for keeping bright areas
+        fit_masked_only: Fit only on the pixels kept by the threshold
+        max_samples: Maximum number of pixels to fit on (fit_masked_only only)
+        chunk_pixels: Pixels per chunk when assigning labels (fit_masked_only only)
+
+    Returns:
+        Segmented image as a BGR uint8 numpy array
+    """
+    labels, palette = remove_shading_labels_from_array(image, num_colors, brightness_threshold,
+                                                       fit_masked_only, max_samples, chunk_pixels)
+    return expand_indexed(labels, palette)
+
+@operation("deshade")
+def remove_shading_and_keep_colors(image_path, output_path, num_colors=8, brightness_threshold=150,
+                                   fit_masked_only=False, max_samples=None, chunk_pixels=1 << 18,
+                                   cache=None, indexed=False):
+    """
+    Remove shading from image while preserving colors using K-means segmentation.
+
+    By default every pixel is clustered, including the masked-out ones as
+    black. With fit_masked_only=True k-means is fitted only on the pixels
+    above the brightness threshold (subsampled to max_samples if given), so
+    no cluster is spent on black. Labels are then assigned in chunks of
+    chunk_pixels and written straight into a uint8 image, with masked-out
+    pixels left black.
+
+    With indexed=True the labels and palette are written directly (a
+    palettized .png, or a .npy label map with a palette sidecar, see
+    image_writer.write_indexed), without building the BGR image. They are
+    smaller and faster to encode, and keep exactly num_colors colors.
+    
+    Args:
+        image_path: Path to input image, or LoadedImage
+        output_path: Path to save output image
+        num_colors: Number of color clusters for segmentation, 1 to MAX_COLORS
+        brightness_threshold: Threshold for keeping bright areas
+        fit_masked_only: Fit only on the pixels kept by the threshold
+        max_samples: Maximum number of pixels to fit on (fit_masked_only only)
+        chunk_pixels: Pixels per chunk when assigning labels (fit_masked_only only)
+        cache: Optional ResultCache keeping the encoded output, reused when
+            the same file is processed with the same parameters again
+            (not used for indexed .npy outputs)
+        indexed: Write the label map and palette instead of a BGR image;
+            output_path must then end in .png or .npy (ValueError otherwise)
+    """
+    _check_num_colors(num_colors)
+    extension = os.path.splitext(output_path)[1].lower()
+    if indexed and extension not in INDEXED_EXTENSIONS:
+        raise ValueError(f"indexed output must be {' or '.join(INDEXED_EXTENSIONS)}, not {output_path}")
+    try:
+        if indexed and extension == ".npy":
+            labels, palette = remove_shading_labels_from_array(
+                as_bgr(image_path), num_colors, brightness_threshold, fit_masked_only, max_samples, chunk_pixels)
+            write_indexed(output_path, labels, palette)
+            return
+
+        def compute():
+            # Read the image
+            image = as_bgr(image_path)
 
-        # Reshape the segmented image back to the original shape
-        segmented_image = segmented_image.reshape(image_rgb.shape)
+            if indexed:
+                return encode_indexed(*remove_shading_labels_from_array(
+                    image, num_colors, brightness_threshold, fit_masked_only, max_samples, chunk_pixels))
 
-        # Convert the image back to BGR
-        segmented_image_bgr = cv2.cvtColor(segmented_image.astype(np.uint8), cv2.COLOR_RGB2BGR)
+            segmented_image_bgr = remove_shading_and_keep_colors_from_array(
+                image, num_colors, brightness_threshold, fit_masked_only, max_samples, chunk_pixels)
+
+            # Encode the segmented image in the output's format
+            return encode_image(segmented_image_bgr, os.path.splitext(output_path)[1])
+
+        if isinstance(image_path, str):
+            params = {"num_colors": num_colors, "brightness_threshold": brightness_threshold,
+                      "fit_masked_only": fit_masked_only, "max_samples": max_samples,
+                      "format": extension}
+            if indexed:
+                params["indexed"] = True
+            encoded = cached(cache, "deshade", image_path, params, compute)
+        else:
+            encoded = compute()
 
         # Save the segmented image
-        cv2.imwrite(output_path, segmented_image_bgr)
+        with stage("write"):
+            with open(output_path, "wb") as f:
+                f.write(encoded)
 
     except UnicodeDecodeError as e:
         print(f"UnicodeDecodeError: {e}")
 
+@operation("deshade")
+def fit_shading_palette(image, num_colors=8, brightness_threshold=150, max_samples=None):
+    """
+    Fit a shading-removal palette once so it can be reused on later frames.
+
+    The fit is seeded, so the same frame always gives the same palette.
+
+    Args:
+        image: Path to input image, BGR numpy array or LoadedImage
+        num_colors: Number of color clusters for segmentation, 1 to MAX_COLORS
+        brightness_threshold: Threshold for keeping bright areas
+        max_samples: Maximum number of pixels to fit on
+
+    Returns:
+        Palette dictionary with RGB 'centers', per-center 'counts' and the
+        'brightness_threshold' it was fitted with
+    """
+    _check_num_colors(num_colors)
+
+    # Suppress the physical cores warning
+    os.environ['LOKY_MAX_CPU_COUNT'] = '4'
+
+    frame = image if not isinstance(image, str) else as_bgr(image)
+    image_rgb = as_rgb(frame)
+    mask = _bright_mask(frame, brightness_threshold)
+    centers, counts = _fit_bright_pixels(image_rgb, mask, num_colors, max_samples, random_state=42)
+    return {'centers': centers, 'counts': counts.astype(np.float64),
+            'brightness_threshold': brightness_threshold}
+
+def save_palette(palette, path):
+    """Save a palette from fit_shading_palette to a .npz file"""
+    np.savez(path, centers=palette['centers'], counts=palette['counts'],
+             brightness_threshold=palette['brightness_threshold'])
+
+def load_palette(path):
+    """Load a palette saved with save_palette"""
+    with np.load(path) as data:
+        return {'centers': data['centers'], 'counts': data['counts'],
+                'brightness_threshold': int(data['brightness_threshold'])}
+
+@operation("deshade")
+def apply_shading_palette(image, palette, output_path=None, chunk_pixels=1 << 18, writer=None):
+    """
+    Remove shading with a fitted palette, without running k-means again.
+
+    Bright pixels are mapped to their nearest palette color and the rest to
+    black, in one vectorized pass.
+
+    Args:
+        image: Path to input image, BGR numpy array or LoadedImage
+        palette: Palette from fit_shading_palette or load_palette
+        output_path: Path to save output image (optional)
+        chunk_pixels: Pixels per chunk when assigning labels
+        writer: Optional ImageWriter saving the output in the background
+
+    Returns:
+        Segmented image as a BGR uint8 numpy array
+    """
+    segmented_image_bgr = expand_indexed(*apply_shading_palette_labels(image, palette, chunk_pixels))
+    if output_path:
+        write_image(output_path, segmented_image_bgr, writer)
+    return segmented_image_bgr
+
+@operation("deshade")
+def apply_shading_palette_labels(image, palette, chunk_pixels=1 << 18):
+    """
+    Remove shading with a fitted palette, as a label map and palette.
+
+    Same as apply_shading_palette without building the BGR image; write the
+    result with image_writer.write_indexed.
+
+    Args:
+        image: Path to input image, BGR numpy array or LoadedImage
+        palette: Palette from fit_shading_palette or load_palette
+        chunk_pixels: Pixels per chunk when assigning labels
+
+    Returns:
+        Tuple of (labels, palette): (H, W) uint8 indices into the uint8 RGB
+        palette of the centers followed by black
+    """
+    frame = image if not isinstance(image, str) else as_bgr(image)
+    image_rgb = as_rgb(frame)
+    mask = _bright_mask(frame, palette['brightness_threshold'])
+    return _label_masked(image_rgb, mask, palette['centers'], chunk_pixels)
+
+@operation("deshade")
+def update_shading_palette(palette, image, max_samples=100000, decay=1.0):
+    """
+    Move a palette towards the colors of a new frame (warm start).
+
+    Applies one mini-batch k-means step, like MiniBatchKMeans.partial_fit:
+    each center moves to the running mean of all pixels assigned to it,
+    weighted by its pixel count. A decay below 1 shrinks the old counts
+    first, so the palette follows a scene that drifts.
+
+    Args:
+        palette: Palette from fit_shading_palette or load_palette
+        image: Path to input image, BGR numpy array or LoadedImage
+        max_samples: Maximum number of pixels to update from
+        decay: Factor applied to the previous counts (0-1)
+
+    Returns:
+        The updated palette (a new dictionary)
+    """
+    frame = image if not isinstance(image, str) else as_bgr(image)
+    image_rgb = as_rgb(frame)
+    mask = _bright_mask(frame, palette['brightness_threshold'])
+    pixels = _bright_pixels(image_rgb, mask, max_samples, np.random.default_rng(42))
+
+    centers = np.array(palette['centers'], dtype=np.float64)
+    counts = np.array(palette['counts'], dtype=np.float64) * decay
+    if len(pixels) and len(centers):
+        with stage("assign_labels"):
+            labels = assign_labels(pixels, centers)
+        batch_counts = np.bincount(labels, minlength=len(centers))
+        batch_sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=len(centers))
+                               for c in range(3)], axis=1)
+        counts += batch_counts
+        updated = batch_counts > 0
+        centers[updated] += (batch_sums[updated] - batch_counts[updated, None] * centers[updated]) \
+            / counts[updated, None]
+    return dict(palette, centers=centers, counts=counts)
+
 if __name__ == "__main__":
     remove_shading_and_keep_colors('samples/sample_image.jpg', 'output/no_shading.jpg', 
                                    num_colors=8, brightness_threshold=150)
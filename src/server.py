@@ -0,0 +1,428 @@
+"""
+Local HTTP processing service.
+
+A long-running asyncio server (standard library only) that keeps a warm
+process pool, so other services can call the operations without paying the
+interpreter and import start-up per image. Image bytes are POSTed as the
+request body, parameters go in the query string:
+
+    POST /canny?low=100&high=200          -> image/png
+    POST /sobel                           -> image/png
+    POST /colors?n=8&method=histogram     -> application/json
+    POST /deshade?n=8&brightness=150      -> image/png
+    POST /warp?corners=x,y+x,y+x,y+x,y    -> image/png (corners detected when omitted)
+    GET  /health, GET /metrics            -> application/json
+
+Image endpoints take format=png|jpg|webp for the response encoding.
+
+Requests are only grouped when there are more of them than free workers:
+the jobs waiting are shared evenly among the workers (up to batch_size per
+task, collecting arrivals for batch_wait), so concurrent requests run in
+parallel while a backlog of small inputs saves a round trip per image. At most
+max_queue requests are queued or running; beyond that the server answers 503
+with Retry-After instead of letting the backlog grow. A pool broken by a
+worker that died is replaced, failing only the jobs it was running.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+
+# Operation name -> response content type
+OPERATIONS = {"canny": "image/png", "sobel": "image/png", "colors": "application/json",
+              "deshade": "image/png", "warp": "image/png"}
+
+_FORMATS = {"png": (".png", "image/png"), "jpg": (".jpg", "image/jpeg"),
+            "jpeg": (".jpg", "image/jpeg"), "webp": (".webp", "image/webp")}
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            411: "Length Required", 413: "Payload Too Large", 422: "Unprocessable Entity",
+            500: "Internal Server Error", 503: "Service Unavailable"}
+
+class RequestError(Exception):
+    """Error answered with an HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _warm_up():
+    """Import the operations and their dependencies in a pool worker"""
+    from src import canny_edge_detector, sobel_edge_detector, color_extractor, remove_shading
+    from src import document_scanner
+    color_extractor._kmeans()
+    return os.getpid()
+
+def _param(params, name, convert, default):
+    """One query parameter converted to a type, 400 when it is invalid"""
+    if name not in params:
+        return default
+    try:
+        return convert(params[name])
+    except ValueError:
+        raise RequestError(400, f"invalid {name}: {params[name]!r}")
+
+def _flag(value):
+    """Parse a boolean query parameter"""
+    if value.lower() in ("1", "true", "yes", "on", ""):
+        return True
+    if value.lower() in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(value)
+
+def _corners(text):
+    """Parse "x,y x,y x,y x,y" into a (4, 2) float32 array"""
+    points = [[float(v) for v in point.split(",")] for point in text.replace("+", " ").split()]
+    if len(points) != 4 or any(len(point) != 2 for point in points):
+        raise ValueError(text)
+    return np.array(points, dtype=np.float32)
+
+def run_operation(name, data, params):
+    """
+    Decode an image, run one operation on it and encode the result.
+
+    Args:
+        name: Operation name, see OPERATIONS
+        data: Encoded image bytes
+        params: Dictionary of query parameters (strings)
+
+    Returns:
+        Tuple of (content type, response body bytes)
+    """
+    from src.image_writer import encode_image
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise RequestError(400, "body is not a supported image")
+    extension, content_type = _FORMATS.get(params.get("format", "png").lower(), (None, None))
+    if extension is None:
+        raise RequestError(400, f"unsupported format: {params['format']!r}")
+
+    if name == "canny":
+        from src.canny_edge_detector import detect_edges_canny_from_array
+        result = detect_edges_canny_from_array(image, _param(params, "low", int, 100),
+                                               _param(params, "high", int, 200))
+    elif name == "sobel":
+        from src.sobel_edge_detector import detect_edges_sobel_from_array
+        result = detect_edges_sobel_from_array(image)[2]
+    elif name == "colors":
+        from src.color_extractor import extract_bright_colorful_colors_from_array
+        colors = extract_bright_colorful_colors_from_array(
+            image, _param(params, "n", int, 8), method=params.get("method", "histogram"),
+            max_samples=_param(params, "max_samples", int, 100000))
+        return "application/json", json.dumps({"colors": colors}).encode()
+    elif name == "deshade":
+        from src.remove_shading import remove_shading_and_keep_colors_from_array
+        result = remove_shading_and_keep_colors_from_array(
+            image, _param(params, "n", int, 8), _param(params, "brightness", int, 150),
+            fit_masked_only=_param(params, "masked_only", _flag, False),
+            max_samples=_param(params, "max_samples", int, None))
+    elif name == "warp":
+        from src.document_scanner import find_document_corners, four_point_transform, order_points
+        corners = _param(params, "corners", _corners, None)
+        if corners is None:
+            corners, confidence = find_document_corners(image, _param(params, "max_dim", int, 800))
+            if corners is None or confidence < _param(params, "min_confidence", float, 0.5):
+                raise RequestError(422, f"no document found (confidence {confidence:.2f})")
+        result = four_point_transform(image, order_points(corners))
+    else:
+        raise RequestError(404, f"unknown operation: {name}")
+    return content_type, encode_image(result, extension)
+
+def run_jobs(jobs):
+    """
+    Run a batch of jobs in a pool worker.
+
+    Args:
+        jobs: List of (operation name, image bytes, params)
+
+    Returns:
+        List with (200, content type, body) or (status, None, error message)
+        per job, one failing job doesn't affect the others
+    """
+    results = []
+    for name, data, params in jobs:
+        try:
+            results.append((200,) + run_operation(name, data, params))
+        except RequestError as e:
+            results.append((e.status, None, str(e)))
+        except (ValueError, AssertionError, cv2.error) as e:
+            results.append((400, None, f"{type(e).__name__}: {e}"))
+        except Exception as e:
+            results.append((500, None, f"{type(e).__name__}: {e}"))
+    return results
+
+def percentiles(values, points=(50, 90, 99)):
+    """Percentiles of a sequence of latencies in milliseconds, None when empty"""
+    if not values:
+        return {f"p{point}": None for point in points}
+    array = np.asarray(values) * 1000
+    return {f"p{point}": round(float(np.percentile(array, point)), 3) for point in points}
+
+class ProcessingServer:
+    """
+    HTTP front end dispatching requests to a process pool.
+
+    Args:
+        workers: Pool size (default: number of CPUs)
+        max_queue: Maximum requests queued or running before answering 503
+            (default: 4 x workers)
+        batch_size: Maximum jobs sent to a worker in one task, when there are
+            more jobs than workers
+        batch_wait: Seconds to collect more jobs before sharing them among the workers
+        max_body: Maximum request body size in bytes
+        window: Number of recent latencies kept per operation for /metrics
+    """
+
+    def __init__(self, workers=None, max_queue=None, batch_size=8, batch_wait=0.005,
+                 max_body=64 << 20, window=1000):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max(max_queue or 4 * self.workers, 1)
+        self.batch_size = max(batch_size, 1)
+        self.batch_wait = batch_wait
+        self.max_body = max_body
+        self.started = time.time()
+        self.pending = 0
+        self.busy = 0
+        self.queue = None
+        self.executor = None
+        self.latencies = {name: deque(maxlen=window) for name in OPERATIONS}
+        self.counts = {"requests": 0, "errors": 0, "rejected": 0, "batches": 0, "pool_restarts": 0}
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """Start the pool, warm up its workers and listen; returns the asyncio server"""
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self._worker_free = asyncio.Event()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up)
+        # Start every worker now rather than on the first requests
+        await asyncio.gather(*(loop.run_in_executor(self.executor, os.getpid)
+                               for _ in range(self.workers)))
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def stop(self):
+        """Stop dispatching and shut the pool down"""
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait=True)
+
+    async def _dispatch(self):
+        """Share queued jobs among the free workers, batching only what they can't take one by one"""
+        loop = asyncio.get_running_loop()
+        backlog = deque()
+        while True:
+            if not backlog:
+                backlog.append(await self.queue.get())
+                deadline = loop.time() + self.batch_wait
+                while len(backlog) < self.batch_size * self.workers:
+                    timeout = deadline - loop.time()
+                    try:
+                        backlog.append(self.queue.get_nowait() if timeout <= 0 else
+                                       await asyncio.wait_for(self.queue.get(), timeout))
+                    except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                        break
+            while self.busy >= self.workers:
+                self._worker_free.clear()
+                await self._worker_free.wait()
+            while not self.queue.empty():
+                backlog.append(self.queue.get_nowait())
+
+            # A worker only gets several jobs when every worker gets some
+            size = min(-(-len(backlog) // self.workers), self.batch_size)
+            for _ in range(self.workers - self.busy):
+                if not backlog:
+                    break
+                self._submit([backlog.popleft() for _ in range(min(size, len(backlog)))])
+
+    def _submit(self, batch):
+        """Send a list of (job, waiter) to the pool as one task"""
+        loop = asyncio.get_running_loop()
+        jobs = [job for job, _ in batch]
+        executor = self.executor
+        try:
+            future = loop.run_in_executor(executor, run_jobs, jobs)
+        except BrokenProcessPool:
+            self._restart_pool(executor)
+            executor = self.executor
+            future = loop.run_in_executor(executor, run_jobs, jobs)
+        self.busy += 1
+        self.counts["batches"] += 1
+        future.add_done_callback(lambda done: self._finished(done, executor, [waiter for _, waiter in batch]))
+
+    def _finished(self, done, executor, waiters):
+        """Hand the results of a finished batch to the waiting requests"""
+        self.busy -= 1
+        self._worker_free.set()
+        try:
+            results = done.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._restart_pool(executor)
+            results = [(500, None, f"{type(e).__name__}: {e}")] * len(waiters)
+        for waiter, result in zip(waiters, results):
+            if not waiter.done():
+                waiter.set_result(result)
+
+    def _restart_pool(self, executor):
+        """Replace a pool broken by a worker that died, once per broken pool"""
+        if executor is not self.executor:
+            return
+        executor.shutdown(wait=False)
+        self.counts["pool_restarts"] += 1
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up)
+
+    async def process(self, name, data, params):
+        """Queue one job and wait for its (status, content type, body)"""
+        if self.pending >= self.max_queue:
+            self.counts["rejected"] += 1
+            raise RequestError(503, "server busy, retry later")
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            waiter = asyncio.get_running_loop().create_future()
+            await self.queue.put(((name, data, params), waiter))
+            result = await waiter
+        finally:
+            self.pending -= 1
+        if result[0] == 200:
+            self.latencies[name].append(time.perf_counter() - start)
+        return result
+
+    def health(self):
+        """Body of /health"""
+        return {"status": "ok", "workers": self.workers, "uptime_s": round(time.time() - self.started, 3)}
+
+    def metrics(self):
+        """Body of /metrics: counters, queue depth and latency percentiles per operation"""
+        return dict(self.counts, queue_depth=self.pending, queued=self.queue.qsize() if self.queue else 0,
+                    max_queue=self.max_queue, workers=self.workers,
+                    latency_ms={name: dict(percentiles(list(values)), count=len(values))
+                                for name, values in self.latencies.items()})
+
+    async def _route(self, method, target, body):
+        """Answer one request, returns (status, content type, body bytes)"""
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        if path in ("/health", "/metrics"):
+            if method != "GET":
+                raise RequestError(405, f"{path} only accepts GET")
+            return 200, "application/json", json.dumps(self.health() if path == "/health" else self.metrics()).encode()
+
+        name = path.lstrip("/")
+        if name not in OPERATIONS:
+            raise RequestError(404, f"unknown endpoint: {path}")
+        if method != "POST":
+            raise RequestError(405, f"{path} only accepts POST")
+        if not body:
+            raise RequestError(400, "empty body, POST the image bytes")
+        params = {key: values[-1] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        status, content_type, result = await self.process(name, body, params)
+        if status != 200:
+            raise RequestError(status, result)
+        return status, content_type, result
+
+    async def _handle_connection(self, reader, writer):
+        """Serve the requests of one connection (HTTP/1.1 keep-alive)"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request_line, reader, writer):
+        """Read one request, write its response; returns whether to keep the connection"""
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            _respond(writer, 400, "application/json", _error_body("malformed request line"), False)
+            return False
+        keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+        self.counts["requests"] += 1
+        try:
+            length = headers.get("content-length")
+            if method == "POST" and length is None:
+                raise RequestError(411, "Content-Length is required")
+            length = length or "0"
+            if not (length.isascii() and length.isdigit()):
+                # Without a length the body can't be skipped, so the connection can't be reused
+                keep_alive = False
+                raise RequestError(400, f"invalid Content-Length: {length!r}")
+            length = int(length)
+            if length > self.max_body:
+                # The body isn't read, so the connection can't be reused
+                keep_alive = False
+                raise RequestError(413, f"body larger than {self.max_body} bytes")
+            body = await reader.readexactly(length) if length else b""
+            status, content_type, payload = await self._route(method, target, body)
+        except RequestError as e:
+            if e.status != 503:
+                self.counts["errors"] += 1
+            _respond(writer, e.status, "application/json", _error_body(str(e)), keep_alive,
+                     {"Retry-After": "1"} if e.status == 503 else None)
+            return keep_alive
+        _respond(writer, status, content_type, payload, keep_alive)
+        return keep_alive
+
+def _error_body(message):
+    return json.dumps({"error": message}).encode()
+
+def _respond(writer, status, content_type, body, keep_alive, headers=None):
+    """Write an HTTP response"""
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", f"Content-Type: {content_type}",
+             f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines += [f"{key}: {value}" for key, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+def serve(host="127.0.0.1", port=8080, **options):
+    """
+    Run the server until interrupted.
+
+    Args:
+        host: Address to listen on
+        port: Port to listen on
+        **options: ProcessingServer arguments
+    """
+    async def run():
+        server = ProcessingServer(**options)
+        listener = await server.start(host, port)
+        print(f"Serving on http://{host}:{port} with {server.workers} workers "
+              f"(max queue {server.max_queue})", flush=True)
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
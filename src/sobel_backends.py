@@ -0,0 +1,264 @@
+"""
+Convolution backends for the Sobel edge detector.
+
+Every backend computes the same two steps with the getvalue border rules of
+the pixel loops (indices before the start wrap around, indices past the end
+read as 0): the 3x3 box blur, and the Sobel gradient magnitude for 3x3, 5x5
+or 7x7 kernels.
+
+    python     the pixel loops of sobel_edge_detector, the reference
+    numpy      one shifted slice per kernel tap
+    separable  the kernels split into a row and a column pass
+    opencv     cv2.boxFilter and cv2.Sobel on the padded image
+
+The accumulator sets the arithmetic of the gradient. "float64" is exact
+(the numpy backend then matches the reference bit for bit). "float32" halves
+the memory traffic. "int16" runs the gradient on the blurred image rounded
+down to uint8, in integers; it is exact for 3x3 and 5x5 kernels and is
+rejected for 7x7, whose sums can overflow int16.
+
+tests/test_sobel_backends.py checks every backend against the reference.
+fastest_backend() times them on this host, and backend="auto" uses the
+fastest.
+"""
+
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from src.instrument import stage
+from src.sobel_edge_detector import (KERNEL_SIZES, sobel_factors, sobel_kernels, get_matrix, getedgyness,
+                                     image_to_box_blur, blur_rows, normalize_edges, _correlate)
+
+ACCUMULATORS = ("float64", "float32", "int16")
+
+def check_options(ksize, accumulator):
+    """Raise ValueError for an unsupported kernel size or accumulator"""
+    if ksize not in KERNEL_SIZES:
+        raise ValueError(f"Unsupported Sobel kernel size: {ksize} (use 3, 5 or 7)")
+    if accumulator not in ACCUMULATORS:
+        raise ValueError(f"Unknown accumulator: {accumulator} (use float64, float32 or int16)")
+    if accumulator == "int16":
+        hk, _ = sobel_kernels(ksize)
+        largest = 255 * sum(v for row in hk for v in row if v > 0)
+        if largest > np.iinfo(np.int16).max:
+            raise ValueError(f"int16 accumulator can overflow with {ksize}x{ksize} kernels "
+                             f"(sums up to {largest}), use float32")
+
+def pad_like_getvalue(array, radius):
+    """
+    Pad a 2D array by radius the way getvalue reads out of range pixels.
+
+    Negative indices wrap around (as far as Python indexing does), indices
+    past the end read as 0.
+    """
+    padded = np.zeros((array.shape[0] + 2 * radius, array.shape[1] + 2 * radius), dtype=array.dtype)
+    rows = np.arange(-radius, array.shape[0] + radius)
+    cols = np.arange(-radius, array.shape[1] + radius)
+    valid_rows = (rows >= -array.shape[0]) & (rows < array.shape[0])
+    valid_cols = (cols >= -array.shape[1]) & (cols < array.shape[1])
+    padded[np.ix_(valid_rows, valid_cols)] = array[np.ix_(rows[valid_rows], cols[valid_cols])]
+    return padded
+
+def _gradient_source(blurred, accumulator):
+    """Blurred image in the accumulator's arithmetic"""
+    if accumulator == "int16":
+        return blurred.astype(np.uint8).astype(np.int16)
+    return blurred.astype(accumulator)
+
+def _magnitude(gx, gy, accumulator):
+    """Gradient magnitude, float64 for the float64 accumulator, float32 otherwise"""
+    dtype = np.float64 if accumulator == "float64" else np.float32
+    gx = gx.astype(dtype, copy=False)
+    gy = gy.astype(dtype, copy=False)
+    return np.sqrt(gx * gx + gy * gy)
+
+class SobelBackend:
+    """
+    Blur and gradient steps of the Sobel detector.
+
+    Subclasses implement blur(gray), returning the float64 box blur of a
+    uint8 image, and gradient(blurred, ksize, accumulator), returning the
+    gradient magnitudes of the blurred image.
+    """
+
+    name = None
+
+    def blur(self, gray):
+        raise NotImplementedError
+
+    def gradient(self, blurred, ksize, accumulator):
+        raise NotImplementedError
+
+class PythonBackend(SobelBackend):
+    """Reference backend running the pixel loops (slow, for small images)"""
+
+    name = "python"
+
+    def blur(self, gray):
+        pixels = [[(value,) for value in row] for row in gray.tolist()]
+        return np.array([[pixel[0] for pixel in row] for row in image_to_box_blur(pixels)], dtype=np.float64)
+
+    def gradient(self, blurred, ksize, accumulator):
+        if accumulator == "int16":
+            pixels = [[(int(value),) for value in row] for row in blurred.tolist()]
+        else:
+            pixels = [[(value,) for value in row] for row in _gradient_source(blurred, accumulator).tolist()]
+        hk, vk = sobel_kernels(ksize)
+        return np.array([[getedgyness(get_matrix(pixels, i, j, ksize), hk, vk) for j in range(len(pixels[i]))]
+                         for i in range(len(pixels))], dtype=np.float64)
+
+class NumpyBackend(SobelBackend):
+    """Vectorized backend adding one shifted slice per kernel tap"""
+
+    name = "numpy"
+
+    def blur(self, gray):
+        return blur_rows(lambda indices: gray[indices], gray.shape[0], np.arange(gray.shape[0]))
+
+    def gradient(self, blurred, ksize, accumulator):
+        height, width = blurred.shape
+        padded = pad_like_getvalue(_gradient_source(blurred, accumulator), ksize // 2)
+        hk, vk = sobel_kernels(ksize)
+        return _magnitude(_correlate(padded, hk, height, width), _correlate(padded, vk, height, width),
+                          accumulator)
+
+def _taps(padded, weights, axis, length):
+    """Weighted sum of shifted slices along one axis, skipping zero weights"""
+    result = None
+    for offset, weight in enumerate(weights):
+        if weight == 0:
+            continue
+        part = padded[offset:offset + length] if axis == 0 else padded[:, offset:offset + length]
+        term = part * weight if weight != 1 else part.copy()
+        result = term if result is None else result + term
+    return result
+
+class SeparableBackend(SobelBackend):
+    """
+    Backend splitting each kernel into a row pass and a column pass.
+
+    A k x k kernel costs 2k operations per pixel instead of k * k. The sums
+    are added in a different order than the reference, so float results can
+    differ in the last bits.
+    """
+
+    name = "separable"
+
+    def blur(self, gray):
+        height, width = gray.shape
+        padded = pad_like_getvalue(gray.astype(np.uint16), 1)
+        rows = _taps(padded, [1, 1, 1], 1, width)
+        return _taps(rows, [1, 1, 1], 0, height) / 9
+
+    def gradient(self, blurred, ksize, accumulator):
+        height, width = blurred.shape
+        padded = pad_like_getvalue(_gradient_source(blurred, accumulator), ksize // 2)
+        smooth, deriv = sobel_factors(ksize)
+        # HK = smooth (down) x deriv (across), VK = -deriv (down) x smooth (across)
+        gx = _taps(_taps(padded, deriv, 1, width), smooth, 0, height)
+        gy = _taps(_taps(padded, smooth, 1, width), [-d for d in deriv], 0, height)
+        return _magnitude(gx, gy, accumulator)
+
+_CV_DEPTHS = {"float64": cv2.CV_64F, "float32": cv2.CV_32F, "int16": cv2.CV_16S}
+
+class OpenCVBackend(SobelBackend):
+    """Backend running cv2.boxFilter and cv2.Sobel on the padded image"""
+
+    name = "opencv"
+
+    def blur(self, gray):
+        padded = pad_like_getvalue(gray, 1)
+        sums = cv2.boxFilter(padded, cv2.CV_32F, (3, 3), normalize=False)
+        return sums[1:-1, 1:-1].astype(np.float64) / 9
+
+    def gradient(self, blurred, ksize, accumulator):
+        radius = ksize // 2
+        source = blurred.astype(np.uint8) if accumulator == "int16" else blurred.astype(accumulator)
+        padded = pad_like_getvalue(source, radius)
+        depth = _CV_DEPTHS[accumulator]
+        # cv2.Sobel's y kernel is -VK, which doesn't change the magnitude
+        gx = cv2.Sobel(padded, depth, 1, 0, ksize=ksize)[radius:-radius, radius:-radius]
+        gy = cv2.Sobel(padded, depth, 0, 1, ksize=ksize)[radius:-radius, radius:-radius]
+        return _magnitude(gx, gy, accumulator)
+
+BACKENDS = {}
+
+def register_backend(backend):
+    """Make a SobelBackend instance selectable by its name"""
+    BACKENDS[backend.name] = backend
+    return backend
+
+for _backend in (PythonBackend(), NumpyBackend(), SeparableBackend(), OpenCVBackend()):
+    register_backend(_backend)
+
+def get_backend(name, ksize=3, accumulator="float64"):
+    """Backend registered under name, "auto" for the fastest on this host"""
+    if name == "auto":
+        name = fastest_backend(ksize, accumulator)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown Sobel backend: {name} (use {', '.join(sorted(BACKENDS))} or auto)")
+    return BACKENDS[name]
+
+def box_blur(gray, backend="numpy"):
+    """3x3 box blur of a uint8 grayscale image as float64, identical on every backend"""
+    backend = get_backend(backend)
+    with stage("blur"):
+        return backend.blur(gray)
+
+def sobel_edges(gray, backend="numpy", ksize=3, accumulator="float64", blurred=None):
+    """
+    Blur a grayscale image and compute its normalized Sobel edges.
+
+    Args:
+        gray: 2D uint8 numpy array
+        backend: Backend name, see BACKENDS, or "auto"
+        ksize: Sobel kernel size, 3, 5 or 7
+        accumulator: "float64", "float32" or "int16"
+        blurred: box_blur(gray) when it is already known
+
+    Returns:
+        Tuple of (blurred, edges) as uint8 arrays
+    """
+    check_options(ksize, accumulator)
+    backend = get_backend(backend, ksize, accumulator)
+    if blurred is None:
+        with stage("blur"):
+            blurred = backend.blur(gray)
+    with stage("gradient"):
+        magnitudes = backend.gradient(blurred, ksize, accumulator)
+    with stage("normalize"):
+        edges = normalize_edges(magnitudes, magnitudes.min(), magnitudes.max())
+    return blurred.astype(np.uint8), edges
+
+def synthetic_image(shape, seed=0):
+    """Grayscale test image with edges, flat areas and noise, for checks and timings"""
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    image = np.full(shape, 40, dtype=np.uint8)
+    cv2.rectangle(image, (width // 5, height // 5), (width // 2, height // 2), 220, -1)
+    cv2.circle(image, (2 * width // 3, 2 * height // 3), min(height, width) // 5, 160, -1)
+    noise = rng.integers(-20, 21, size=shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+@lru_cache(maxsize=None)
+def fastest_backend(ksize=3, accumulator="float64", shape=(720, 960), repeat=3):
+    """
+    Name of the fastest backend on this host, timed once per process.
+
+    The python reference isn't timed.
+    """
+    check_options(ksize, accumulator)
+    gray = synthetic_image(shape)
+    timings = {}
+    for name, backend in BACKENDS.items():
+        if name == "python":
+            continue
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            backend.gradient(backend.blur(gray), ksize, accumulator)
+            runs.append(time.perf_counter() - start)
+        timings[name] = min(runs)
+    return min(timings, key=timings.get)
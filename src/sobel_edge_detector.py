@@ -1,6 +1,12 @@
-from PIL import Image
+import os
 import numpy as np
+import cv2
 from math import sqrt
+from src.tiling import (open_image_source, read_rows, iter_bands, process_bands,
+                        open_band_output, close_band_output)
+from src.image_io import as_rgb, as_mean_gray, cached
+from src.instrument import operation, stage
+from src.image_writer import write_image
 
 min_edgyness = 600
 
@@ -12,8 +18,45 @@ VK = [[1, 2, 1],
       [0, 0, 0],
       [-1, -2, -1]]
 
+KERNEL_SIZES = (3, 5, 7)
+
+def _binomial(n):
+    """Row n of Pascal's triangle"""
+    row = [1]
+    for _ in range(n):
+        row = [a + b for a, b in zip(row + [0], [0] + row)]
+    return row
+
+def sobel_factors(ksize=3):
+    """
+    Separable factors of the Sobel kernels.
+
+    Returns:
+        Tuple of (smooth, deriv) lists: HK[n][m] = smooth[n] * deriv[m] and
+        VK[n][m] = -deriv[n] * smooth[m]
+    """
+    if ksize not in KERNEL_SIZES:
+        raise ValueError(f"Unsupported Sobel kernel size: {ksize} (use 3, 5 or 7)")
+    smooth = _binomial(ksize - 1)
+    deriv = [b - a for a, b in zip(_binomial(ksize - 3) + [0, 0], [0, 0] + _binomial(ksize - 3))]
+    return smooth, deriv
+
+def sobel_kernels(ksize=3):
+    """
+    Sobel kernels of a given size, as lists of rows like HK and VK.
+
+    The 5x5 and 7x7 kernels are the binomial extensions OpenCV uses; the 3x3
+    kernels are HK and VK.
+    """
+    smooth, deriv = sobel_factors(ksize)
+    hk = [[s * d for d in deriv] for s in smooth]
+    vk = [[-d * s for s in smooth] for d in deriv]
+    return hk, vk
+
 def array_from_image(load_filepath):
     """Load image and convert to 2D pixel array"""
+    from PIL import Image
+
     im = Image.open(load_filepath)
     im_pixels = list(im.getdata())
     width, height = im.size
@@ -24,6 +67,8 @@ def array_from_image(load_filepath):
 
 def image_from_array(pixel_array, save_filepath):
     """Convert 2D pixel array back to image and save"""
+    from PIL import Image
+
     array = np.array(pixel_array, dtype=np.uint8)
     new_image = Image.fromarray(array)
     new_image.save(save_filepath)
@@ -45,6 +90,12 @@ def getvalue(array, x, y):
     except IndexError:
         return 0
 
+def get_matrix(array, x, y, size=3):
+    """Get size x size pixel matrix around position (x, y)"""
+    radius = size // 2
+    return [[getvalue(array, x + n, y + m) for m in range(-radius, radius + 1)]
+            for n in range(-radius, radius + 1)]
+
 def get3X3matrix(array, x, y):
     """Get 3x3 pixel matrix around position (x, y)"""
     pixelmatrix = [[getvalue(array, x - 1, y - 1), getvalue(array, x - 1, y), getvalue(array, x - 1, y + 1)],
@@ -52,21 +103,27 @@ def get3X3matrix(array, x, y):
                    [getvalue(array, x + 1, y - 1), getvalue(array, x + 1, y), getvalue(array, x + 1, y + 1)]]
     return pixelmatrix
 
-def getedgyness(PM):
+def getedgyness(PM, hk=HK, vk=VK):
     """Calculate edge intensity using Sobel kernels"""
     HKV = 0
     VKV = 0
     
     for n in range(len(PM)):
         for m in range(len(PM[0])):
-            HKV += HK[n][m] * PM[n][m]
-            VKV += VK[n][m] * PM[n][m]
+            HKV += hk[n][m] * PM[n][m]
+            VKV += vk[n][m] * PM[n][m]
     
     KV = sqrt(HKV * HKV + VKV * VKV)
     return KV
 
 def image_to_blur(pixel_array):
-    """Apply blur filter to image"""
+    """
+    Apply blur filter to image.
+
+    Pixels are blurred in place in scan order, so each 3x3 average reads
+    neighbours above and to the left that are already blurred (the legacy
+    engine's blur). image_to_box_blur averages the unblurred neighbourhood.
+    """
     for i in range(len(pixel_array)):
         for j in range(len(pixel_array[i])):
             PM = get3X3matrix(pixel_array, i, j)
@@ -80,33 +137,224 @@ def image_to_blur(pixel_array):
             
     return pixel_array
 
-def detect_edges_sobel(input_path, output_path):
-    """Detect edges using Sobel operator"""
+def image_to_box_blur(pixel_array):
+    """Apply a 3x3 box blur reading the unblurred neighbourhood of every pixel (python engine)"""
+    # Read neighbours from an untouched copy so already-blurred pixels
+    # don't leak into the stencil of the pixels after them
+    source = [list(row) for row in pixel_array]
+    for i in range(len(pixel_array)):
+        for j in range(len(pixel_array[i])):
+            PM = get3X3matrix(source, i, j)
+            
+            Irow1 = PM[0][0] + PM[0][1] + PM[0][2]
+            Irow2 = PM[1][0] + PM[1][1] + PM[1][2]
+            Irow3 = PM[2][0] + PM[2][1] + PM[2][2]
+            I = (Irow1 + Irow2 + Irow3) / 9
+            
+            pixel_array[i][j] = (I, I, I)
+            
+    return pixel_array
+
+def gray_from_array(image):
+    """Convert an RGB(A) array to grayscale the way image_to_gray does"""
+    return as_mean_gray(np.asarray(image))
+
+def _border_rows(indices, height):
+    """Resolve row indices the way getvalue does: -1 wraps, height reads as 0"""
+    indices = np.where(indices < 0, indices + height, indices)
+    return np.minimum(indices, height)
+
+def _pad_cols(rows):
+    """Pad columns the way getvalue does: wrap on the left, zeros on the right"""
+    zeros = np.zeros((rows.shape[0], 1), dtype=rows.dtype)
+    return np.concatenate([rows[:, -1:], rows, zeros], axis=1)
+
+def _correlate(padded, kernel, height, width):
+    """Apply a square kernel in the same order getedgyness sums its terms"""
+    result = None
+    for n in range(len(kernel)):
+        for m in range(len(kernel)):
+            if kernel[n][m] == 0:
+                continue
+            term = kernel[n][m] * padded[n:n + height, m:m + width]
+            result = term if result is None else result + term
+    return result
+
+def blur_rows(read_gray_rows, height, rows):
+    """
+    Blur the given rows of a grayscale image with the 3x3 box filter.
+
+    Args:
+        read_gray_rows: Callable returning gray rows (uint8) for a sorted array of indices
+        height: Height of the full image
+        rows: Row indices to blur, -1 and height are resolved like getvalue
+
+    Returns:
+        float64 array with one blurred row per requested index
+    """
+    rows = _border_rows(np.asarray(rows), height)
+    neighbours = _border_rows(rows[:, None] + np.array([-1, 0, 1]), height)
+    neighbours[rows == height] = height
+
+    # Read every source row once and add a zero row for the bottom border
+    needed = np.unique(neighbours[neighbours < height])
+    source = read_gray_rows(needed).astype(np.uint16)
+    source = np.concatenate([source, np.zeros((1, source.shape[1]), dtype=np.uint16)])
+    positions = np.searchsorted(needed, neighbours)
+
+    width = source.shape[1]
+    total = np.zeros((len(rows), width), dtype=np.uint16)
+    for k in range(3):
+        padded = _pad_cols(source[positions[:, k]])
+        total += padded[:, 0:width]
+        total += padded[:, 1:width + 1]
+        total += padded[:, 2:width + 2]
+    return total / 9
+
+def sobel_magnitude_rows(read_gray_rows, height, start, stop):
+    """
+    Sobel edge magnitudes for rows [start, stop) of the blurred image.
+
+    Reads rows start-2 .. stop+1 of the grayscale image (plus the wrapped
+    bottom rows for the first band), so bands can be computed independently.
+    """
+    blurred = blur_rows(read_gray_rows, height, np.arange(start - 1, stop + 1))
+    padded = _pad_cols(blurred)
+    width = blurred.shape[1]
+    HKV = _correlate(padded, HK, stop - start, width)
+    VKV = _correlate(padded, VK, stop - start, width)
+    return np.sqrt(HKV * HKV + VKV * VKV)
+
+def normalize_edges(edges, min_edge, max_edge):
+    """Scale edge magnitudes to 0-255 like detect_edges_sobel"""
+    edge_range = max_edge - min_edge if max_edge != min_edge else 1
+    normalized = ((edges - min_edge) / edge_range) * 255
+    return np.clip(normalized.astype(np.int64), 0, 255).astype(np.uint8)
+
+@operation("sobel")
+def detect_edges_sobel_from_array(image, backend="numpy", ksize=3, accumulator="float64"):
+    """
+    Detect edges using the Sobel operator on an in-memory image.
+
+    Equivalent of the pixel loops in detect_edges_sobel: grayscale, 3x3 box
+    blur and Sobel kernels with the same getvalue borders. The default numpy
+    backend with 3x3 kernels and float64 matches the loops exactly.
+
+    Args:
+        image: Color or grayscale numpy array (channel order doesn't matter),
+            or LoadedImage (reuses its cached grayscale)
+        backend: Convolution backend, see src.sobel_backends ("auto" picks the
+            fastest on this host)
+        ksize: Sobel kernel size, 3, 5 or 7
+        accumulator: "float64", "float32" or "int16"
+
+    Returns:
+        Tuple of (grayscale, blurred, edges) as uint8 arrays
+    """
+    from src.sobel_backends import box_blur, sobel_edges
+
+    gray = as_mean_gray(image)
+    # A LoadedImage keeps the blur for the other Sobel passes over it
+    blurred = cached(image, "box_blur", lambda: box_blur(gray, "numpy" if backend == "auto" else backend))
+    blurred, edges = sobel_edges(gray, backend, ksize, accumulator, blurred)
+    return gray, blurred, edges
+
+def _load_rgb(load_filepath):
+    """Load an image as an RGB(A) array with PIL"""
+    from PIL import Image
+
+    with stage("decode"):
+        im = Image.open(load_filepath)
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGB")
+        return np.asarray(im)
+
+
+def _step_path(steps_dir, name):
+    """Path of an intermediate step image, or None when steps aren't saved"""
+    return os.path.join(steps_dir, name) if steps_dir else None
+
+def _detect_edges_sobel_python(input_path, output_path, steps_dir):
+    """Reference implementation using the pure-Python pixel loops"""
     # Load the image and convert it to a 2D pixel array
     pixels = array_from_image(input_path)
-    image_from_array(pixels, "output/step1_original.png")
+    if steps_dir:
+        image_from_array(pixels, _step_path(steps_dir, "step1_original.png"))
 
     # Convert to grayscale
     pixels = image_to_gray(pixels)
-    image_from_array(pixels, "output/step2_grayscale.png")
+    if steps_dir:
+        image_from_array(pixels, _step_path(steps_dir, "step2_grayscale.png"))
     
     # Apply blur
-    pixels = image_to_blur(pixels)
-    image_from_array(pixels, "output/step3_blurred.png")
+    pixels = image_to_box_blur(pixels)
+    if steps_dir:
+        image_from_array(pixels, _step_path(steps_dir, "step3_blurred.png"))
 
     # Apply Sobel operator and find max value for normalization
     edge_values = []
     for i in range(len(pixels)):
+        row = []
         for j in range(len(pixels[i])):
             PM = get3X3matrix(pixels, i, j)
-            edgyness = getedgyness(PM)
-            edge_values.append(edgyness)
+            row.append(getedgyness(PM))
+        edge_values.append(row)
     
+    # Normalize edge values to 0-255 range
+    flat_values = [value for row in edge_values for value in row]
+    max_edge = max(flat_values) if flat_values else 1
+    min_edge = min(flat_values) if flat_values else 0
+    edge_range = max_edge - min_edge if max_edge != min_edge else 1
+    
+    for i in range(len(pixels)):
+        for j in range(len(pixels[i])):
+            # Normalize to 0-255
+            normalized = int(((edge_values[i][j] - min_edge) / edge_range) * 255)
+            normalized = max(0, min(255, normalized))  # Clamp to 0-255
+            pixels[i][j] = (normalized, normalized, normalized)
+            
+    # Save the processed image
+    if output_path:
+        image_from_array(pixels, output_path)
+    return np.array(pixels, dtype=np.uint8)[:, :, 0]
+
+def _detect_edges_sobel_legacy(input_path, output_path, steps_dir):
+    """
+    The original pixel loops, which write results into the buffer they read.
+
+    Each stencil sees its upper and left neighbours already processed: blurred
+    in the blur, and already normalized in the final pass (so values are
+    recomputed there and clamped). The output depends on the scan order and
+    can't be vectorized; it is kept to reproduce results made before the
+    numpy engine.
+    """
+    # Load the image and convert it to a 2D pixel array
+    pixels = array_from_image(input_path)
+    if steps_dir:
+        image_from_array(pixels, _step_path(steps_dir, "step1_original.png"))
+
+    # Convert to grayscale
+    pixels = image_to_gray(pixels)
+    if steps_dir:
+        image_from_array(pixels, _step_path(steps_dir, "step2_grayscale.png"))
+
+    # Apply blur
+    pixels = image_to_blur(pixels)
+    if steps_dir:
+        image_from_array(pixels, _step_path(steps_dir, "step3_blurred.png"))
+
+    # Apply Sobel operator and find max value for normalization
+    edge_values = []
+    for i in range(len(pixels)):
+        for j in range(len(pixels[i])):
+            PM = get3X3matrix(pixels, i, j)
+            edge_values.append(getedgyness(PM))
+
     # Normalize edge values to 0-255 range
     max_edge = max(edge_values) if edge_values else 1
     min_edge = min(edge_values) if edge_values else 0
     edge_range = max_edge - min_edge if max_edge != min_edge else 1
-    
+
     for i in range(len(pixels)):
         for j in range(len(pixels[i])):
             PM = get3X3matrix(pixels, i, j)
@@ -115,9 +363,101 @@ def detect_edges_sobel(input_path, output_path):
             normalized = int(((edgyness - min_edge) / edge_range) * 255)
             normalized = max(0, min(255, normalized))  # Clamp to 0-255
             pixels[i][j] = (normalized, normalized, normalized)
-            
+
     # Save the processed image
-    image_from_array(pixels, output_path)
+    if output_path:
+        image_from_array(pixels, output_path)
+    return np.array(pixels, dtype=np.uint8)[:, :, 0]
+
+@operation("sobel")
+def detect_edges_sobel(input_path, output_path, engine="numpy", steps_dir=None, writer=None,
+                       backend="numpy", ksize=3, accumulator="float64"):
+    """
+    Detect edges using Sobel operator.
+
+    Args:
+        input_path: Path to input image, or BGR numpy array / LoadedImage (numpy engine)
+        output_path: Path to save output image, None to only return the edges
+        engine: "numpy" for the vectorized engine, "python" for the pixel
+            loops giving the same output, or "legacy" for the original loops.
+            Those read pixels they had already overwritten, so their output
+            differs from the other engines on almost every pixel
+        steps_dir: Directory for the intermediate step images (opt-in debug output)
+        writer: Optional ImageWriter encoding the images in the background
+            (numpy engine)
+        backend: Convolution backend of the numpy engine, see src.sobel_backends
+        ksize: Sobel kernel size, 3, 5 or 7 (numpy engine)
+        accumulator: "float64", "float32" or "int16" (numpy engine)
+
+    Returns:
+        Detected edges as a 2D uint8 numpy array
+    """
+    if engine == "python":
+        return _detect_edges_sobel_python(input_path, output_path, steps_dir)
+    if engine == "legacy":
+        return _detect_edges_sobel_legacy(input_path, output_path, steps_dir)
+    if engine != "numpy":
+        raise ValueError(f"Unknown Sobel engine: {engine}")
+
+    image = _load_rgb(input_path) if isinstance(input_path, str) else input_path
+    gray, blurred, edges = detect_edges_sobel_from_array(image, backend, ksize, accumulator)
+    if steps_dir:
+        original = image if isinstance(input_path, str) else as_rgb(image)
+        code = cv2.COLOR_RGBA2BGRA if original.ndim == 3 and original.shape[2] == 4 else cv2.COLOR_RGB2BGR
+        original = cv2.cvtColor(original, code) if original.ndim == 3 else original
+        write_image(_step_path(steps_dir, "step1_original.png"), original, writer)
+        write_image(_step_path(steps_dir, "step2_grayscale.png"), gray, writer)
+        write_image(_step_path(steps_dir, "step3_blurred.png"), blurred, writer)
+    if output_path:
+        write_image(output_path, edges, writer)
+    return edges
+
+@operation("sobel")
+def detect_edges_sobel_tiled(input_path, output_path, band_rows=256, workers=1):
+    """
+    Detect edges using Sobel operator, processing the image in row bands.
+
+    Each band reads a 2-row halo so the blur and Sobel stencils match
+    detect_edges_sobel exactly at band seams. Normalization needs the global
+    min/max, so the gradient is computed twice: once per band for the range,
+    then again to write the normalized band. Peak memory depends on
+    band_rows, not on the image size, when the input is memory-mappable
+    (.npy or binary PGM/PPM).
+
+    Args:
+        input_path: Path to input image
+        output_path: Path to save output image (.npy is written as a memmap)
+        band_rows: Number of rows per band
+        workers: Number of threads processing bands
+
+    Returns:
+        Memory-mapped edges for .npy outputs, otherwise None
+    """
+    source = open_image_source(input_path, _load_rgb)
+    height, width = source.shape[:2]
+
+    def read_gray_rows(indices):
+        return gray_from_array(read_rows(source, indices))
+
+    def band_range(start, stop):
+        edges = sobel_magnitude_rows(read_gray_rows, height, start, stop)
+        return edges.min(), edges.max()
+
+    bands = iter_bands(height, band_rows)
+    with stage("range"):
+        ranges = process_bands(bands, band_range, workers)
+    min_edge = min(low for low, high in ranges)
+    max_edge = max(high for low, high in ranges)
+
+    output = open_band_output(output_path, (height, width))
+
+    def write_band(start, stop):
+        edges = sobel_magnitude_rows(read_gray_rows, height, start, stop)
+        output[start:stop] = normalize_edges(edges, min_edge, max_edge)
+
+    with stage("gradient"):
+        process_bands(bands, write_band, workers)
+    return close_band_output(output, output_path)
 
 if __name__ == "__main__":
     detect_edges_sobel("samples/sample_image.jpg", "output/sobel_edges.png")
@@ -0,0 +1,140 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.image_io import is_indexed, load_indexed
+from src.image_writer import write_image
+
+def _read_pnm_header(f):
+    """Read a binary PGM/PPM header, returns (magic, width, height, maxval)"""
+    tokens = []
+    while len(tokens) < 4:
+        line = f.readline()
+        if not line:
+            raise ValueError("Truncated PNM header")
+        tokens.extend(line.split(b"#")[0].split())
+    magic, width, height, maxval = tokens[:4]
+    return magic, int(width), int(height), int(maxval)
+
+def _map_pnm(path):
+    """Memory-map the pixel data of an 8-bit binary PGM/PPM, or return None"""
+    with open(path, "rb") as f:
+        if f.read(2) not in (b"P5", b"P6"):
+            return None
+        f.seek(0)
+        magic, width, height, maxval = _read_pnm_header(f)
+        offset = f.tell()
+    if maxval > 255:
+        return None
+
+    channels = 3 if magic == b"P6" else 1
+    shape = (height, width, channels) if channels == 3 else (height, width)
+    data = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=shape)
+    # PPM stores RGB, present it in OpenCV's BGR order without copying
+    return data[:, :, ::-1] if channels == 3 else data
+
+class IndexedSource:
+    """
+    BGR view of a memory-mapped label map and its palette.
+
+    Indexing reads the labels of the requested rows and expands only those,
+    so a label map can be read in bands like any other source.
+    """
+
+    def __init__(self, labels, palette):
+        self.labels = labels
+        self.palette = np.asarray(palette, dtype=np.uint8)
+        self._palette_bgr = np.ascontiguousarray(self.palette[:, ::-1])
+        self.shape = tuple(labels.shape) + (3,)
+        self.ndim = 3
+        self.dtype = np.dtype(np.uint8)
+
+    def __getitem__(self, index):
+        return self._palette_bgr[np.asarray(self.labels[index])]
+
+def open_image_source(image_path, decode):
+    """
+    Open an image for band-wise reading.
+
+    .npy files and 8-bit binary PGM/PPM files are memory-mapped, so only the
+    rows that are read get loaded. Color data is presented in BGR order
+    (.npy arrays are taken as already BGR). A .npy label map with a palette
+    sidecar (see image_io.is_indexed) is opened as an IndexedSource. Any
+    other format can't be read partially and is decoded in full with the
+    given decode function.
+
+    Args:
+        image_path: Path to input image
+        decode: Function decoding a regular image file to a numpy array
+
+    Returns:
+        Array-like image (numpy array or memmap)
+    """
+    extension = os.path.splitext(image_path)[1].lower()
+    if extension == ".npy" and is_indexed(image_path):
+        return IndexedSource(*load_indexed(image_path, mmap=True))
+    if extension == ".npy":
+        return np.load(image_path, mmap_mode="r")
+    if extension in (".pgm", ".ppm", ".pnm"):
+        mapped = _map_pnm(image_path)
+        if mapped is not None:
+            return mapped
+
+    image = decode(image_path)
+    assert image is not None, "file could not be read, check with os.path.exists()"
+    return image
+
+def read_rows(source, indices):
+    """Read a sorted array of row indices from an image source"""
+    return np.asarray(source[indices])
+
+def iter_bands(height, band_rows):
+    """Split [0, height) into (start, stop) row bands"""
+    return [(start, min(start + band_rows, height)) for start in range(0, height, band_rows)]
+
+def process_bands(bands, func, workers=1):
+    """
+    Run func(start, stop) over row bands and return the results in order.
+
+    With workers > 1 the bands run on a thread pool (OpenCV and NumPy release
+    the GIL). At most 2 * workers bands are in flight, so peak memory depends
+    on the band size rather than the image size.
+    """
+    if workers <= 1:
+        return [func(start, stop) for start, stop in bands]
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for start, stop in bands:
+            pending.append(executor.submit(func, start, stop))
+            if len(pending) >= 2 * workers:
+                results.append(pending.pop(0).result())
+        results.extend(future.result() for future in pending)
+    return results
+
+def open_band_output(output_path, shape, dtype=np.uint8):
+    """
+    Create a memory-mapped output array that bands can be written into.
+
+    A .npy output path is mapped directly. For other formats the bands go to
+    an anonymous temporary file that close_band_output encodes with
+    write_image.
+    """
+    if output_path and output_path.lower().endswith(".npy"):
+        return np.lib.format.open_memmap(output_path, mode="w+", dtype=dtype, shape=shape)
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode="w+", shape=shape)
+
+def close_band_output(output, output_path):
+    """
+    Flush a band output, encoding it when the target isn't a .npy file.
+
+    Returns:
+        The memory-mapped result for .npy outputs, otherwise None
+    """
+    output.flush()
+    if output_path and output_path.lower().endswith(".npy"):
+        return output
+    if output_path:
+        write_image(output_path, output)
+    return None
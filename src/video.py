@@ -0,0 +1,206 @@
+"""
+Video and frame-stream processing.
+
+A reader thread decodes frames with cv2.VideoCapture into a bounded queue,
+a pool of worker threads runs Canny, Sobel or a fixed shading palette on
+them, and the results are written in order with cv2.VideoWriter. The queue
+and the number of frames in flight are both bounded, so memory stays flat
+whatever the length of the video. Threads are used rather than processes:
+OpenCV and most NumPy work release the GIL, and frames don't need to be
+pickled.
+
+With realtime=True the video's clock starts at the first frame, and the
+reader drops frames while it is more than max_lag seconds behind that
+clock. A dropped frame repeats the previous output, so the result keeps the
+input's duration. Dropping saves the processing and the conversion of the
+frame, not its decoding: VideoCapture.grab() still decodes it with the FFmpeg
+backend, since the frames after it may be predicted from it.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+from src.instrument import stage
+
+OPERATIONS = ("canny", "sobel", "palette")
+
+# Marks the end of the frame queue
+_END = object()
+
+def frame_function(operation, first_frame, low_threshold=100, high_threshold=200, palette=None):
+    """
+    Function processing one BGR frame into one BGR output frame.
+
+    Args:
+        operation: "canny", "sobel" or "palette"
+        first_frame: First frame of the video, fits the palette when none is given
+        low_threshold: Canny low threshold
+        high_threshold: Canny high threshold
+        palette: Palette dictionary or .npz path for "palette"
+
+    Returns:
+        Function taking and returning a BGR uint8 frame
+    """
+    if operation == "canny":
+        from src.canny_edge_detector import detect_edges_canny_from_array
+        return lambda frame: cv2.cvtColor(detect_edges_canny_from_array(frame, low_threshold, high_threshold),
+                                          cv2.COLOR_GRAY2BGR)
+    if operation == "sobel":
+        from src.sobel_edge_detector import detect_edges_sobel_from_array
+        return lambda frame: cv2.cvtColor(detect_edges_sobel_from_array(frame)[2], cv2.COLOR_GRAY2BGR)
+    if operation == "palette":
+        from src.remove_shading import apply_shading_palette, fit_shading_palette, load_palette
+        if palette is None:
+            palette = fit_shading_palette(first_frame, max_samples=100000)
+        elif isinstance(palette, str):
+            palette = load_palette(palette)
+        return lambda frame: apply_shading_palette(frame, palette)
+    raise ValueError(f"Unknown operation: {operation}")
+
+def _put(frames, item, stop):
+    """Put an item on the queue, giving up when stop is set; returns whether it was queued"""
+    while not stop.is_set():
+        try:
+            frames.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _read_frames(capture, frames, stop, fps, realtime, max_lag):
+    """
+    Reader thread: queue (index, frame) pairs, then _END.
+
+    A dropped frame is queued as (index, None). Errors are queued in place
+    of the next frame.
+    """
+    index = 0
+    start = None
+    try:
+        while not stop.is_set():
+            if realtime and start is not None and time.perf_counter() - start > index / fps + max_lag:
+                # Behind the video's clock: skip the frame (grab() still
+                # decodes it, but doesn't convert or return the pixels)
+                if not capture.grab():
+                    break
+                frame = None
+            else:
+                with stage("read"):
+                    ok, frame = capture.read()
+                if not ok:
+                    break
+                if start is None:
+                    start = time.perf_counter()
+            if not _put(frames, (index, frame), stop):
+                return
+            index += 1
+    except Exception as e:
+        _put(frames, e, stop)
+        return
+    _put(frames, _END, stop)
+
+def process_video(input_path, output_path, operation="canny", workers=None, queue_size=8,
+                  realtime=False, max_lag=0.5, fourcc="mp4v", low_threshold=100, high_threshold=200,
+                  palette=None, progress=None, progress_interval=1.0):
+    """
+    Process every frame of a video and write the results as a video.
+
+    Args:
+        input_path: Video file (or anything cv2.VideoCapture opens)
+        output_path: Output video path
+        operation: "canny", "sobel" or "palette"
+        workers: Number of worker threads (default: CPUs)
+        queue_size: Maximum frames decoded ahead, and maximum frames in flight
+        realtime: Drop frames while processing falls behind the video's frame rate
+        max_lag: Seconds behind the video's clock tolerated before dropping (realtime only)
+        fourcc: Four-character code of the output codec
+        low_threshold: Canny low threshold
+        high_threshold: Canny high threshold
+        palette: Palette dictionary or .npz path for "palette" (default: fitted
+            on the first frame)
+        progress: Optional function called with the statistics every
+            progress_interval seconds
+        progress_interval: Seconds between progress calls
+
+    Returns:
+        Statistics dictionary: 'frames' written, 'processed', 'skipped',
+        'seconds', 'fps' (frames processed per second) and the input's 'input_fps'
+    """
+    capture = cv2.VideoCapture(input_path)
+    if not capture.isOpened():
+        raise IOError(f"could not open video: {input_path}")
+    input_fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    workers = workers or os.cpu_count() or 1
+    queue_size = max(queue_size, 1)
+
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_frames, args=(capture, frames, stop, input_fps, realtime, max_lag),
+                              name="video-reader", daemon=True)
+    stats = {"frames": 0, "processed": 0, "skipped": 0, "seconds": 0.0, "fps": 0.0, "input_fps": input_fps}
+    state = {"writer": None, "last": None, "reported": time.perf_counter()}
+    start = time.perf_counter()
+
+    def write(future):
+        if future is None:
+            # Dropped frame: repeat the previous output
+            stats["skipped"] += 1
+            output = state["last"]
+            if output is None:
+                return
+        else:
+            output = future.result()
+            stats["processed"] += 1
+        if state["writer"] is None:
+            height, width = output.shape[:2]
+            state["writer"] = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), input_fps,
+                                              (width, height))
+            if not state["writer"].isOpened():
+                raise IOError(f"could not open video writer for {output_path} ({fourcc})")
+        with stage("write"):
+            state["writer"].write(output)
+        state["last"] = output
+        stats["frames"] += 1
+
+        now = time.perf_counter()
+        stats["seconds"] = now - start
+        stats["fps"] = stats["processed"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+        if progress is not None and now - state["reported"] >= progress_interval:
+            state["reported"] = now
+            progress(dict(stats))
+
+    func = None
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            reader.start()
+            while True:
+                item = frames.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                _, frame = item
+                if frame is not None and func is None:
+                    func = frame_function(operation, frame, low_threshold, high_threshold, palette)
+                pending.append(executor.submit(func, frame) if frame is not None else None)
+                # Write finished frames in order, keeping at most queue_size in flight
+                while pending and (len(pending) >= queue_size or pending[0] is None or pending[0].done()):
+                    write(pending.popleft())
+            while pending:
+                write(pending.popleft())
+    finally:
+        stop.set()
+        reader.join()
+        capture.release()
+        if state["writer"] is not None:
+            state["writer"].release()
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["fps"] = stats["processed"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    return stats
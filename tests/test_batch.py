@@ -0,0 +1,76 @@
+"""Batch Canny: deterministic outputs, per-file failures and a bounded number of queued tasks."""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from src.batch import expand_inputs, output_paths, run_batch
+from src.canny_edge_detector import detect_edges_canny, detect_edges_canny_batch
+
+
+@pytest.fixture
+def folder(tmp_path):
+    """Images in two folders, with the same name in both, and an unreadable file"""
+    rng = np.random.default_rng(0)
+    for sub in ("a", "b"):
+        (tmp_path / "in" / sub).mkdir(parents=True)
+        for name in ("x.png", "y.jpg"):
+            cv2.imwrite(str(tmp_path / "in" / sub / name), rng.integers(0, 256, (40, 50, 3), dtype=np.uint8))
+    (tmp_path / "in" / "a" / "broken.png").write_bytes(b"not an image")
+    (tmp_path / "in" / "a" / "notes.txt").write_text("skipped")
+    return tmp_path / "in"
+
+
+def test_expand_inputs_sorted_and_unique(folder):
+    paths = expand_inputs([str(folder / "b"), str(folder / "a"), str(folder / "a" / "x.png")])
+    names = [path.split("in/", 1)[1] for path in paths]
+    assert names == ["b/x.png", "b/y.jpg", "a/broken.png", "a/x.png", "a/y.jpg"]
+
+
+def test_output_paths_keep_layout(folder, tmp_path):
+    paths = expand_inputs([str(folder)], recursive=True)
+    outputs = output_paths(paths, str(tmp_path / "out"), "_canny", ".png")
+    assert len(set(outputs)) == len(outputs)
+    assert str(tmp_path / "out" / "a" / "x_canny.png") in outputs
+    assert str(tmp_path / "out" / "b" / "x_canny.png") in outputs
+
+
+@pytest.mark.parametrize("use_threads", [True, False])
+def test_batch_canny(folder, tmp_path, use_threads):
+    failures = []
+    report = detect_edges_canny_batch([str(folder)], str(tmp_path / "out"), 50, 150, workers=2,
+                                      use_threads=use_threads, recursive=True,
+                                      on_result=lambda path, output, error: error and failures.append(path))
+
+    assert report["processed"] == 4
+    assert [path for path, _ in report["failed"]] == failures == [str(folder / "a" / "broken.png")]
+    assert report["images_per_sec"] > 0
+    for sub in ("a", "b"):
+        for name in ("x", "y"):
+            output = cv2.imread(str(tmp_path / "out" / sub / f"{name}_canny.png"), cv2.IMREAD_GRAYSCALE)
+            source = str(folder / sub / (name + (".png" if name == "x" else ".jpg")))
+            assert (output == detect_edges_canny(source, None, 50, 150)).all()
+
+
+def test_run_batch_bounds_tasks_in_flight():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def task(i):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        if i == 3:
+            raise ValueError("bad task")
+        return i * i
+
+    results = list(run_batch(task, range(20), workers=4, max_in_flight=3, use_threads=True))
+    assert [result for _, result, _ in results] == [i * i if i != 3 else None for i in range(20)]
+    assert isinstance(results[3][2], ValueError)
+    assert running[1] <= 3
@@ -0,0 +1,84 @@
+"""Result cache: content-addressed keys, size-bounded LRU eviction and temporary file cleanup."""
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from src.cache import EVICT_TO, STALE_TEMP_SECONDS, ResultCache, cache_key, cached, file_hash
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "cache"), max_bytes=10000)
+
+
+@pytest.mark.parametrize("value", [np.arange(12, dtype=np.uint8).reshape((3, 4)), b"\x89PNG", [[1, 2, 3]]])
+def test_round_trip(cache, value):
+    cache.put("ab" * 32, value)
+    result = cache.get("ab" * 32)
+    if isinstance(value, np.ndarray):
+        assert result.dtype == value.dtype and (result == value).all()
+    else:
+        assert result == value
+
+
+def test_key_follows_content_and_params(tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(b"one")
+    key = cache_key("colors", file_hash(str(path)), {"n": 8})
+    assert cache_key("colors", file_hash(str(path)), {"n": 8}) == key
+    assert cache_key("colors", file_hash(str(path)), {"n": 4}) != key
+    path.write_bytes(b"two")
+    assert cache_key("colors", file_hash(str(path)), {"n": 8}) != key
+
+
+def test_cached_computes_once(cache, tmp_path):
+    path = tmp_path / "image.png"
+    path.write_bytes(b"pixels")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [[255, 0, 0]]
+
+    assert cached(cache, "colors", str(path), {}, compute) == [[255, 0, 0]]
+    assert cached(cache, "colors", str(path), {}, compute) == [[255, 0, 0]]
+    assert len(calls) == 1
+
+
+def test_least_recently_used_evicted(cache):
+    keys = [f"{i:02d}" * 32 for i in range(30)]
+    for i, key in enumerate(keys):
+        cache.put(key, bytes(1000))
+        # Distinct modification times, oldest first
+        os.utime(cache._path(key, ".bin"), (i, i))
+        if i == 5:
+            cache.get(keys[0])
+    assert cache.size() <= cache.max_bytes
+    # Read after it was written, so newer than the entries written after it
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[-1]) is not None
+    assert cache.get(keys[1]) is None
+
+
+def test_eviction_leaves_headroom(cache):
+    for i in range(11):
+        cache.put(f"{i:02d}" * 32, bytes(1000))
+    assert cache.size() <= cache.max_bytes * EVICT_TO
+
+
+def test_stale_temporary_files_removed(cache):
+    cache.put("ab" * 32, b"entry")
+    folder = os.path.dirname(cache._path("ab" * 32, ".bin"))
+    stale, fresh = os.path.join(folder, "stale.tmp"), os.path.join(folder, "fresh.tmp")
+    for path in (stale, fresh):
+        with open(path, "wb") as f:
+            f.write(bytes(100))
+    old = time.time() - STALE_TEMP_SECONDS - 10
+    os.utime(stale, (old, old))
+
+    # A write in progress counts towards the size, a left-over one is deleted
+    assert cache.size() == len(b"entry") + 100
+    assert not os.path.exists(stale) and os.path.exists(fresh)
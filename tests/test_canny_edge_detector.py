@@ -0,0 +1,38 @@
+"""Canny threshold sweep: one gradient computation, same edges as separate runs."""
+
+import cv2
+import numpy as np
+import pytest
+
+from src.canny_edge_detector import (auto_canny, auto_canny_thresholds, canny_gradients, canny_threshold_sweep,
+                                     detect_edges_canny_from_array)
+
+PAIRS = [(10, 30), (50, 150), (100, 200), (150, 250)]
+
+
+@pytest.fixture(scope="module")
+def image():
+    noise = np.random.default_rng(0).uniform(0, 255, (90, 120, 3)).astype(np.float32)
+    return cv2.normalize(cv2.GaussianBlur(noise, (0, 0), 2), None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+
+def test_sweep_matches_separate_runs(image):
+    edges = canny_threshold_sweep(image, PAIRS)
+    assert edges.shape == (len(PAIRS),) + image.shape[:2]
+    for stack, (low, high) in zip(edges, PAIRS):
+        assert (stack == detect_edges_canny_from_array(image, low, high)).all()
+
+
+def test_sweep_reuses_gradients(image):
+    gradients = canny_gradients(image)
+    assert (canny_threshold_sweep(None, PAIRS, gradients) == canny_threshold_sweep(image, PAIRS)).all()
+
+
+def test_auto_canny_picks_nearest_pair(image):
+    low, high = auto_canny_thresholds(image)
+    median = np.median(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    assert (low, high) == (int(0.67 * median), int(min(255, 1.33 * median)))
+
+    edges, pair = auto_canny(image, threshold_pairs=PAIRS)
+    assert pair == min(PAIRS, key=lambda p: abs(p[0] - low) + abs(p[1] - high))
+    assert (edges == detect_edges_canny_from_array(image, *pair)).all()
@@ -0,0 +1,58 @@
+"""Batch command line: one result per input, failures reported without stopping the batch."""
+
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from src.cli import main
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """A folder with two images and one unreadable file"""
+    folder = tmp_path / "in"
+    folder.mkdir()
+    rng = np.random.default_rng(0)
+    for name in ("a.png", "b.png"):
+        cv2.imwrite(str(folder / name), rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+    (folder / "broken.png").write_bytes(b"not an image")
+    return folder
+
+
+def test_canny_batch_writes_outputs(inputs, tmp_path, capsys):
+    status = main(["canny", str(inputs), "-o", str(tmp_path / "out"), "--threads", "--json"])
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    assert status == 1
+    results = {record["input"].rsplit("/", 1)[1]: record for record in records[:-1]}
+    assert not results["broken.png"]["ok"]
+    for name in ("a", "b"):
+        assert results[f"{name}.png"]["ok"]
+        assert cv2.imread(str(tmp_path / "out" / f"{name}_canny.png")) is not None
+    assert records[-1]["summary"]["processed"] == 2
+    assert len(records[-1]["summary"]["failed"]) == 1
+
+
+def test_colors_json_output_stays_json(inputs, capsys):
+    status = main(["colors", str(inputs), "--method", "histogram", "--no-cache", "--threads", "--json"])
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    assert status == 1
+    broken = next(record for record in records[:-1] if record["input"].endswith("broken.png"))
+    # The real cause is reported, not a generic failure
+    assert "could not be read" in broken["error"]
+    assert all(len(record["colors"]) == 8 for record in records[:-1] if record["ok"])
+
+
+@pytest.mark.parametrize("argv", [
+    ["sobel", "x.png", "--preview", "2", "--engine", "legacy"],
+    ["sobel", "x.png", "--preview", "2", "--engine", "python"],
+    ["canny", "x.png", "--jpeg-quality", "101"],
+    ["canny", "x.png", "--jpeg-quality", "-1"],
+])
+def test_invalid_options_rejected(argv):
+    with pytest.raises(SystemExit) as error:
+        main(argv)
+    assert error.value.code == 2
@@ -0,0 +1,55 @@
+"""The fast color extraction methods quantize about as well as the exact one."""
+
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from src.color_extractor import color_histogram, _fit_histogram, _fit_sample, _kmeans
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+NUM_COLORS = 8
+# Maximum increase of the RMS distance to the nearest palette color over the
+# exact palette, in levels (the docstring of extract_bright_colorful_colors
+# states the measured value)
+MAX_EXCESS = 0.1
+
+
+def _rms_distance(rgb, centers):
+    """RMS distance from every pixel to its nearest center"""
+    pixels = rgb.reshape((-1, 3)).astype(np.float64)
+    centers = np.asarray(centers, dtype=np.float64)
+    distances = ((pixels[:, None, :] - centers[None]) ** 2).sum(axis=2).min(axis=1)
+    return np.sqrt(distances.mean())
+
+
+@pytest.fixture(scope="module", params=[("TestImage.png", 1), ("climbingWall.jpg", 2)], ids=lambda p: p[0])
+def sample(request):
+    """RGB sample image (at 1/reduce size) and the RMS distance of its exact palette"""
+    name, reduce = request.param
+    bgr = cv2.imread(os.path.join(SAMPLES, name))[::reduce, ::reduce]
+    rgb = np.ascontiguousarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+    exact = _kmeans(n_clusters=NUM_COLORS, n_init=10, random_state=42).fit(rgb.reshape((-1, 3))).cluster_centers_
+    return rgb, _rms_distance(rgb, exact)
+
+
+def test_histogram_close_to_exact(sample):
+    rgb, exact = sample
+    counts, sums = color_histogram(rgb.reshape((-1, 3)), 5)
+    assert _rms_distance(rgb, _fit_histogram(counts, sums, NUM_COLORS)) <= exact + MAX_EXCESS
+
+
+def test_sample_close_to_exact(sample):
+    rgb, exact = sample
+    assert _rms_distance(rgb, _fit_sample(rgb, NUM_COLORS, 100000)) <= exact + MAX_EXCESS
+
+
+def test_histogram_bin_means_within_bound():
+    # Every pixel is within (2**(8-bits) - 1) * sqrt(3) of its bin's mean
+    pixels = np.random.default_rng(0).integers(0, 256, (20000, 3), dtype=np.uint8)
+    counts, sums = color_histogram(pixels, 5)
+    shift = 3
+    bins = ((pixels[:, 0] >> shift).astype(int) << 10) | ((pixels[:, 1] >> shift).astype(int) << 5) | (pixels[:, 2] >> shift)
+    means = sums[bins] / counts[bins][:, None]
+    assert np.sqrt(((pixels - means) ** 2).sum(axis=1)).max() <= 7 * np.sqrt(3)
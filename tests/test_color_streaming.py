@@ -0,0 +1,52 @@
+"""Streaming color extraction gives the in-memory result while reading the image in chunks."""
+
+import cv2
+import numpy as np
+import pytest
+
+from src.color_extractor import (_reservoir_add, extract_bright_colorful_colors_from_array,
+                                  extract_bright_colorful_colors_streaming)
+
+
+@pytest.fixture(scope="module")
+def image():
+    noise = np.random.default_rng(0).uniform(0, 255, (60, 80, 3)).astype(np.float32)
+    return cv2.normalize(cv2.GaussianBlur(noise, (0, 0), 3), None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+
+@pytest.fixture(params=[".png", ".npy"])
+def image_path(request, image, tmp_path):
+    path = str(tmp_path / f"image{request.param}")
+    if request.param == ".npy":
+        np.save(path, image)
+    else:
+        cv2.imwrite(path, image)
+    return path
+
+
+def test_histogram_matches_in_memory(image, image_path):
+    # Chunks of a few rows, so the running histogram sums many partial ones
+    colors = extract_bright_colorful_colors_streaming(image_path, num_colors=6, chunk_pixels=500)
+    assert colors == extract_bright_colorful_colors_from_array(image, num_colors=6, method="histogram")
+
+
+def test_full_reservoir_matches_exact(image, image_path):
+    # A reservoir larger than the image keeps every pixel in order
+    colors = extract_bright_colorful_colors_streaming(image_path, num_colors=6, method="reservoir",
+                                                      chunk_pixels=500, max_samples=image.size)
+    assert colors == extract_bright_colorful_colors_from_array(image, num_colors=6, method="exact")
+
+
+def test_reservoir_sample_is_uniform():
+    # Every pixel, early or late in the stream, is kept with the same probability
+    rng = np.random.default_rng(1)
+    kept = np.zeros(1000)
+    for _ in range(300):
+        reservoir = np.empty((100, 1), dtype=np.int64)
+        seen = 0
+        for start in range(0, 1000, 70):
+            seen = _reservoir_add(reservoir, seen, np.arange(start, min(start + 70, 1000))[:, None], rng)
+        kept[reservoir[:, 0]] += 1
+    assert kept.sum() == 300 * 100
+    assert abs(kept[:500].sum() - kept[500:].sum()) < 0.05 * kept.sum()
+    assert abs(kept[:100].mean() - 30) < 5 and abs(kept[-100:].mean() - 30) < 5
@@ -0,0 +1,66 @@
+"""Document corners are found without clicks, unclear pages are left for manual corners, and
+fixed-camera captures are warped with a precomputed scan profile."""
+
+import cv2
+import numpy as np
+import pytest
+
+from src.document_scanner import (apply_scan_profile, create_scan_profile, find_document_corners,
+                                  four_point_transform, load_scan_profile, save_scan_profile,
+                                  scan_documents_batch)
+
+# Page corners in the order find_document_corners returns them: top-left,
+# top-right, bottom-right, bottom-left
+CORNERS = np.array([[260, 150], [1010, 210], [960, 840], [210, 760]], dtype=np.float32)
+
+
+def _capture():
+    """A bright page on a darker, textured desk"""
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(40, 90, (1000, 1200, 3), dtype=np.uint8), (0, 0), 2)
+    cv2.fillConvexPoly(image, CORNERS.astype(np.int32), (235, 240, 245))
+    return image
+
+
+def test_corners_found_at_full_resolution():
+    # Detection runs on a copy downscaled 3x; corners come back full size
+    corners, confidence = find_document_corners(_capture(), max_dim=400)
+    assert confidence > 0.5
+    assert np.abs(corners - CORNERS).max() < 8
+
+
+def test_blank_image_has_no_confident_corners():
+    corners, confidence = find_document_corners(np.full((300, 400, 3), 128, dtype=np.uint8))
+    assert corners is None and confidence == 0.0
+
+
+def test_batch_skips_low_confidence_pages(tmp_path):
+    folder = tmp_path / "in"
+    folder.mkdir()
+    cv2.imwrite(str(folder / "page.png"), _capture())
+    cv2.imwrite(str(folder / "blank.png"), np.full((300, 400, 3), 128, dtype=np.uint8))
+
+    report = scan_documents_batch([str(folder)], str(tmp_path / "out"), workers=1, use_threads=True)
+    assert report["processed"] == 1
+    assert [path.rsplit("/", 1)[1] for path, _ in report["low_confidence"]] == ["blank.png"]
+    assert not report["failed"]
+    assert cv2.imread(str(tmp_path / "out" / "page_scan.png")) is not None
+    assert not (tmp_path / "out" / "blank_scan.png").exists()
+
+
+def test_scan_profile_matches_four_point_transform(tmp_path):
+    image = cv2.GaussianBlur(np.random.default_rng(1).integers(0, 256, (1000, 1200, 3), dtype=np.uint8), (0, 0), 3)
+    # Corners in any order
+    profile = create_scan_profile(CORNERS[::-1])
+    expected = four_point_transform(image, CORNERS)
+
+    path = str(tmp_path / "profile.npz")
+    save_scan_profile(profile, path)
+    for profile in (profile, load_scan_profile(path)):
+        assert profile["size"] == expected.shape[1::-1]
+        warped = apply_scan_profile(image, profile)
+        # Both interpolate in fixed point, rounding apart by at most one level
+        assert np.abs(warped.astype(np.int16) - expected).max() <= 1
+
+    out = np.empty_like(expected)
+    assert apply_scan_profile(image, profile, out) is out
@@ -0,0 +1,105 @@
+"""Images are decoded once and their conversions shared by every operation; headers are
+probed without decoding and previews decoded at reduced size."""
+
+import threading
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+import pytest
+
+import src.image_io as image_io
+from src.canny_edge_detector import detect_edges_canny_from_array
+from src.color_extractor import extract_bright_colorful_colors_from_array
+from src.document_scanner import four_point_transform
+from src.image_io import LoadedImage, load_image, preview_factor, preview_image, probe_image
+from src.remove_shading import remove_shading_and_keep_colors_from_array
+from src.sobel_edge_detector import detect_edges_sobel_from_array
+
+CORNERS = np.array([[5, 4], [70, 8], [66, 50], [3, 44]], dtype=np.float32)
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = str(tmp_path / "image.png")
+    cv2.imwrite(path, np.random.default_rng(0).integers(0, 256, (56, 80, 3), dtype=np.uint8))
+    return path
+
+
+def _run_all(image):
+    # The deshade fit is unseeded and draws from NumPy's global generator
+    np.random.seed(0)
+    return [detect_edges_canny_from_array(image, 50, 150),
+            detect_edges_sobel_from_array(image)[2],
+            extract_bright_colorful_colors_from_array(image, 4, method="histogram"),
+            remove_shading_and_keep_colors_from_array(image, 4),
+            four_point_transform(image, CORNERS)]
+
+
+def test_operations_share_one_decode(image_path, monkeypatch):
+    decodes = Counter()
+    imread, convert = cv2.imread, image_io._convert
+    monkeypatch.setattr(cv2, "imread", lambda *args: decodes.update(["decode"]) or imread(*args))
+    monkeypatch.setattr(image_io, "_convert", lambda image, target: decodes.update([target]) or convert(image, target))
+
+    image = load_image(image_path)
+    results = _run_all(image)
+    assert decodes == {"decode": 1, "rgb": 1, "gray": 1}
+
+    # Same results as from a plain array
+    for result, expected in zip(results, _run_all(cv2.imread(image_path))):
+        assert np.array_equal(result, expected)
+
+
+def test_conversion_computed_once_across_threads():
+    calls = []
+
+    def convert():
+        calls.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    image = LoadedImage(np.zeros((4, 4, 3), dtype=np.uint8))
+    threads = [threading.Thread(target=image._cached, args=("name", convert)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    image.release("name")
+    assert image._cached("name", convert) == "value" and len(calls) == 2
+
+
+def test_unreadable_file(tmp_path):
+    path = tmp_path / "broken.png"
+    path.write_bytes(b"not an image")
+    assert load_image(str(path)) is None
+
+
+def test_probe_reads_header_only(tmp_path, monkeypatch):
+    path = str(tmp_path / "photo.jpg")
+    cv2.imwrite(path, np.zeros((1200, 1700, 3), dtype=np.uint8))
+    monkeypatch.setattr(cv2, "imread", lambda *args: pytest.fail("probe_image decoded the image"))
+
+    assert probe_image(path) == {"width": 1700, "height": 1200, "channels": 3, "format": "JPEG"}
+    (tmp_path / "broken.jpg").write_bytes(b"not an image")
+    assert probe_image(str(tmp_path / "broken.jpg")) is None
+
+
+@pytest.mark.parametrize("width, height, factor", [(640, 480, 1), (1700, 1200, 4), (12000, 9000, 8)])
+def test_preview_factor(width, height, factor):
+    assert preview_factor(width, height, max_dim=400) == factor
+
+
+def test_preview_decodes_at_reduced_size(tmp_path):
+    path = str(tmp_path / "photo.jpg")
+    image = cv2.resize(np.random.default_rng(0).integers(0, 256, (12, 17, 3), dtype=np.uint8), (1700, 1200))
+    cv2.imwrite(path, image)
+
+    preview = preview_image(path, max_dim=400)
+    assert preview.reduce == 4
+    assert preview.shape == (300, 425, 3)
+    # Close to a downscale of the full decode
+    full = cv2.resize(cv2.imread(path), (425, 300), interpolation=cv2.INTER_AREA)
+    assert np.abs(preview.bgr.astype(np.int16) - full).mean() < 3
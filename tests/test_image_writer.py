@@ -0,0 +1,66 @@
+"""Background writes give the same files as direct ones, with a bounded queue and errors surfaced."""
+
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+import src.image_writer as image_writer
+from src.image_writer import ImageWriter, configure, encode_image, write_image
+
+
+@pytest.fixture
+def images():
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (40, 50, 3), dtype=np.uint8) for _ in range(6)]
+
+
+@pytest.mark.parametrize("extension, settings", [(".png", {"png_compression": 6}), (".jpg", {"jpeg_quality": 80}),
+                                                 (".webp", {})])
+def test_writer_matches_direct_writes(images, tmp_path, extension, settings):
+    with ImageWriter(workers=3, max_pending=2, **settings) as writer:
+        futures = [writer.submit(str(tmp_path / f"bg{i}{extension}"), image) for i, image in enumerate(images)]
+        encoded = writer.encode(images[0], extension).result()
+    assert all(future.done() for future in futures)
+
+    for i, image in enumerate(images):
+        write_image(str(tmp_path / f"direct{i}{extension}"), image, **settings)
+        assert (tmp_path / f"bg{i}{extension}").read_bytes() == (tmp_path / f"direct{i}{extension}").read_bytes()
+    assert encoded == encode_image(images[0], extension, **settings)
+
+
+def test_submit_blocks_when_queue_is_full(images, tmp_path, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(image_writer, "write_image", lambda *args, **kwargs: release.wait())
+
+    writer = ImageWriter(workers=1, max_pending=2)
+    writer.submit("a.png", images[0])
+    writer.submit("b.png", images[1])
+    third = threading.Thread(target=writer.submit, args=("c.png", images[2]))
+    third.start()
+    third.join(0.2)
+    assert third.is_alive()
+
+    release.set()
+    third.join(5)
+    assert not third.is_alive()
+    writer.close()
+
+
+def test_errors_raised_by_flush(images, tmp_path):
+    writer = ImageWriter(workers=2)
+    ok = writer.submit(str(tmp_path / "ok.png"), images[0])
+    failed = writer.submit(str(tmp_path / "missing" / "bad.png"), images[1])
+    with pytest.raises(FileNotFoundError):
+        writer.flush()
+    assert ok.exception() is None and isinstance(failed.exception(), FileNotFoundError)
+    # The error is reported once
+    writer.close()
+    assert cv2.imread(str(tmp_path / "ok.png")) is not None
+
+
+@pytest.mark.parametrize("settings", [{"png_compression": 10}, {"jpeg_quality": -1}, {"webp_quality": 0}])
+def test_configure_rejects_out_of_range(settings):
+    with pytest.raises(ValueError):
+        configure(**settings)
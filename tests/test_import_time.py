@@ -0,0 +1,35 @@
+"""Every entry point must import within budget and without heavy dependencies it doesn't use."""
+
+import importlib.util
+import os
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds per scenario, the fastest of REPEAT fresh interpreters counts
+BUDGET = 0.5
+REPEAT = 3
+
+# benchmarks/ isn't a package, load the script by path
+_spec = importlib.util.spec_from_file_location("import_time", os.path.join(REPO_ROOT, "benchmarks", "import_time.py"))
+import_time = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(import_time)
+
+
+@pytest.fixture(scope="module", params=import_time.SCENARIOS, ids=[name for name, _, _ in import_time.SCENARIOS])
+def scenario(request):
+    name, modules, forbidden = request.param
+    seconds, loaded = min((import_time.measure(modules) for _ in range(REPEAT)), key=lambda run: run[0])
+    return seconds, loaded, forbidden
+
+
+def test_no_heavy_dependencies(scenario):
+    _, loaded, forbidden = scenario
+    leaked = sorted(module for module in forbidden
+                    if any(m == module or m.startswith(module + ".") for m in loaded))
+    assert not leaked
+
+
+def test_within_budget(scenario):
+    seconds, _, _ = scenario
+    assert seconds <= BUDGET
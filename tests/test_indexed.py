@@ -0,0 +1,56 @@
+"""Indexed output: label maps and palettes round-trip through PNG and .npy to the same BGR pixels."""
+
+import cv2
+import numpy as np
+import pytest
+
+from src.image_io import as_bgr, as_gray, expand_indexed, is_indexed, load_image, load_indexed
+from src.image_writer import ImageWriter, write_indexed
+from src.remove_shading import remove_shading_labels_from_array
+
+
+@pytest.fixture(scope="module")
+def indexed():
+    """Labels and palette of a deshaded image with a few colors"""
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 60, (50, 70, 3), dtype=np.uint8)
+    image[5:25, 5:40] = (230, 200, 180)
+    image[30:45, 10:50] = (180, 240, 250)
+    image[10:45, 55:65] = (250, 190, 240)
+    return remove_shading_labels_from_array(image, 3, fit_masked_only=True)
+
+
+@pytest.mark.parametrize("extension", [".png", ".npy"])
+def test_round_trip(indexed, tmp_path, extension):
+    labels, palette = indexed
+    path = str(tmp_path / f"flat{extension}")
+    with ImageWriter() as writer:
+        write_indexed(path, labels, palette, writer)
+
+    loaded_labels, loaded_palette = load_indexed(path)
+    expected = expand_indexed(labels, palette)
+    assert np.array_equal(expand_indexed(loaded_labels, loaded_palette), expected)
+    # Any reader sees the full-color image
+    assert np.array_equal(as_bgr(path), expected)
+    assert np.array_equal(load_image(path).bgr, expected)
+    assert is_indexed(path) == (extension == ".npy")
+
+
+def test_png_is_palettized_and_smaller(indexed, tmp_path):
+    labels, palette = indexed
+    write_indexed(str(tmp_path / "flat.png"), labels, palette)
+    cv2.imwrite(str(tmp_path / "full.png"), expand_indexed(labels, palette))
+    assert (tmp_path / "flat.png").stat().st_size < (tmp_path / "full.png").stat().st_size
+    assert np.array_equal(cv2.imread(str(tmp_path / "flat.png")), expand_indexed(labels, palette))
+
+
+def test_label_map_grayscale_matches_expanded(indexed, tmp_path):
+    labels, palette = indexed
+    path = str(tmp_path / "flat.npy")
+    write_indexed(path, labels, palette)
+    assert np.array_equal(as_gray(path), cv2.cvtColor(expand_indexed(labels, palette), cv2.COLOR_BGR2GRAY))
+
+
+def test_unsupported_extension(indexed, tmp_path):
+    with pytest.raises(ValueError):
+        write_indexed(str(tmp_path / "flat.jpg"), *indexed)
@@ -0,0 +1,67 @@
+"""Stage instrumentation: off by default, nested records per operation, hooks and JSON logs."""
+
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from src import instrument
+from src.canny_edge_detector import detect_edges_canny
+
+
+@pytest.fixture(autouse=True)
+def disabled():
+    yield
+    instrument.disable()
+
+
+def test_nothing_recorded_by_default():
+    records = []
+    instrument.add_hook(records.append)
+    with instrument.stage("decode"):
+        pass
+    assert not instrument.is_enabled() and records == []
+
+
+def test_operation_stages(tmp_path):
+    path = str(tmp_path / "image.png")
+    cv2.imwrite(path, np.zeros((40, 60, 3), dtype=np.uint8))
+    with instrument.collect() as records:
+        detect_edges_canny(path, str(tmp_path / "edges.png"))
+
+    # Inner stages finish first; the path wrapper adds one top-level stage
+    assert [record["stage"] for record in records] == ["canny/decode", "canny/edges", "canny/encode",
+                                                       "canny/write", "canny"]
+    assert all(record["operation"] == "canny" for record in records)
+    assert records[-1]["wall_s"] >= sum(record["wall_s"] for record in records[:-1])
+    assert not instrument.is_enabled()
+
+
+def test_errors_and_fields_recorded():
+    with instrument.collect() as records:
+        with pytest.raises(ValueError):
+            with instrument.stage("outer", operation="job", input="a.png"):
+                with instrument.stage("inner"):
+                    raise ValueError("bad input")
+    assert [record["stage"] for record in records] == ["outer/inner", "outer"]
+    assert records[0]["operation"] == "job" and records[1]["input"] == "a.png"
+    assert all(record["error"] == "ValueError: bad input" for record in records)
+
+
+def test_tracemalloc_peak_and_json_log(tmp_path):
+    log = tmp_path / "stages.jsonl"
+    instrument.enable(memory="tracemalloc", log=str(log))
+    with instrument.stage("allocate"):
+        buffer = np.ones(1 << 20)
+        del buffer
+    instrument.disable()
+
+    record, = [json.loads(line) for line in log.read_text().splitlines()]
+    assert record["stage"] == "allocate"
+    assert record["mem_peak_bytes"] >= 8 << 20
+
+
+def test_unknown_memory_mode():
+    with pytest.raises(ValueError):
+        instrument.enable(memory="heap")
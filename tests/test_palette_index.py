@@ -0,0 +1,84 @@
+"""Palette index: queries rank by palette distance, and rows survive replace, remove, compact and reopen."""
+
+import cv2
+import numpy as np
+import pytest
+
+from src.palette_index import PaletteIndex, index_images
+
+
+def _distance(target, palette, symmetric=True):
+    """Reference palette distance, computed directly"""
+    target = np.asarray(target, dtype=np.float64).reshape((-1, 3))
+    palette = np.asarray(palette, dtype=np.float64)
+    d = np.linalg.norm(palette[:, None] - target[None], axis=2)
+    forward = d.min(axis=0).mean()
+    if not symmetric or len(target) == 1:
+        return forward
+    return (forward + d.min(axis=1).mean()) / 2
+
+
+@pytest.fixture
+def palettes():
+    rng = np.random.default_rng(0)
+    return {f"img{i}.png": rng.integers(0, 256, (rng.integers(1, 9), 3)).tolist() for i in range(50)}
+
+
+@pytest.fixture
+def index(tmp_path, palettes):
+    index = PaletteIndex(str(tmp_path / "index"), num_colors=8)
+    index.add_many(palettes.items())
+    return index
+
+
+@pytest.mark.parametrize("target", [[200, 40, 40], [[200, 40, 40], [10, 10, 10], [90, 200, 250]]])
+@pytest.mark.parametrize("symmetric", [True, False])
+def test_distances_match_reference(index, palettes, target, symmetric):
+    distances = index.distances(target, symmetric, chunk_rows=7)
+    expected = [_distance(target, palettes[path], symmetric) for path in index.paths]
+    assert np.allclose(distances, expected, rtol=1e-4, atol=1e-3)
+
+    results = index.query(target, k=5, symmetric=symmetric)
+    assert [path for path, _ in results] == [index.paths[row] for row in np.argsort(expected, kind="stable")[:5]]
+
+
+def test_replace_remove_compact_and_reopen(index, palettes, tmp_path):
+    index.add("img3.png", [[1, 2, 3]])
+    assert index.remove("img4.png", "missing.png") == 1
+    assert len(index) == 49 and "img4.png" not in index
+    assert index.query([1, 2, 3], k=1) == [("img3.png", 0.0)]
+
+    index.compact()
+    assert index.rows == 49
+    reopened = PaletteIndex(str(tmp_path / "index"), num_colors=3)
+    assert reopened.num_colors == 8 and len(reopened) == 49
+    assert reopened.palette("img3.png") == [[1, 2, 3]]
+    assert reopened.palette("img5.png") == palettes["img5.png"]
+    assert np.array_equal(reopened.distances([9, 9, 9]), index.distances([9, 9, 9]))
+
+
+def test_half_written_append_dropped(index, tmp_path):
+    # An append interrupted after the colors but before the paths
+    with open(tmp_path / "index" / "colors.u8", "ab") as f:
+        f.write(bytes(8 * 3 * 2))
+    reopened = PaletteIndex(str(tmp_path / "index"))
+    assert reopened.rows == 50
+    reopened.add("new.png", [[5, 5, 5]])
+    assert PaletteIndex(str(tmp_path / "index")).palette("new.png") == [[5, 5, 5]]
+
+
+def test_index_images(tmp_path):
+    paths = []
+    for i, color in enumerate([(0, 0, 255), (0, 255, 0), (255, 0, 0)]):
+        paths.append(str(tmp_path / f"{i}.png"))
+        cv2.imwrite(paths[-1], np.full((20, 30, 3), color, dtype=np.uint8))
+    (tmp_path / "broken.png").write_bytes(b"not an image")
+
+    index = PaletteIndex(str(tmp_path / "index"), num_colors=2)
+    added, failed = index_images(index, paths + [str(tmp_path / "broken.png")], workers=2, use_threads=True,
+                                 batch_rows=1)
+    assert added == 3 and [path for path, _ in failed] == [str(tmp_path / "broken.png")]
+    # Pure red (RGB) is the first image, written in BGR
+    assert index.query([255, 0, 0], k=1)[0][0] == paths[0]
+    # Already indexed images are skipped
+    assert index_images(index, paths, use_threads=True) == (0, [])
@@ -0,0 +1,84 @@
+"""Pipelines chain operations in memory, share conversions between steps and reject invalid DAGs."""
+
+import json
+from collections import Counter
+
+import cv2
+import numpy as np
+import pytest
+
+import src.image_io as image_io
+from src.canny_edge_detector import detect_edges_canny_from_array
+from src.color_extractor import extract_bright_colorful_colors_from_array
+from src.document_scanner import four_point_transform
+from src.pipeline import Pipeline
+from src.sobel_edge_detector import detect_edges_sobel_from_array
+
+CORNERS = [[10, 8], [110, 12], [104, 80], [6, 74]]
+
+SPEC = {"steps": [
+    {"name": "page", "op": "scan", "params": {"corners": CORNERS}},
+    {"name": "edges", "op": "canny", "input": "page", "params": {"low_threshold": 40, "high_threshold": 120},
+     "output": "{stem}_edges.png"},
+    {"name": "contours", "op": "canny", "input": "page"},
+    {"name": "sobel", "op": "sobel", "input": "page"},
+    {"name": "colors", "op": "colors", "input": "page", "params": {"num_colors": 4, "method": "histogram"}},
+]}
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    noise = np.random.default_rng(0).uniform(0, 255, (90, 120, 3)).astype(np.float32)
+    path = str(tmp_path / "capture.png")
+    cv2.imwrite(path, cv2.GaussianBlur(noise, (0, 0), 2).astype(np.uint8))
+    return path
+
+
+def test_results_match_separate_calls(image_path, tmp_path):
+    results = Pipeline.from_spec(SPEC, workers=3).run(image_path, str(tmp_path / "out"))
+
+    page = four_point_transform(cv2.imread(image_path), np.array(CORNERS, dtype=np.float32))
+    assert results["edges"] == str(tmp_path / "out" / "capture_edges.png")
+    assert np.array_equal(cv2.imread(results["edges"], cv2.IMREAD_GRAYSCALE),
+                          detect_edges_canny_from_array(page, 40, 120))
+    assert np.array_equal(results["contours"], detect_edges_canny_from_array(page))
+    assert np.array_equal(results["sobel"], detect_edges_sobel_from_array(page)[2])
+    assert results["colors"] == extract_bright_colorful_colors_from_array(page, 4, method="histogram")
+    # Intermediate steps read by others aren't returned
+    assert "page" not in results
+
+
+def test_conversions_computed_once(image_path, tmp_path, monkeypatch):
+    conversions = Counter()
+    convert = image_io._convert
+    monkeypatch.setattr(image_io, "_convert",
+                        lambda image, target: conversions.update([target]) or convert(image, target))
+    Pipeline.from_spec(SPEC, workers=3).run(image_path, str(tmp_path / "out"))
+    # Both Canny steps share the page's grayscale
+    assert conversions == {"gray": 1, "rgb": 1}
+
+
+def test_spec_file(image_path, tmp_path):
+    spec_path = tmp_path / "job.json"
+    spec_path.write_text(json.dumps(SPEC))
+    assert set(Pipeline.from_spec(str(spec_path)).run(image_path, str(tmp_path / "out"))) == {
+        "edges", "contours", "sobel", "colors"}
+
+
+@pytest.mark.parametrize("steps, message", [
+    ([{"name": "a", "op": "canny"}, {"name": "a", "op": "sobel"}], "duplicate step name"),
+    ([{"name": "input", "op": "canny"}], "duplicate step name"),
+    ([{"name": "a", "op": "blur"}], "unknown operation"),
+    ([{"name": "a", "op": "canny", "input": "b"}], "unknown step"),
+    ([{"name": "a", "op": "colors"}, {"name": "b", "op": "canny", "input": "a"}], "doesn't produce an image"),
+    ([{"name": "a", "op": "canny", "input": "b"}, {"name": "b", "op": "sobel", "input": "a"}], "cycle"),
+])
+def test_invalid_specs(steps, message):
+    with pytest.raises(ValueError, match=message):
+        Pipeline(steps)
+
+
+def test_failed_step_raises():
+    pipeline = Pipeline([{"name": "page", "op": "scan"}, {"name": "edges", "op": "canny", "input": "page"}])
+    with pytest.raises(ValueError, match="no document found"):
+        pipeline.run(np.full((60, 80, 3), 128, dtype=np.uint8))
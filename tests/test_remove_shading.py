@@ -0,0 +1,55 @@
+"""Shading removal fitted on the bright pixels only, with labels assigned in chunks."""
+
+import numpy as np
+import pytest
+
+from src.image_writer import write_indexed
+from src.remove_shading import (MAX_COLORS, assign_labels, remove_shading_and_keep_colors,
+                                remove_shading_labels_from_array)
+
+BRIGHTNESS = 150
+
+
+@pytest.fixture
+def image():
+    """BGR image: three bright colors on a dark, noisy background"""
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 60, (60, 90, 3), dtype=np.uint8)
+    image[5:25, 5:40] = (230, 200, 180)
+    image[30:55, 10:50] = (180, 240, 250)
+    image[10:50, 60:85] = (250, 190, 240)
+    return image
+
+
+def test_masked_fit_keeps_dark_pixels_black(image):
+    labels, palette = remove_shading_labels_from_array(image, 3, BRIGHTNESS, fit_masked_only=True)
+    # Three fitted colors, then black for the masked-out pixels
+    assert len(palette) == 4 and palette[-1].tolist() == [0, 0, 0]
+    dark = image.mean(axis=2) <= BRIGHTNESS
+    assert (labels[dark] == 3).all()
+    # Every bright region gets its own color (RGB, truncated to uint8)
+    expected = np.array(sorted([[180, 200, 230], [250, 240, 180], [240, 190, 250]]))
+    assert np.abs(np.array(sorted(palette[:3].tolist())) - expected).max() <= 1
+
+
+def test_chunked_assignment_matches_one_pass(image):
+    pixels = image.reshape((-1, 3))
+    centers = np.random.default_rng(1).uniform(0, 255, (5, 3))
+    assert (assign_labels(pixels, centers, chunk_pixels=7) == assign_labels(pixels, centers, len(pixels))).all()
+
+
+@pytest.mark.parametrize("num_colors", [0, MAX_COLORS + 1, 256])
+def test_num_colors_out_of_range(image, tmp_path, num_colors):
+    with pytest.raises(ValueError):
+        remove_shading_labels_from_array(image, num_colors, fit_masked_only=True)
+    with pytest.raises(ValueError):
+        remove_shading_and_keep_colors(str(tmp_path / "missing.png"), str(tmp_path / "out.png"), num_colors)
+
+
+@pytest.mark.parametrize("extension", [".png", ".npy"])
+def test_write_indexed_rejects_labels_past_uint8(tmp_path, extension):
+    labels = np.full((4, 4), 256, dtype=np.int32)
+    with pytest.raises(ValueError):
+        write_indexed(str(tmp_path / f"labels{extension}"), labels, np.zeros((257, 3)))
+    with pytest.raises(ValueError):
+        write_indexed(str(tmp_path / f"labels{extension}"), labels, np.zeros((256, 3)))
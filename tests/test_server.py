@@ -0,0 +1,59 @@
+"""The processing server runs concurrent requests in parallel and survives worker crashes."""
+
+import asyncio
+import os
+import signal
+
+import cv2
+import numpy as np
+
+from src.server import ProcessingServer
+
+# Seconds before a hung server fails the test
+TIMEOUT = 60
+
+
+def _png(seed=0):
+    image = np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def _run(workers, requests, before=None):
+    """Start a server, send requests concurrently, return (results, counts)"""
+    async def run():
+        server = ProcessingServer(workers=workers)
+        listener = await server.start(port=0)
+        try:
+            if before is not None:
+                await before(server)
+            results = await asyncio.gather(*(server.process("sobel", _png(i), {}) for i in range(requests)))
+            return results, dict(server.counts)
+        finally:
+            listener.close()
+            await server.stop()
+
+    return asyncio.run(asyncio.wait_for(run(), TIMEOUT))
+
+
+def test_concurrent_requests_use_every_worker():
+    results, counts = _run(workers=4, requests=4)
+    assert [status for status, _, _ in results] == [200] * 4
+    assert counts["batches"] == 4
+
+
+def test_backlog_is_shared_among_workers():
+    results, counts = _run(workers=2, requests=8)
+    assert [status for status, _, _ in results] == [200] * 8
+    assert counts["batches"] == 2
+
+
+def test_pool_restarted_after_worker_dies():
+    async def kill_worker(server):
+        os.kill(next(iter(server.executor._processes)), signal.SIGKILL)
+        # Let the pool notice the dead worker
+        while not server.executor._broken:
+            await asyncio.sleep(0.01)
+
+    results, counts = _run(workers=2, requests=2, before=kill_worker)
+    assert [status for status, _, _ in results] == [200] * 2
+    assert counts["pool_restarts"] == 1
@@ -0,0 +1,68 @@
+"""A fitted shading palette is reusable: saved, applied without k-means and updated from new frames."""
+
+import numpy as np
+import pytest
+
+from src.remove_shading import (apply_shading_palette, apply_shading_palette_labels, assign_labels,
+                                fit_shading_palette, load_palette, save_palette, update_shading_palette)
+
+BRIGHTNESS = 150
+COLORS = [(230, 200, 180), (180, 240, 250), (250, 190, 240)]
+
+
+def _frame(shift=0, seed=0):
+    """BGR frame: three bright colors (moved by shift) on a dark, noisy background"""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 60, (60, 90, 3), dtype=np.uint8)
+    for (rows, cols), color in zip([(slice(5, 25), slice(5, 40)), (slice(30, 55), slice(10, 50)),
+                                    (slice(10, 50), slice(60, 85))], COLORS):
+        frame[rows, cols] = np.array(color) - shift
+    return frame
+
+
+@pytest.fixture(scope="module")
+def palette():
+    return fit_shading_palette(_frame(), num_colors=3, brightness_threshold=BRIGHTNESS)
+
+
+def test_fit_is_deterministic(palette):
+    again = fit_shading_palette(_frame(), num_colors=3, brightness_threshold=BRIGHTNESS)
+    assert np.array_equal(again["centers"], palette["centers"])
+    assert palette["counts"].sum() == (_frame().mean(axis=2) > BRIGHTNESS).sum()
+
+
+def test_save_and_load_round_trip(palette, tmp_path):
+    path = str(tmp_path / "palette.npz")
+    save_palette(palette, path)
+    loaded = load_palette(path)
+    assert np.array_equal(loaded["centers"], palette["centers"])
+    assert np.array_equal(loaded["counts"], palette["counts"])
+    assert loaded["brightness_threshold"] == BRIGHTNESS
+
+
+def test_apply_maps_to_nearest_center(palette):
+    frame = _frame(seed=1)
+    labels, colors = apply_shading_palette_labels(frame, palette)
+    bright = frame.mean(axis=2) > BRIGHTNESS
+    rgb = frame[..., ::-1].reshape((-1, 3))
+    expected = assign_labels(rgb[bright.reshape(-1)], palette["centers"])
+    assert (labels[bright] == expected).all()
+    assert (labels[~bright] == len(palette["centers"])).all()
+    assert colors[-1].tolist() == [0, 0, 0]
+
+    segmented = apply_shading_palette(frame, palette)
+    assert (segmented[~bright] == 0).all()
+    assert (segmented[..., ::-1] == colors[labels]).all()
+
+
+def test_update_follows_new_frames(palette):
+    updated = update_shading_palette(palette, _frame(shift=20), decay=0.0)
+    # With the old counts forgotten, each center moves onto the new colors
+    expected = sorted((np.array(color)[::-1] - 20).tolist() for color in COLORS)
+    assert np.allclose(sorted(updated["centers"].tolist()), expected)
+    assert np.array_equal(palette["centers"], fit_shading_palette(_frame(), 3, BRIGHTNESS)["centers"])
+
+    halfway = update_shading_palette(palette, _frame(shift=20))
+    # Equal counts: the running mean lands halfway
+    assert np.allclose(sorted(halfway["centers"].tolist()), [[c + 10 for c in color] for color in expected])
+    assert np.array_equal(halfway["counts"], 2 * palette["counts"])
@@ -0,0 +1,64 @@
+"""Every Sobel backend must match the pure-Python reference."""
+
+import numpy as np
+import pytest
+
+from src.sobel_backends import (ACCUMULATORS, BACKENDS, KERNEL_SIZES, check_options, sobel_edges,
+                                synthetic_image)
+from src.sobel_edge_detector import normalize_edges
+
+# Maximum gradient magnitude error, relative to the largest magnitude
+RTOL = 1e-5
+# Maximum difference of the normalized edges, in gray levels (float rounding
+# can move a value across an integer boundary)
+TOLERANCE = 1
+
+FAST_BACKENDS = [name for name in BACKENDS if name != "python"]
+SUPPORTED = [(ksize, accumulator) for ksize in KERNEL_SIZES for accumulator in ACCUMULATORS
+             if not (accumulator == "int16" and ksize == 7)]
+
+
+@pytest.fixture(scope="module")
+def gray():
+    # Small, the reference is slow
+    return synthetic_image((40, 56))
+
+
+@pytest.fixture(scope="module")
+def reference(gray):
+    """Reference blur and gradients, computed once per kernel size and accumulator"""
+    backend = BACKENDS["python"]
+    blurred = backend.blur(gray)
+    return blurred, {options: backend.gradient(blurred, *options) for options in SUPPORTED}
+
+
+@pytest.mark.parametrize("name", FAST_BACKENDS)
+def test_blur_matches_reference(name, gray, reference):
+    assert np.array_equal(BACKENDS[name].blur(gray), reference[0])
+
+
+@pytest.mark.parametrize("ksize,accumulator", SUPPORTED)
+@pytest.mark.parametrize("name", FAST_BACKENDS)
+def test_gradient_matches_reference(name, ksize, accumulator, gray, reference):
+    backend = BACKENDS[name]
+    expected = reference[1][(ksize, accumulator)]
+    magnitudes = backend.gradient(backend.blur(gray), ksize, accumulator)
+
+    scale = max(float(expected.max()), 1.0)
+    assert np.abs(magnitudes - expected).max() / scale <= RTOL
+
+    edges = normalize_edges(magnitudes, magnitudes.min(), magnitudes.max())
+    expected_edges = normalize_edges(expected, expected.min(), expected.max())
+    assert np.abs(edges.astype(np.int16) - expected_edges).max() <= TOLERANCE
+
+
+@pytest.mark.parametrize("ksize", KERNEL_SIZES)
+def test_numpy_float64_is_exact(ksize, gray, reference):
+    _, edges = sobel_edges(gray, "numpy", ksize, "float64")
+    expected = reference[1][(ksize, "float64")]
+    assert np.array_equal(edges, normalize_edges(expected, expected.min(), expected.max()))
+
+
+def test_int16_rejected_for_7x7():
+    with pytest.raises(ValueError):
+        check_options(7, "int16")
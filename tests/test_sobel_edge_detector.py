@@ -0,0 +1,88 @@
+"""
+Sobel output of each engine, pinned on a small image.
+
+The legacy engine and image_to_blur must keep the original in-place
+results. The numpy and python engines compute the plain filter from the
+unmodified image, which changes every pixel of this image.
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.sobel_edge_detector import (array_from_image, detect_edges_sobel, image_to_blur, image_to_box_blur,
+                                     image_to_gray)
+
+# RGB, 6 x 8
+IMAGE = [
+    [[139, 74, 229], [241, 169, 65], [6, 160, 149], [106, 38, 175], [188, 205, 175], [229, 98, 249], [10, 148, 95], [86, 147, 198]],
+    [[66, 39, 106], [213, 171, 45], [167, 57, 69], [81, 55, 14], [153, 178, 215], [76, 52, 39], [250, 72, 215], [50, 161, 223]],
+    [[112, 172, 161], [233, 38, 17], [89, 1, 221], [6, 242, 127], [143, 6, 60], [210, 94, 25], [166, 33, 249], [189, 12, 204]],
+    [[33, 57, 124], [30, 199, 149], [202, 119, 72], [220, 3, 209], [122, 136, 147], [77, 133, 82], [115, 87, 162], [230, 70, 71]],
+    [[240, 62, 47], [184, 31, 34], [63, 65, 146], [197, 142, 253], [81, 133, 240], [113, 30, 247], [103, 122, 31], [19, 42, 129]],
+    [[141, 136, 33], [149, 161, 0], [178, 141, 107], [35, 107, 130], [72, 27, 217], [254, 99, 13], [195, 206, 59], [228, 235, 202]],
+]
+
+# Output of the original detect_edges_sobel, before the numpy engine
+LEGACY_EDGES = [
+    [78, 74, 72, 81, 88, 96, 78, 186],
+    [4, 116, 73, 75, 67, 80, 26, 141],
+    [57, 117, 66, 114, 104, 104, 57, 119],
+    [54, 81, 77, 85, 35, 63, 41, 118],
+    [10, 110, 19, 75, 47, 88, 15, 79],
+    [100, 117, 118, 102, 120, 119, 110, 136],
+]
+
+# Output of the numpy and python engines
+EDGES = [
+    [95, 90, 62, 56, 70, 87, 106, 248],
+    [44, 36, 0, 11, 36, 42, 74, 255],
+    [53, 14, 14, 19, 8, 22, 71, 236],
+    [46, 13, 33, 28, 28, 11, 67, 225],
+    [66, 69, 85, 77, 72, 62, 80, 214],
+    [199, 214, 233, 247, 245, 238, 221, 198],
+]
+
+# Original image_to_blur of the grayscale image, rounded
+LEGACY_BLUR = [
+    [136.889, 117.543, 105.949, 118.55, 122.617, 132.735, 137.082, 108.565],
+    [122.111, 118.832, 103.542, 108.851, 113.639, 118.564, 134.772, 89.824],
+    [114.419, 109.545, 118.863, 116.544, 112.4, 121.153, 121.035, 80.515],
+    [98.498, 109.814, 122.307, 132.013, 132.457, 119.005, 107.079, 64.403],
+    [106.857, 106.608, 121.527, 132.589, 123.785, 119.703, 117.132, 80.624],
+    [80.121, 73.346, 74.008, 71.879, 74.995, 78.957, 85.602, 56.04],
+]
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = str(tmp_path / "image.png")
+    Image.fromarray(np.array(IMAGE, dtype=np.uint8)).save(path)
+    return path
+
+
+def test_legacy_engine_reproduces_original_output(image_path):
+    assert detect_edges_sobel(image_path, None, engine="legacy").tolist() == LEGACY_EDGES
+
+
+@pytest.mark.parametrize("engine", ["numpy", "python"])
+def test_engine_output(image_path, engine):
+    assert detect_edges_sobel(image_path, None, engine=engine).tolist() == EDGES
+
+
+def test_every_pixel_changed():
+    assert (np.array(EDGES) != np.array(LEGACY_EDGES)).all()
+
+
+def test_image_to_blur_blurs_in_place(image_path):
+    blurred = image_to_blur(image_to_gray(array_from_image(image_path)))
+    assert [[pixel[0] for pixel in row] for row in blurred] == [pytest.approx(row, abs=1e-3) for row in LEGACY_BLUR]
+
+
+def test_box_blur_reads_unblurred_neighbours(image_path):
+    gray = image_to_gray(array_from_image(image_path))
+    values = np.array([[pixel[0] for pixel in row] for row in gray], dtype=np.float64)
+    blurred = np.array([[pixel[0] for pixel in row] for row in image_to_box_blur(gray)])
+    # An interior pixel is the mean of its original 3x3 neighbourhood
+    assert blurred[2, 3] == pytest.approx(values[1:4, 2:5].mean())
+    assert blurred[2, 3] != pytest.approx(LEGACY_BLUR[2][3], abs=1e-3)
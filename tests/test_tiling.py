@@ -0,0 +1,50 @@
+"""Tiled Canny and Sobel give the same edges as the whole-image detectors."""
+
+import cv2
+import numpy as np
+import pytest
+
+from src.canny_edge_detector import detect_edges_canny_tiled
+from src.sobel_edge_detector import detect_edges_sobel, detect_edges_sobel_tiled
+
+
+@pytest.fixture(scope="module")
+def image():
+    """BGR image with smooth blobs, so edge chains cross many band seams"""
+    noise = np.random.default_rng(0).uniform(0, 255, (157, 203, 3)).astype(np.float32)
+    blurred = cv2.GaussianBlur(noise, (0, 0), 4)
+    return cv2.normalize(blurred, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+
+@pytest.fixture(params=[".png", ".npy"])
+def image_path(request, image, tmp_path):
+    path = str(tmp_path / f"image{request.param}")
+    if request.param == ".npy":
+        # Memory-mapped input, BGR like the decoded formats
+        np.save(path, image)
+    else:
+        cv2.imwrite(path, image)
+    return path
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("thresholds", [(5, 20), (20, 60)])
+def test_tiled_canny_matches_canny(image_path, tmp_path, workers, thresholds):
+    # Compare on the grayscale the tiled mode reads (a PNG decoder's
+    # grayscale differs slightly from cv2.cvtColor's)
+    if image_path.endswith(".npy"):
+        gray = cv2.cvtColor(np.load(image_path), cv2.COLOR_BGR2GRAY)
+    else:
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    expected = cv2.Canny(gray, *thresholds)
+    edges = detect_edges_canny_tiled(image_path, str(tmp_path / "edges.npy"), *thresholds, band_rows=16,
+                                     workers=workers)
+    assert expected.any()
+    assert (np.asarray(edges) == expected).all()
+
+
+@pytest.mark.parametrize("band_rows", [1, 16, 1000])
+def test_tiled_sobel_matches_sobel(image_path, tmp_path, band_rows):
+    expected = detect_edges_sobel(image_path if image_path.endswith(".png") else np.load(image_path), None)
+    edges = detect_edges_sobel_tiled(image_path, str(tmp_path / "edges.npy"), band_rows=band_rows, workers=2)
+    assert (np.asarray(edges) == expected).all()
@@ -0,0 +1,72 @@
+"""Video frames are processed in parallel and written in order, and realtime mode drops late frames."""
+
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import src.video as video
+from src.video import process_video
+
+FRAMES = 24
+SIZE = (96, 64)
+
+
+def _read(path):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+@pytest.fixture
+def clip(tmp_path):
+    """A white square moving right by 3 pixels per frame"""
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 100, SIZE)
+    for i in range(FRAMES):
+        frame = np.zeros((SIZE[1], SIZE[0], 3), dtype=np.uint8)
+        frame[20:44, 3 * i:3 * i + 20] = 255
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def _left_edge(frame):
+    """Column of the leftmost edge pixel"""
+    return int(np.nonzero(frame.max(axis=(0, 2)) > 128)[0][0])
+
+
+def test_frames_written_in_order(clip, tmp_path):
+    output = str(tmp_path / "edges.avi")
+    stats = process_video(clip, output, "canny", workers=4, queue_size=3, fourcc="MJPG")
+    assert stats["frames"] == stats["processed"] == FRAMES and stats["skipped"] == 0
+
+    frames = _read(output)
+    assert len(frames) == FRAMES
+    expected = [cv2.Canny(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), 100, 200)[..., None] for frame in _read(clip)]
+    assert [_left_edge(frame) for frame in frames] == [_left_edge(edges) for edges in expected]
+
+
+def test_realtime_repeats_dropped_frames(clip, tmp_path, monkeypatch):
+    def slow(operation, first_frame, *args):
+        # Ten times slower than the clip's 100 fps
+        return lambda frame: time.sleep(0.1) or frame
+    monkeypatch.setattr(video, "frame_function", slow)
+
+    output = str(tmp_path / "realtime.avi")
+    stats = process_video(clip, output, workers=1, queue_size=1, realtime=True, max_lag=0.0, fourcc="MJPG")
+    assert stats["skipped"] > 0
+    assert stats["frames"] == stats["processed"] + stats["skipped"] == FRAMES
+
+    frames = _read(output)
+    assert len(frames) == FRAMES
+    # Only the processed frames are distinct, the dropped ones repeat them
+    distinct = 1 + sum(not np.array_equal(a, b) for a, b in zip(frames, frames[1:]))
+    assert distinct == stats["processed"]